@@ -112,7 +112,7 @@ class engine(cengine):
 				record = response['value']
 
 				# Emit an event log
-				referer_event = self.storage.find_one(mfilter={'rk': rk}, namespace='events')
+				referer_event = self.storage.find_one(mfilter={'rk': rk}, namespace='events', view=True)
 				if referer_event:
 					referer_event = referer_event.dump()
 
@@ -67,21 +67,28 @@ class engine(cengine):
 
 
 	def conditions(self, event, derogation):
-		conditions_json = derogation.get('conditions', None)
+		# Conditions are parsed and compiled once per derogation
+		if 'conditions_check' not in derogation:
+			conditions_json = derogation.get('conditions', None)
 
-		try:
-			conditions = json.loads(conditions_json)
+			try:
+				conditions = json.loads(conditions_json)
 
-		except ValueError:
-			self.logger.error("Invalid conditions field in '%s': %s" % (derogation['_id'], conditions_json))
-			self.logger.debug(derogation)
+			except ValueError:
+				self.logger.error("Invalid conditions field in '%s': %s" % (derogation['_id'], conditions_json))
+				self.logger.debug(derogation)
 
-			return False
+				return False
+
+			derogation['conditions_check'] = None
+
+			if conditions:
+				derogation['conditions_check'] = cmfilter.compile(conditions)
 
-		if conditions:
-			check = cmfilter.check(conditions, event)
+		if derogation['conditions_check']:
+			check = derogation['conditions_check'](event)
 
-			self.logger.debug(" + 'conditions' check is %s" % check)
+			self.logger.debug(" + 'conditions' check is %s", check)
 
 			return check
 
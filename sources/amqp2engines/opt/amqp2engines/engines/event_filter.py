@@ -28,6 +28,55 @@ import cmfilter
 import ast
 
 
+# Fields used to index rules, from the most to the least selective
+INDEXED_FIELDS = ['resource', 'component', 'connector_name', 'connector', 'event_type']
+
+
+class RulesIndex(object):
+	"""
+		Index rules on their equality constraints, so an event is only
+		checked against rules it can match. Candidates are returned in
+		rules order, to keep first-match priority.
+	"""
+
+	def __init__(self, rules):
+		self.buckets = dict([(field, {}) for field in INDEXED_FIELDS])
+		self.unindexed = []
+
+		for position, rule in enumerate(rules):
+			constraints = cmfilter.equality_constraints(rule['mfilter'], INDEXED_FIELDS)
+
+			for field in INDEXED_FIELDS:
+				if field in constraints:
+					try:
+						self.buckets[field].setdefault(constraints[field], []).append(position)
+						break
+
+					except TypeError:
+						# Unhashable value
+						pass
+
+			else:
+				self.unindexed.append(position)
+
+		# Don't look up fields without rules
+		self.buckets = dict([(field, bucket) for field, bucket in self.buckets.items() if bucket])
+
+	def get_candidates(self, event):
+		candidates = list(self.unindexed)
+
+		for field, bucket in self.buckets.items():
+			try:
+				candidates += bucket.get(event.get(field, None), [])
+
+			except TypeError:
+				pass
+
+		candidates.sort()
+
+		return candidates
+
+
 class engine(cengine):
 	etype = 'event_filter'
 
@@ -37,6 +86,9 @@ class engine(cengine):
 		account = caccount(user="root", group="root")
 		self.storage = get_storage(logging_level=self.logging_level, account=account)
 
+		self.candidate_count = 0
+		self.event_count = 0
+
 	def pre_run(self):
 		self.drop_event_count = 0
 		self.pass_event_count = 0
@@ -49,22 +101,41 @@ class engine(cengine):
 
 		default_action = self.configuration.get('default_action', 'pass')
 
+		rules = self.configuration.get('rules', [])
+
+		# Index is built on beat
+		index = self.configuration.get('index', None)
+
+		if not index:
+			index = self.configuration['index'] = RulesIndex(rules)
+
+		candidates = index.get_candidates(event)
+
+		self.candidate_count += len(candidates)
+		self.event_count += 1
+
 		#When list configuration then check black and white lists depending on json configuration
-		for filterItem in self.configuration.get('rules', []):
+		for position in candidates:
+			filterItem = rules[position]
 
 			action = filterItem.get('action')
 
 			name = filterItem.get('name', 'no_name')
 
-			# Try filter rules on current event
-			if cmfilter.check(filterItem['mfilter'], event):
+			# Try filter rules on current event (compiled on beat)
+			check = filterItem.get('check', None)
+
+			if not check:
+				check = filterItem['check'] = cmfilter.compile(filterItem['mfilter'])
+
+			if check(event):
 				if action == 'pass':
-					self.logger.debug("Event passed by rule '%s'" % name)
+					self.logger.debug("Event passed by rule '%s'", name)
 					self.pass_event_count += 1
 					return event
 
 				elif action == 'drop':
-					self.logger.debug("Event dropped by rule '%s'" % name)
+					self.logger.debug("Event dropped by rule '%s'", name)
 					self.drop_event_count += 1
 					return DROP
 
@@ -73,11 +144,11 @@ class engine(cengine):
 
 		# No rules matched
 		if default_action == 'drop':
-			self.logger.debug("Event '%s' dropped by default action" % (rk))
+			self.logger.debug("Event '%s' dropped by default action", rk)
 			self.drop_event_count += 1
 			return DROP
 
-		self.logger.debug("Event '%s' passed by default action" % (rk))
+		self.logger.debug("Event '%s' passed by default action", rk)
 		self.pass_event_count += 1
 
 		return event
@@ -93,8 +164,11 @@ class engine(cengine):
 			for record in records:
 				record_dump = record.dump()
 				record_dump["mfilter"] = ast.literal_eval(record_dump["mfilter"])
+				record_dump["check"] = cmfilter.compile(record_dump["mfilter"])
 				self.configuration['rules'].append(record_dump)
 
+			self.configuration['index'] = RulesIndex(self.configuration['rules'])
+
 			self.send_stat_event()
 
 		except Exception, e:
@@ -104,6 +178,11 @@ class engine(cengine):
 	def send_stat_event(self):
 		""" Send AMQP Event for drop and pass metrics """
 
+		candidates_per_event = 0
+
+		if self.event_count:
+			candidates_per_event = float(self.candidate_count) / self.event_count
+
 		event = cevent.forger(
 			connector = "cengine",
 			connector_name = "engine",
@@ -115,7 +194,8 @@ class engine(cengine):
 			output="%s event dropped since %s" % (self.drop_event_count, self.beat_interval),
 			perf_data_array=[
 								{'metric': 'pass_event' , 'value': self.pass_event_count, 'type': 'GAUGE' },
-								{'metric': 'drop_event' , 'value': self.drop_event_count, 'type': 'GAUGE' }
+								{'metric': 'drop_event' , 'value': self.drop_event_count, 'type': 'GAUGE' },
+								{'metric': 'candidate_rules_per_event' , 'value': round(candidates_per_event, 2), 'type': 'GAUGE' }
 							]
 		)
 
@@ -128,6 +208,8 @@ class engine(cengine):
 
 		self.drop_event_count = 0
 		self.pass_event_count = 0
+		self.candidate_count = 0
+		self.event_count = 0
 
 
 	def find_default_action(self):
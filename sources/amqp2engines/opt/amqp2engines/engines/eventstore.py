@@ -29,11 +29,23 @@ import csv
 class engine(cengine):
 	etype = 'eventstore'
 
-	def __init__(self, *args, **kargs):
+	def __init__(self, write_behind=False, flush_interval=1000, flush_size=500, flush_on_change=True, flush_on_shutdown=True,
+			log_partition=None, log_retention=0, states_size=100000, *args, **kargs):
 		super(engine, self).__init__(*args, **kargs)
 
-		self.archiver = carchiver(namespace='events',  autolog=False, logging_level=self.logging_level)
-
+		self.archiver = carchiver(
+			namespace='events',
+			autolog=False,
+			logging_level=self.logging_level,
+			write_behind=write_behind,
+			flush_interval=flush_interval,
+			flush_size=flush_size,
+			flush_on_change=flush_on_change,
+			flush_on_shutdown=flush_on_shutdown,
+			log_partition=log_partition,
+			log_retention=log_retention,
+			states_size=states_size
+		)
 
 		self.event_types = csv.reader([CONFIG.get('events', 'types')]).next()
 		self.check_types = csv.reader([CONFIG.get('events', 'checks')]).next()
@@ -46,6 +58,14 @@ class engine(cengine):
 	def beat(self):
 		self.cdowntime.reload(self.beat_interval)
 
+		# Write states of idle events
+		self.archiver.flush(force=True)
+
+		self.archiver.purge_logs()
+
+	def post_run(self):
+		self.archiver.close()
+
 	def store_check(self, event):
 		_id = self.archiver.check_event(event['rk'], event)
 
@@ -48,6 +48,10 @@ class engine(cengine):
 	def pre_run(self):
 		self.manager = pyperfstore2.manager(logging_level=self.logging_level)
 
+		# Known series don't upsert their meta on each push
+		known = self.manager.store.warm_known()
+		self.logger.info("%s known series" % known)
+
 		self.internal_amqp = camqp(logging_level=self.logging_level, logging_name='{0}-internal-amqp'.format(self.name))
 
 		self.internal_amqp.add_queue(
@@ -100,7 +104,7 @@ class engine(cengine):
 
 				value = Str2Number(value)
 
-				self.logger.debug(" + Put metric '%s' (%s %s (%s)) for ts %s ..." % (metric, value, unit, dtype, timestamp))
+				self.logger.debug(" + Put metric '%s' (%s %s (%s)) for ts %s ...", metric, value, unit, dtype, timestamp)
 
 				if value == None:
 					self.logger.warning("Invalid value: '%s' (%s: %s)" % (value, rk, metric))
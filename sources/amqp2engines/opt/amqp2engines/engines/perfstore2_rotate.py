@@ -46,6 +46,10 @@ class engine(cengine):
 
 		self.build_interval = 60 * 60 * 2 # 2 hours
 		self.last_build = time.time()
+
+		# Chunks moved from GridFS to documents by beat
+		self.bins_by_beat = 200
+		self.bins_migrated = False
 		
 	def pre_run(self):
 		self.manager = pyperfstore2.manager(logging_level=self.logging_level)
@@ -119,6 +123,14 @@ class engine(cengine):
 		## Work
 		for key in keys:
 			self.manager.rotate(_id=key)
+
+		## Migrate binaries in spare time
+		if not self.bins_migrated and (time.time() - start) < self.beat_interval / 2:
+			checked = self.manager.store.migrate_bins(limit=self.bins_by_beat)
+			self.logger.debug(" + Binaries checked for migration: %s" % checked)
+
+			if not checked:
+				self.bins_migrated = True
 	
 		elapsed = (time.time() - start)
 		self.counter_event += len(keys)
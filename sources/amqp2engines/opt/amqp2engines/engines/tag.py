@@ -72,6 +72,12 @@ class engine(cengine):
 				# tag field is defined here only
 				selector.tags = []
 
+				# compiled mfilter
+				selector.check = None
+
+				if selector.mfilter:
+					selector.check = cmfilter.compile(selector.mfilter)
+
 				for selector_tag in ['crecord_name', 'display_name']:
 					if  selector_tag in selector_dump and selector_dump[selector_tag]:
 						selector.tags.append(selector_dump[selector_tag])
@@ -120,8 +126,8 @@ class engine(cengine):
 			add_tag = False
 			cfilter = False
 			self.logger.debug('Filter %s: type %s' % (selector.mfilter, type(selector.mfilter)) )
-			if selector.mfilter:
-				cfilter = cmfilter.check(selector.mfilter, event)
+			if selector.check:
+				cfilter = selector.check(event)
 
 			if 'rk' in event:
 				if event['rk'] not in selector.exclude_ids and (event['rk'] in selector.include_ids or cfilter):
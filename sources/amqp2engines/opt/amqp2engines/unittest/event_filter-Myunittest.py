@@ -25,6 +25,7 @@ import logging
 sys.path.append(os.path.expanduser('~/opt/amqp2engines/engines/'))
 
 import event_filter
+import cmfilter
 from cengine import DROP
 
 
@@ -122,6 +123,40 @@ class KnownValues(unittest.TestCase):
 		self.engine.configuration = {}
 		self.assertEqual(self.engine.work(event), event)
 
+	def test_02_Index(self):
+		rules = [
+			{'mfilter': {'connector': 'nagios', 'state': 2}, 'action': 'drop', 'name': 'nagios-critical'},
+			{'mfilter': {'component': 'host1'}, 'action': 'pass', 'name': 'host1'},
+			{'mfilter': {'$or': [{'connector': 'collectd'}, {'state': 1}]}, 'action': 'drop', 'name': 'or'},
+			{'mfilter': {'$and': [{'event_type': 'log'}, {'connector': 'nagios'}]}, 'action': 'drop', 'name': 'nagios-log'},
+			{'mfilter': {'connector': 'nagios'}, 'action': 'pass', 'name': 'nagios'},
+		]
+
+		index = event_filter.RulesIndex(rules)
+
+		event = {'connector': 'nagios', 'event_type': 'check', 'component': 'host2', 'state': 2}
+		self.assertEqual(index.get_candidates(event), [0, 2, 3, 4])
+
+		event = {'connector': 'shinken', 'event_type': 'log', 'component': 'host1', 'state': 0}
+		self.assertEqual(index.get_candidates(event), [1, 2])
+
+		# Same decisions as without index
+		self.engine.configuration = {'rules': rules, 'default_action': 'pass'}
+
+		for connector in ['nagios', 'collectd', 'shinken']:
+			for event_type in ['check', 'log']:
+				for component in ['host1', 'host2']:
+					for state in [0, 1, 2]:
+						event = {'connector': connector, 'connector_name': 'unittest', 'event_type': event_type, 'source_type': 'component', 'component': component, 'state': state}
+
+						expected = event
+						for rule in rules:
+							if cmfilter.check(rule['mfilter'], event):
+								expected = event if rule['action'] == 'pass' else DROP
+								break
+
+						self.assertEqual(self.engine.work(event), expected)
+
 
 if __name__ == "__main__":
 	unittest.main()
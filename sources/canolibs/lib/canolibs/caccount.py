@@ -101,6 +101,19 @@ class caccount(crecord):
 		else:
 			return False
 		
+	def get_principals(self):
+		"""
+			Return what this account matches in 'aaa_readers' of records
+			(see crecord.get_readers).
+		"""
+
+		principals = [self._id, self.group] + list(self.groups) + ['unauth']
+
+		if self.user != 'anonymous':
+			principals.append('other')
+
+		return principals
+
 	def get_mail_md5(self):
 		m = hashlib.md5()
 		m.update(self.mail)
@@ -20,8 +20,17 @@
 import sys
 import kombu
 from kombu import Connection, Exchange, Queue
+from kombu.serialization import register, dumps
 import kombu.pools
 
+from bson import objectid
+import json
+
+try:
+	import msgpack
+except ImportError:
+	msgpack = None
+
 try:
 	from amqplib.client_0_8.exceptions import AMQPConnectionException as ConnectionError
 except ImportError as IE:
@@ -34,8 +43,33 @@ import sys
 #from kombu.pools import producers
 
 
+## Serializers of camqp, aware of ObjectId so messages don't need to be copied
+## and cleaned. They have their own names, kombu serializers are left alone.
+def _encode_default(obj):
+	if isinstance(obj, objectid.ObjectId):
+		return str(obj)
+
+	raise TypeError("%s is not serializable" % repr(obj))
+
+# name -> (encoder, content_type, content_encoding)
+SERIALIZERS = {
+	# Plain JSON for consumers, decoded by kombu's own json serializer
+	'canopsis-json': (lambda obj: json.dumps(obj, default=_encode_default), 'application/json', 'utf-8')
+}
+
+if msgpack:
+	SERIALIZERS['canopsis-msgpack'] = (lambda obj: msgpack.packb(obj, default=_encode_default), 'application/x-canopsis-msgpack', 'binary')
+
+	# Its own content type: consumers decode it, kombu's msgpack stays disabled
+	register('canopsis-msgpack',
+		SERIALIZERS['canopsis-msgpack'][0],
+		lambda data: msgpack.unpackb(data, encoding='utf-8'),
+		content_type='application/x-canopsis-msgpack',
+		content_encoding='binary')
+
+
 class camqp(threading.Thread):
-	def __init__(self, host="localhost", port=5672, userid="guest", password="guest", virtual_host="canopsis", exchange_name="canopsis", logging_name="camqp", logging_level=logging.INFO, read_config_file=True, auto_connect=True, on_ready=None):
+	def __init__(self, host="localhost", port=5672, userid="guest", password="guest", virtual_host="canopsis", exchange_name="canopsis", logging_name="camqp", logging_level=logging.INFO, read_config_file=True, auto_connect=True, on_ready=None, transport="amqp", on_drain=None):
 		threading.Thread.__init__(self)
 
 		self.logger = logging.getLogger(logging_name)
@@ -49,10 +83,25 @@ class camqp(threading.Thread):
 		self.exchange_name=exchange_name
 		self.logging_level = logging_level
 
+		## 'amqp' for RabbitMQ, 'memory' for an in-process broker (tests and benchmarks)
+		self.transport = transport
+
+		## Serializer between engines (amq.direct), json is kept for other exchanges
+		self.internal_serializer = 'canopsis-json'
+
+		if msgpack:
+			self.internal_serializer = 'canopsis-msgpack'
+
+		## Compress messages bigger than this size (in bytes, 0 to disable)
+		self.compression_threshold = 0
+
 		if (read_config_file):
 			self.read_config("amqp")
 
-		self.amqp_uri = "amqp://%s:%s@%s:%s/%s" % (self.userid, self.password, self.host, self.port, self.virtual_host)
+		if self.transport == "memory":
+			self.amqp_uri = "memory://"
+		else:
+			self.amqp_uri = "amqp://%s:%s@%s:%s/%s" % (self.userid, self.password, self.host, self.port, self.virtual_host)
 
 		self.logger.setLevel(logging_level)
 
@@ -65,6 +114,9 @@ class camqp(threading.Thread):
 		self.connected = False
 		self.on_ready = on_ready
 
+		## Called by this thread after each drain, with or without messages
+		self.on_drain = on_drain
+
 		self.RUN = True
 
 		self.exchanges = {}
@@ -123,6 +175,13 @@ class camqp(threading.Thread):
 						traceback.print_exc(file=sys.stdout)
 						break
 
+					if self.on_drain:
+						try:
+							self.on_drain()
+
+						except Exception as err:
+							self.logger.error("Error in drain callback: %s" % err)
+
 				self.disconnect()
 
 			if self.RUN:
@@ -138,7 +197,10 @@ class camqp(threading.Thread):
 
 	def connect(self):
 		if not self.connected:
-			self.logger.info("Connect to AMQP Broker (%s:%s)" % (self.host, self.port))
+			if self.transport == "memory":
+				self.logger.info("Connect to in-memory broker")
+			else:
+				self.logger.info("Connect to AMQP Broker (%s:%s)" % (self.host, self.port))
 
 			self.conn = Connection(self.amqp_uri)
 
@@ -234,6 +296,10 @@ class camqp(threading.Thread):
 					self.logger.debug("   + Create Consumer")
 					qsettings['consumer'] = self.conn.Consumer(qsettings['queue'], callbacks=[ qsettings['callback'] ])
 
+					if qsettings['prefetch_count']:
+						self.logger.debug("   + Prefetch count: %s" % qsettings['prefetch_count'])
+						qsettings['consumer'].qos(prefetch_count=qsettings['prefetch_count'])
+
 				self.logger.debug("   + Consume queue")
 				qsettings['consumer'].consume()
 
@@ -241,7 +307,7 @@ class camqp(threading.Thread):
 				self.on_ready()
 
 
-	def add_queue(self, queue_name, routing_keys, callback, exchange_name=None, no_ack=True, exclusive=False, auto_delete=True):
+	def add_queue(self, queue_name, routing_keys, callback, exchange_name=None, no_ack=True, exclusive=False, auto_delete=True, prefetch_count=None):
 		#if exchange_name == "amq.direct":
 		#	routing_keys = queue_name
 
@@ -264,34 +330,83 @@ class camqp(threading.Thread):
 									'exchange_name': exchange_name,
 									'no_ack': no_ack,
 									'exclusive': exclusive,
-									'auto_delete': auto_delete
+									'auto_delete': auto_delete,
+									'prefetch_count': prefetch_count
 							}
 
 
-	def publish(self, msg, routing_key, exchange_name=None, serializer="json", compression=None, content_type=None, content_encoding=None):
+	def get_serializer(self, exchange_name):
+		if exchange_name == "amq.direct":
+			return self.internal_serializer
+
+		return "canopsis-json"
+
+	def encode(self, msg, serializer, compression=None):
+		"""
+			Serialize message, returns (body, content_type, content_encoding, compression).
+			Compression is enabled when message is bigger than compression_threshold.
+		"""
+
+		if serializer in SERIALIZERS:
+			encoder, content_type, content_encoding = SERIALIZERS[serializer]
+			body = encoder(msg)
+		else:
+			content_type, content_encoding, body = dumps(msg, serializer=serializer)
+
+		if not compression and self.compression_threshold and len(body) > self.compression_threshold:
+			compression = 'zlib'
+
+		return body, content_type, content_encoding, compression
+
+	def _publish(self, producer, msg, routing_key, exchange, serializer, compression):
+		body, content_type, content_encoding, compression = self.encode(msg, serializer, compression)
+
+		producer.publish(body,
+			content_type=content_type,
+			content_encoding=content_encoding,
+			compression=compression,
+			routing_key=routing_key,
+			exchange=exchange)
+
+	def publish(self, msg, routing_key, exchange_name=None, serializer=None, compression=None, content_type=None, content_encoding=None):
 		self.wait_connection()
 		if self.connected:
 			if not exchange_name:
 				exchange_name = self.exchange_name
 
-			self.logger.debug("Send message to %s in %s" % (routing_key, exchange_name))
+			if not serializer:
+				serializer = self.get_serializer(exchange_name)
+
+			self.logger.debug("Send message to %s in %s", routing_key, exchange_name)
 			with self.producers[self.conn].acquire(block=True) as producer:
 				try:
-					_msg = msg.copy()
-					camqp._clean_msg_for_serialization(_msg)
-					producer.publish(_msg, serializer=serializer, compression=compression, routing_key=routing_key, exchange=self.get_exchange(exchange_name))
+					self._publish(producer, msg, routing_key, self.get_exchange(exchange_name), serializer, compression)
 					self.logger.debug(" + Sended")
 				except Exception, err:
 					self.logger.error(" + Impossible to send (%s)" % err)
 		else:
 			self.logger.error("You are not connected ...")
 
-	@staticmethod
-	def _clean_msg_for_serialization(msg):
-		from bson import objectid
-		for key in msg:
-			if isinstance(msg[key], objectid.ObjectId):
-				msg[key] = str(msg[key])
+	def publish_many(self, msgs, routing_key, exchange_name=None, serializer=None, compression=None):
+		self.wait_connection()
+		if self.connected:
+			if not exchange_name:
+				exchange_name = self.exchange_name
+
+			if not serializer:
+				serializer = self.get_serializer(exchange_name)
+
+			exchange = self.get_exchange(exchange_name)
+
+			self.logger.debug("Send %s messages to %s in %s", len(msgs), routing_key, exchange_name)
+			with self.producers[self.conn].acquire(block=True) as producer:
+				for msg in msgs:
+					try:
+						self._publish(producer, msg, routing_key, exchange, serializer, compression)
+					except Exception, err:
+						self.logger.error(" + Impossible to send (%s)" % err)
+		else:
+			self.logger.error("You are not connected ...")
 
 	def cancel_queues(self):
 		if self.connected:
@@ -360,6 +475,16 @@ class camqp(threading.Thread):
 			self.virtual_host = self.config.get(section, "virtual_host")
 			self.exchange_name = self.config.get(section, "exchange_name")
 
+			if self.config.has_option(section, "transport"):
+				self.transport = self.config.get(section, "transport")
+
+			if self.config.has_option(section, "internal_serializer"):
+				# msgpack or json
+				self.internal_serializer = "canopsis-%s" % self.config.get(section, "internal_serializer")
+
+			if self.config.has_option(section, "compression_threshold"):
+				self.compression_threshold = self.config.getint(section, "compression_threshold")
+
 		except Exception, err:
 			self.logger.error("Impossible to load configurations (%s), use default ..." % err)
 
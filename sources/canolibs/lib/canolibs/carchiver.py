@@ -19,9 +19,12 @@
 # ---------------------------------
 
 import logging, time
+from threading import RLock
+from collections import OrderedDict
 from cstorage import get_storage
 from caccount import caccount
-from crecord import crecord
+from crecord import crawrecord
+from ceventlog import ceventlog
 
 from ctools import legend
 from ctools import uniq
@@ -29,8 +32,40 @@ from ctools import parse_perfdata
 
 legend_type = ['soft', 'hard']
 
+# Fields of the event state used to detect changes
+change_fields = {'state': 1, 'state_type': 1, 'last_state_change': 1, 'perf_data_array': 1, 'output': 1, 'timestamp': 1}
+
 class carchiver(object):
-	def __init__(self, namespace, storage=None, autolog=False, logging_level=logging.ERROR):
+	def __init__(self, namespace, storage=None, autolog=False, logging_level=logging.ERROR,
+			write_behind=False, flush_interval=1000, flush_size=500, flush_on_change=True, flush_on_shutdown=True,
+			log_partition=None, log_retention=0, states_size=100000):
+		"""
+			With 'write_behind', event states are kept in memory and written
+			to MongoDB by bulk flushes, instead of one read and one write
+			per check:
+
+			 - 'flush_interval' (ms) and 'flush_size' (dirty events) trigger
+			   a flush, updates of the same event between two flushes are
+			   coalesced in one write.
+			 - 'flush_on_change' flushes as soon as an event changes state,
+			   so a published alert is always backed by the stored state
+			   (only output/perfdata updates can be lost on crash).
+			 - 'flush_on_shutdown' flushes pending writes in close().
+
+			At most 'states_size' states are kept, least recently used
+			ones are evicted once written. States are never read again
+			from MongoDB while in memory, so
+			each event must be archived by a single carchiver: with
+			several eventstore processes, events must be sharded (see
+			cshard), else states of other processes are stale and state
+			changes are missed or published twice. Readers of the
+			events collection see output/perfdata updates up to
+			'flush_interval' late.
+
+			Logs are written by a ceventlog, by bulks too with 'write_behind',
+			in time partitions with 'log_partition' ('hour' or 'day') dropped
+			after 'log_retention' seconds.
+		"""
 
 		self.logger = logging.getLogger('carchiver')
 		self.logger.setLevel(logging_level)
@@ -52,6 +87,166 @@ class carchiver(object):
 
 		self.collection = self.storage.get_backend(namespace)
 
+		self.write_behind = write_behind
+		self.flush_interval = flush_interval
+		self.flush_size = flush_size
+		self.flush_on_change = flush_on_change
+		self.flush_on_shutdown = flush_on_shutdown
+
+		# State table: _id -> change fields of the stored event, in LRU order
+		self.states = OrderedDict()
+		self.states_size = states_size
+		# Pending writes: _id -> ('replace', document) or ('set', fields)
+		self.dirty = {}
+		self.dirty_lock = RLock()
+		self.flush_last = time.time()
+
+		self.eventlog = ceventlog(
+			namespace=self.namespace_log,
+			storage=self.storage,
+			partition=log_partition,
+			retention=log_retention,
+			bulk_size=flush_size if write_behind else 1,
+			bulk_interval=flush_interval,
+			logging_level=logging_level
+		)
+
+	def get_event(self, _id):
+		if not self.write_behind:
+			return self.collection.find_one(_id, fields=change_fields)
+
+		with self.dirty_lock:
+			state = self.states.pop(_id, None)
+
+			if state is None:
+				devent = self.collection.find_one(_id, fields=change_fields)
+
+				if not devent:
+					return None
+
+				state = dict([(key, devent[key]) for key in change_fields if key in devent])
+
+			self.set_state(_id, state)
+
+			# Copy it, merge_perf_data works in place
+			devent = dict(state)
+
+		if 'perf_data_array' in devent:
+			devent['perf_data_array'] = list(devent['perf_data_array'])
+
+		return devent
+
+	def update_event(self, _id, change):
+		if not self.write_behind:
+			self.collection.update({'_id': _id}, {'$set': change})
+			return
+
+		with self.dirty_lock:
+			state = self.states.pop(_id, {})
+			state.update(change)
+
+			self.mark_dirty(_id, 'set', change)
+			self.set_state(_id, state)
+
+	def set_state(self, _id, state):
+		# Must be called with dirty_lock held
+		self.states.pop(_id, None)
+		self.states[_id] = state
+
+		excess = len(self.states) - self.states_size
+
+		if excess <= 0:
+			return
+
+		# Dirty states are newer than MongoDB, keep them until flushed
+		evicted = []
+
+		for key in self.states:
+			if key not in self.dirty:
+				evicted.append(key)
+
+				if len(evicted) >= excess:
+					break
+
+		for key in evicted:
+			del self.states[key]
+
+	def mark_dirty(self, _id, op, data):
+		with self.dirty_lock:
+			pending = self.dirty.get(_id, None)
+
+			# Coalesce with the pending write of this event
+			if pending and op == 'set':
+				pending[1].update(data)
+			else:
+				self.dirty[_id] = (op, data)
+
+	def flush(self, force=False):
+		"""
+			Write pending event states in one unordered bulk, and pending
+			logs, when 'flush_interval' or 'flush_size' is reached (or 'force').
+		"""
+
+		if not self.write_behind:
+			return 0
+
+		self.eventlog.flush(force=force)
+
+		with self.dirty_lock:
+			now = time.time()
+
+			if not self.dirty:
+				self.flush_last = now
+				return 0
+
+			if not force and len(self.dirty) < self.flush_size and (now - self.flush_last) * 1000 < self.flush_interval:
+				return 0
+
+			dirty = self.dirty
+			self.dirty = {}
+			self.flush_last = now
+
+			self.logger.debug("Flush %s event(s) in %s" % (len(dirty), self.namespace))
+
+			bulk = self.collection.initialize_unordered_bulk_op()
+
+			for _id, (op, data) in dirty.iteritems():
+				if op == 'replace':
+					bulk.find({'_id': _id}).upsert().replace_one(data)
+				else:
+					bulk.find({'_id': _id}).update_one({'$set': data})
+
+			try:
+				bulk.execute()
+
+			except Exception, err:
+				self.logger.error("Impossible to flush %s event(s): %s" % (len(dirty), err))
+
+				# Keep them for the next flush, after newer updates
+				for _id, (op, data) in dirty.iteritems():
+					pending = self.dirty.get(_id, None)
+
+					if pending and pending[0] == 'set':
+						data = dict(data, **pending[1])
+					elif pending:
+						continue
+
+					self.dirty[_id] = (op, data)
+
+				return 0
+
+			return len(dirty)
+
+	def close(self):
+		if self.flush_on_shutdown:
+			self.flush(force=True)
+
+		elif self.dirty or self.eventlog.pending_count:
+			self.logger.warning("Drop %s pending event(s) and %s log(s) write" % (len(self.dirty), self.eventlog.pending_count))
+
+	def purge_logs(self):
+		return self.eventlog.purge()
+
 	def check_event(self, _id, event):
 		changed = False
 		new_event = False
@@ -72,8 +267,7 @@ class carchiver(object):
 		try:
 			# Get old record
 			#record = self.storage.get(_id, account=self.account)
-			change_fields = {'state': 1, 'state_type': 1, 'last_state_change': 1, 'perf_data_array': 1, 'output': 1, 'timestamp': 1}
-			devent = self.collection.find_one(_id, fields=change_fields)
+			devent = self.get_event(_id)
 
 			if not devent:
 				new_event = True
@@ -122,12 +316,14 @@ class carchiver(object):
 				if key in event and key in devent and devent[key] != event[key]:
 					change[key] = event[key]
 			if change:
-				self.storage.get_backend('events').update({'_id': _id}, {'$set': change})
+				self.update_event(_id, change)
 
 		mid = None
 		if changed or self.autolog:
 			mid = self.log_event(_id, event)
 
+		self.flush(force=changed and self.flush_on_change)
+
 		return mid
 
 	def merge_perf_data(self, old_event, new_event):
@@ -159,31 +355,47 @@ class carchiver(object):
 		return new_event
 
 	def store_new_event(self, _id, event):
-		record = crecord(event)
-		record.type = "event"
+		# The event goes on to next engines, keep crecord fields out of it
+		record = crawrecord(dict(event), type="event")
 		record.chmod("o+r")
 		record._id = _id
 
-		self.storage.put(record, namespace=self.namespace, account=self.account)
+		if not self.write_behind:
+			self.storage.put(record, namespace=self.namespace, account=self.account)
+			return
+
+		if not record.owner:
+			record.chown(self.account.user)
+
+		if not record.group:
+			record.chgrp(self.account.group)
+
+		record.write_time = int(time.time())
+
+		data = record.dump()
+
+		with self.dirty_lock:
+			if _id not in self.states:
+				data['crecord_creation_time'] = record.write_time
+
+			self.mark_dirty(_id, 'replace', data)
+			self.set_state(_id, dict([(key, event[key]) for key in change_fields if key in event]))
 
 	def log_event(self, _id, event):
 		self.logger.debug("Log event '%s' in %s ..." % (_id, self.namespace_log))
-		record = crecord(event)
-		record.type = "event"
-		record.chmod("o+r")
-		record.data['event_id'] = _id
-		record._id = _id + '.' + str(time.time())
-
-		self.storage.put(record, namespace=self.namespace_log, account=self.account)
-		return record._id
+		return self.eventlog.log(_id, event)
 
 	def get_logs(self, _id, start=None, stop=None):
-		return self.storage.find({'event_id': _id}, namespace=self.namespace_log, account=self.account)
+		return self.eventlog.find({'event_id': _id}, start=start, stop=stop)
 
 	def remove_all(self):
 		self.logger.debug("Remove all logs and state archives")
 
+		with self.dirty_lock:
+			self.states = OrderedDict()
+			self.dirty = {}
+
 		self.storage.drop_namespace(self.namespace)
-		self.storage.drop_namespace(self.namespace_log)
+		self.eventlog.drop()
 
 
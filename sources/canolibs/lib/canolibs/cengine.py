@@ -21,12 +21,19 @@
 from cinit import cinit
 from camqp import camqp
 from cstorage import get_storage
+from cstorage import get_pool_stats
 from caccount import caccount
+from cshard import cshard, get_shard_queue
+from chistogram import chistogram
 import cevent
 
 import traceback
+import cProfile
+import json
 import itertools
+import threading
 import logging
+import signal
 import time
 import sys
 import os
@@ -47,6 +54,12 @@ class cengine(object):
 			logging_level=logging.INFO,
 			exchange_name='amq.direct',
 			routing_keys=[],
+			batch_size=0,
+			batch_window=500,
+			shard=None,
+			next_shards={},
+			latency_dump=False,
+			profile_duration=30,
 			*args, **kwargs):
 
 		super(cengine, self).__init__(*args, **kwargs)
@@ -60,6 +73,12 @@ class cengine(object):
 		self.camqp = camqp
 
 		self.amqp_queue = "Engine_{0}".format(self.name)
+
+		## Consume only one shard of the events (see cshard)
+		self.shard = shard
+
+		if self.shard is not None:
+			self.amqp_queue = get_shard_queue(self.amqp_queue, self.shard)
 		self.routing_keys = routing_keys
 		self.exchange_name = exchange_name
 
@@ -68,6 +87,16 @@ class cengine(object):
 		self.next_amqp_queues = next_amqp_queues
 		self.get_amqp_queue = itertools.cycle(self.next_amqp_queues)
 
+		## Next queues sharded on event's routing key
+		self.next_rings = dict([
+			(queue_name, cshard(shards))
+			for queue_name, shards in next_shards.items()
+		])
+
+		## In-process engines fused after this one (see fuse())
+		self.next_engines = []
+		self.fused_engines = []
+
 		## Get from internal or external queue
 		self.next_balanced = next_balanced
 
@@ -84,13 +113,35 @@ class cengine(object):
 		self.counter_error = 0
 		self.counter_event = 0
 		self.counter_worktime = 0
+		self.counter_warn = 0
+		self.counter_crit = 0
 
 		self.thd_warn_sec_per_evt = 0.6
 		self.thd_crit_sec_per_evt = 0.9
 
+		## Latency distribution of work(), dumped on each stat if latency_dump
+		self.histogram = chistogram()
+		self.latency_dump = latency_dump
+		self.latency_dump_path = os.path.expanduser("~/var/log/engines/%s-latency.json" % name)
+
+		## On-demand profiling of the consumer thread (SIGUSR1)
+		self.profile_duration = profile_duration
+		self.profile_path = os.path.expanduser("~/var/log/engines/%s.prof" % name)
+		self.profile_requested = False
+		self.profile_end = None
+		self.profiler = None
+
 		self.beat_interval = beat_interval
 		self.beat_last = time.time()
 
+		## Micro-batch consumption (disabled when batch_size < 2)
+		self.batch_size = batch_size
+		self.batch_window = batch_window
+		self.batch = []
+		self.batch_start = None
+		self.batch_lock = threading.Lock()
+		self.batch_flush_requested = False
+
 		self.create_queue =  True
 
 		self.send_stats_event = True
@@ -128,17 +179,43 @@ class cengine(object):
 
 		return record_object
 
-	def new_amqp_queue(self, amqp_queue, routing_keys, on_amqp_event, exchange_name):
+	def new_amqp_queue(self, amqp_queue, routing_keys, on_amqp_event, exchange_name, prefetch_count=None, no_ack=True):
 		self.amqp.add_queue(
 			queue_name=amqp_queue,
 			routing_keys=routing_keys,
 			callback=on_amqp_event,
 			exchange_name=exchange_name,
-			no_ack=True,
+			no_ack=no_ack,
 			exclusive=False,
-			auto_delete=False
+			auto_delete=False,
+			prefetch_count=prefetch_count
 		)
 
+	def is_batched(self):
+		return self.batch_size > 1
+
+	def fuse(self, engines):
+		"""
+			Run engines in this process, right after this one.
+			Each engine forwards its events to the next one by calling its
+			_work() directly, only the last one publishes on AMQP.
+		"""
+
+		self.fused_engines = list(engines)
+
+		chain = [self] + self.fused_engines
+
+		for engine, next_engine in zip(chain[:-1], chain[1:]):
+			engine.next_engines = [next_engine]
+
+	def new_dispatcher_queue(self):
+		if self.etype in self.dispatcher_crecords:
+			rk = 'dispatcher.' + self.etype
+			self.logger.debug('Creating dispatcher queue for engine ' + self.etype)
+
+			self.amqp.get_exchange('media')
+			self.new_amqp_queue('Dispatcher_' + self.etype, rk, self.consume_dispatcher, 'media')
+
 	def pre_run(self):
 		pass
 
@@ -151,34 +228,54 @@ class cengine(object):
 
 		self.logger.info("Start Engine with pid %s" % (os.getpid()))
 
-		self.amqp = self.camqp(logging_level=self.logging_level, logging_name="%s-amqp" % self.name, on_ready=ready)
+		signal.signal(signal.SIGUSR1, self.on_profile_signal)
+
+		on_drain = None
+
+		# Batches are flushed by the consumer thread, it owns the AMQP channel
+		if self.is_batched():
+			on_drain = self.on_amqp_drain
+
+		self.amqp = self.camqp(logging_level=self.logging_level, logging_name="%s-amqp" % self.name, on_ready=ready, on_drain=on_drain)
 
 		if self.create_queue:
-			self.new_amqp_queue(self.amqp_queue, self.routing_keys, self.on_amqp_event, self.exchange_name)
+			if self.is_batched():
+				self.logger.info("Batch mode: %s events or %s ms" % (self.batch_size, self.batch_window))
+				# Batched events are acked once processed, the broker sends
+				# at most a batch of unacked events
+				self.new_amqp_queue(self.amqp_queue, self.routing_keys, self.on_amqp_batch_event, self.exchange_name, prefetch_count=self.batch_size, no_ack=False)
+
+			else:
+				self.new_amqp_queue(self.amqp_queue, self.routing_keys, self.on_amqp_event, self.exchange_name)
 			# This is an async engine and it needs engine dispatcher bindinds to be feed properly
 
-		if self.etype in self.dispatcher_crecords:
-			rk = 'dispatcher.' + self.etype
-			self.logger.debug('Creating dispatcher queue for engine ' + self.etype)
+		self.new_dispatcher_queue()
 
-			self.amqp.get_exchange('media')
-			self.new_amqp_queue('Dispatcher_' + self.etype, rk, self.consume_dispatcher, 'media')
+		# Fused engines share our AMQP connection
+		for engine in self.fused_engines:
+			self.logger.info("Fuse engine %s" % engine.name)
+			engine.amqp = self.amqp
+			engine.new_dispatcher_queue()
 
 		self.amqp.start()
 
-		self.pre_run()
+		for engine in [self] + self.fused_engines:
+			engine.pre_run()
+
+		sleep_time = 1
 
 		while self.RUN:
 			# Beat
-			if self.beat_interval:
-				now = time.time()
+			for engine in [self] + self.fused_engines:
+				if engine.beat_interval:
+					now = time.time()
 
-				if now > (self.beat_last + self.beat_interval):
-					self._beat()
-					self.beat_last = now
+					if now > (engine.beat_last + engine.beat_interval):
+						engine._beat()
+						engine.beat_last = now
 
 			try:
-				time.sleep(1)
+				time.sleep(sleep_time)
 
 			except Exception as err:
 				self.logger.error("Error in break time: %s" % err)
@@ -188,13 +285,49 @@ class cengine(object):
 				self.logger.info('Stop request')
 				self.RUN = False
 
-		self.post_run()
+		if self.is_batched():
+			self.wait_batch_flush()
+
+		for engine in [self] + self.fused_engines:
+			engine.post_run()
 
 		self.logger.info("Stop Engine")
 		self.stop()
 		self.logger.info("End of Engine")
 
+	def on_profile_signal(self, signum, frame):
+		self.logger.info("Profiling requested for %s seconds" % self.profile_duration)
+		self.profile_requested = True
+
+	def profile(self):
+		"""
+			Called by the consumer thread before each event (or batch).
+			Profiling must be enabled and disabled from that thread.
+		"""
+
+		if self.profiler:
+			if time.time() >= self.profile_end:
+				self.profiler.disable()
+
+				try:
+					self.profiler.dump_stats(self.profile_path)
+					self.logger.info("Profile written in %s" % self.profile_path)
+
+				except IOError as err:
+					self.logger.error("Impossible to write profile: %s" % err)
+
+				self.profiler = None
+
+		elif self.profile_requested:
+			self.profile_requested = False
+			self.profile_end = time.time() + self.profile_duration
+
+			self.profiler = cProfile.Profile()
+			self.profiler.enable()
+
 	def on_amqp_event(self, event, msg):
+		self.profile()
+
 		try:
 			self._work(event, msg)
 
@@ -208,6 +341,7 @@ class cengine(object):
 
 	def _work(self, event, msg=None, *args, **kargs):
 		start = time.time()
+		downstream = 0
 		error = False
 
 		try:
@@ -221,7 +355,7 @@ class cengine(object):
 					event['processing'] = {}
 
 				event['processing'][self.etype] = start
-				self.next_queue(event)
+				downstream = self.next_queue(event)
 
 		except Exception, err:
 			error = True
@@ -231,27 +365,280 @@ class cengine(object):
 		if error:
 			self.counter_error +=1
 
-		elapsed = time.time() - start
+		elapsed = time.time() - start - downstream
 
 		if elapsed > 3:
 			self.logger.warning("Elapsed time %.2f seconds" % elapsed)
 
-		self.counter_event += 1
-		self.counter_worktime += elapsed
+		self.count_worktime(elapsed)
 
 	def work(self, event, amqp_msg):
 		return event
 
+	def on_amqp_batch_event(self, event, msg):
+		self.profile()
+
+		with self.batch_lock:
+			if not self.batch:
+				self.batch_start = time.time()
+
+			self.batch.append((event, msg))
+
+			if len(self.batch) >= self.batch_size:
+				self._flush_batch()
+
+	def on_amqp_drain(self):
+		"""
+			Called by the consumer thread after each drain, flush the
+			incomplete batch when its window is over or a flush is requested.
+		"""
+
+		flush = self.batch_flush_requested
+		self.flush_batch(timeout=not flush)
+
+		if flush:
+			self.batch_flush_requested = False
+
+	def wait_batch_flush(self, timeout=5):
+		"""
+			Ask the consumer thread to flush the pending batch and wait for it,
+			unacked events are delivered again if it can't.
+		"""
+
+		self.batch_flush_requested = True
+		end = time.time() + timeout
+
+		while self.batch_flush_requested and self.amqp.is_alive() and time.time() < end:
+			time.sleep(0.1)
+
+		if self.batch_flush_requested:
+			self.logger.warning("Batch of %s events not flushed" % len(self.batch))
+
+	def flush_batch(self, timeout=False):
+		"""
+			Process pending events, if timeout is True only when the batch window is over.
+		"""
+
+		with self.batch_lock:
+			if not self.batch:
+				return
+
+			if timeout and (time.time() - self.batch_start) * 1000 < self.batch_window:
+				return
+
+			self._flush_batch()
+
+	def _flush_batch(self):
+		# Must be called with batch_lock held
+		batch = self.batch
+		self.batch = []
+		self.batch_start = None
+
+		events = [event for event, msg in batch]
+		msgs = [msg for event, msg in batch]
+
+		if not self._work_batch(events, msgs):
+			self.logger.error("Impossible to deal with a batch of %s events" % len(events))
+
+			try:
+				self.next_queue_batch(events)
+
+			except Exception as err:
+				# Events are neither worked nor forwarded, give them back
+				self.logger.error("Impossible to forward the batch: %s" % err)
+				self.requeue_batch(msgs)
+				return
+
+		self.ack_batch(msgs)
+
+	def ack_batch(self, msgs):
+		"""
+			Ack messages of a processed batch, the broker delivers unacked
+			ones again if the engine stops before.
+		"""
+
+		for msg in msgs:
+			if msg is None:
+				continue
+
+			try:
+				msg.ack()
+
+			except Exception as err:
+				# Messages of a lost connection are delivered again anyway
+				self.logger.error("Impossible to ack %s events: %s" % (len(msgs), err))
+				break
+
+	def requeue_batch(self, msgs):
+		"""
+			Give back messages of a failed batch to the broker.
+		"""
+
+		for msg in msgs:
+			if msg is None:
+				continue
+
+			try:
+				msg.requeue()
+
+			except Exception as err:
+				self.logger.error("Impossible to requeue %s events: %s" % (len(msgs), err))
+				break
+
+	def _work_batch(self, events, msgs=None, *args, **kargs):
+		"""
+			Work and forward a batch, returns False when it failed.
+		"""
+
+		start = time.time()
+		downstream = 0
+		error = False
+
+		try:
+			wevents = self.work_batch(events, msgs, *args, **kargs)
+
+			forward = []
+
+			for event, wevent in zip(events, wevents):
+				if wevent != DROP:
+					if isinstance(wevent, dict):
+						event = wevent
+
+					if 'processing' not in event:
+						event['processing'] = {}
+
+					event['processing'][self.etype] = start
+					forward.append(event)
+
+			downstream = self.next_queue_batch(forward)
+
+		except Exception, err:
+			error = True
+			self.logger.error("Worker raise exception: %s" % err)
+			self.logger.error(traceback.format_exc())
+
+		if error:
+			self.counter_error += len(events)
+
+		elapsed = time.time() - start - downstream
+
+		if elapsed > 3:
+			self.logger.warning("Elapsed time %.2f seconds for %s events" % (elapsed, len(events)))
+
+		self.count_worktime(elapsed, len(events))
+
+		return not error
+
+	def count_worktime(self, elapsed, count=1):
+		"""
+			Account 'count' events worked in 'elapsed' seconds.
+		"""
+
+		if not count:
+			return
+
+		sec_per_evt = elapsed / count
+
+		self.counter_event += count
+		self.counter_worktime += elapsed
+		self.histogram.add(sec_per_evt, count)
+
+		if sec_per_evt > self.thd_warn_sec_per_evt:
+			self.counter_warn += count
+
+		if sec_per_evt > self.thd_crit_sec_per_evt:
+			self.counter_crit += count
+
+	def work_batch(self, events, amqp_msgs=None):
+		"""
+			Process a list of events, returns a list of the same length
+			with the worked event (or DROP) at each position.
+			Override it to do bulk I/O.
+		"""
+
+		if amqp_msgs is None:
+			amqp_msgs = [None] * len(events)
+
+		return [self.work(event, msg) for event, msg in zip(events, amqp_msgs)]
+
 	def next_queue(self, event):
+		"""
+			Forward event, returns the time spent in fused engines.
+		"""
+
+		if self.next_engines:
+			start = time.time()
+
+			for engine in self.next_engines:
+				engine._work(event)
+
+			return time.time() - start
+
 		if self.next_balanced:
 			queue_name = self.get_amqp_queue.next()
 			if queue_name:
-				self.amqp.publish(event, queue_name, "amq.direct")
+				self.amqp.publish(event, self.get_next_queue(queue_name, event), "amq.direct")
 
 		else:
 			for queue_name in self.next_amqp_queues:
 				#self.logger.debug(" + Forward via amqp to '%s'" % engine.amqp_queue)
-				self.amqp.publish(event, queue_name, "amq.direct")
+				self.amqp.publish(event, self.get_next_queue(queue_name, event), "amq.direct")
+
+		return 0
+
+	def get_next_queue(self, queue_name, event):
+		"""
+			Returns the queue (or the shard queue) to forward event in.
+		"""
+
+		ring = self.next_rings.get(queue_name, None)
+
+		if ring:
+			rk = event.get('rk', None)
+
+			if not rk:
+				rk = cevent.get_routingkey(event)
+
+			return ring.get_queue(queue_name, rk)
+
+		return queue_name
+
+	def publish_batch(self, events, queue_name):
+		if queue_name not in self.next_rings:
+			self.amqp.publish_many(events, queue_name, "amq.direct")
+			return
+
+		# Group events by shard queue, keeping their order
+		shard_queues = {}
+
+		for event in events:
+			shard_queues.setdefault(self.get_next_queue(queue_name, event), []).append(event)
+
+		for shard_queue in shard_queues:
+			self.amqp.publish_many(shard_queues[shard_queue], shard_queue, "amq.direct")
+
+	def next_queue_batch(self, events):
+		if not events:
+			return 0
+
+		if self.next_engines:
+			start = time.time()
+
+			for engine in self.next_engines:
+				engine._work_batch(events)
+
+			return time.time() - start
+
+		if self.next_balanced:
+			queue_name = self.get_amqp_queue.next()
+			if queue_name:
+				self.publish_batch(events, queue_name)
+
+		else:
+			for queue_name in self.next_amqp_queues:
+				self.publish_batch(events, queue_name)
+
+		return 0
 
 
 	def _beat(self):
@@ -288,6 +675,18 @@ class cengine(object):
 						'warn': self.thd_warn_sec_per_evt,
 						'crit': self.thd_crit_sec_per_evt
 					},
+					{'retention': self.perfdata_retention, 'metric': 'cps_sec_per_evt_p50', 'value': round(self.histogram.percentile(50),5), 'unit': 's' },
+					{'retention': self.perfdata_retention, 'metric': 'cps_sec_per_evt_p90', 'value': round(self.histogram.percentile(90),5), 'unit': 's' },
+					{'retention': self.perfdata_retention, 'metric': 'cps_sec_per_evt_p99', 'value': round(self.histogram.percentile(99),5), 'unit': 's' },
+					{'retention': self.perfdata_retention, 'metric': 'cps_sec_per_evt_max', 'value': round(self.histogram.max,5), 'unit': 's' },
+					{'retention': self.perfdata_retention, 'metric': 'cps_evt_over_warn', 'value': self.counter_warn, 'unit': 'evt' },
+					{'retention': self.perfdata_retention, 'metric': 'cps_evt_over_crit', 'value': self.counter_crit, 'unit': 'evt' },
+				]
+
+				pool_stats = get_pool_stats()
+				perf_data_array += [
+					{'retention': self.perfdata_retention, 'metric': 'cps_mongo_clients', 'value': pool_stats['clients'] },
+					{'retention': self.perfdata_retention, 'metric': 'cps_mongo_storages', 'value': pool_stats['storages'] },
 				]
 
 				self.logger.debug(" + State: %s" % state)
@@ -307,9 +706,15 @@ class cengine(object):
 				rk = cevent.get_routingkey(event)
 				self.amqp.publish(event, rk, self.amqp.exchange_name_events)
 
+			if self.latency_dump and self.counter_event != 0:
+				self.dump_histogram(now)
+
 			self.counter_error = 0
 			self.counter_event = 0
 			self.counter_worktime = 0
+			self.counter_warn = 0
+			self.counter_crit = 0
+			self.histogram.reset()
 
 		try:
 			self.beat()
@@ -321,6 +726,23 @@ class cengine(object):
 		finally:
 			self.beat_lock = False
 
+	def dump_histogram(self, timestamp):
+		"""
+			Append the raw latency histogram of the last stat period
+			as a JSON line (see chistogram.load to read it back).
+		"""
+
+		dump = self.histogram.dump()
+		dump['timestamp'] = timestamp
+		dump['engine'] = self.etype
+
+		try:
+			with open(self.latency_dump_path, 'a') as f:
+				f.write(json.dumps(dump) + '\n')
+
+		except IOError as err:
+			self.logger.error("Impossible to dump latency histogram: %s" % err)
+
 	def beat(self):
 		pass
 
@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+#--------------------------------
+# Copyright (c) 2011 "Capensis" [http://www.capensis.com]
+#
+# This file is part of Canopsis.
+#
+# Canopsis is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canopsis is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Canopsis.  If not, see <http://www.gnu.org/licenses/>.
+# ---------------------------------
+
+import logging, time, calendar
+import heapq, itertools
+from threading import RLock
+from cstorage import get_storage
+from caccount import caccount
+from crecord import crecord
+
+# Partition period: (seconds, collection suffix)
+PARTITIONS = {
+	'hour': (3600, '%Y%m%d%H'),
+	'day': (86400, '%Y%m%d')
+}
+
+
+class logkey(object):
+	"""
+		Order logs on (key, direction) of 'sort', like MongoDB does.
+	"""
+
+	def __init__(self, record, sort):
+		self.record = record
+		self.sort = sort or []
+		self.values = [record._id if key == '_id' else record.data.get(key, None) for key, direction in self.sort]
+
+	def __lt__(self, other):
+		for (key, direction), value, other_value in zip(self.sort, self.values, other.values):
+			if value != other_value:
+				if direction == -1:
+					return value > other_value
+
+				return value < other_value
+
+		return False
+
+
+class ceventlog(object):
+	"""
+		Writer of engine-owned event logs (events_log).
+
+		Logs are inserted as raw documents by bulks of 'bulk_size' logs or
+		every 'bulk_interval' ms (0 inserts at once), without the crecord
+		read and the ACL checks of cstorage.put.
+
+		With 'partition' ('hour' or 'day'), logs are written in one
+		collection per period of their write time (<namespace>_<UTC start
+		of period>), created with the indexes of <namespace>. 'retention'
+		(seconds) drops whole partitions instead of deleting logs.
+
+		Reads fan out over <namespace> and all the partitions written
+		since the start of the requested time range, whatever the
+		configured 'partition': late events are in later partitions, but
+		an event stamped in the future is only found from its write time.
+		The list of partitions is read again every 'partitions_ttl'
+		seconds, and on purge.
+	"""
+
+	def __init__(self, namespace='events_log', storage=None, partition=None, retention=0, bulk_size=1, bulk_interval=1000, partitions_ttl=60, logging_level=logging.ERROR):
+		self.logger = logging.getLogger('ceventlog')
+		self.logger.setLevel(logging_level)
+
+		self.namespace = namespace
+
+		if partition and partition not in PARTITIONS:
+			raise ValueError("Invalid partition '%s' (%s)" % (partition, ', '.join(PARTITIONS.keys())))
+
+		self.partition = partition
+		self.retention = retention
+		self.bulk_size = bulk_size
+		self.bulk_interval = bulk_interval
+
+		self.account = caccount(user="root", group="root")
+
+		if not storage:
+			self.storage = get_storage(namespace=namespace, logging_level=logging_level)
+		else:
+			self.storage = storage
+
+		# ACL and crecord fields of a log, dumped once
+		record = crecord({}, type='event')
+		record.chown(self.account.user)
+		record.chgrp(self.account.group)
+		record.chmod("o+r")
+
+		self.template = record.dump()
+		del self.template['_id']
+
+		# Pending logs: partition -> documents
+		self.pending = {}
+		self.pending_count = 0
+		self.pending_lock = RLock()
+		self.flush_last = time.time()
+
+		# Partitions known to exist (indexes ensured)
+		self.partitions = None
+		self.partitions_ttl = partitions_ttl
+		self.partitions_time = 0
+
+	def get_partition(self, timestamp):
+		if not self.partition:
+			return self.namespace
+
+		period, suffix = PARTITIONS[self.partition]
+		start = int(timestamp) - int(timestamp) % period
+
+		return '%s_%s' % (self.namespace, time.strftime(suffix, time.gmtime(start)))
+
+	def get_partition_range(self, namespace):
+		"""
+			Return (start, period) of partition 'namespace' or None.
+		"""
+
+		suffix = namespace[len(self.namespace) + 1:]
+
+		for period, fmt in PARTITIONS.values():
+			if len(suffix) != len(time.strftime(fmt, time.gmtime(0))):
+				continue
+
+			try:
+				return (calendar.timegm(time.strptime(suffix, fmt)), period)
+
+			except ValueError:
+				pass
+
+		return None
+
+	def list_partitions(self, refresh=False):
+		"""
+			Return sorted (start, period, namespace) of existing partitions.
+		"""
+
+		now = time.time()
+
+		if self.partitions is None or refresh or now - self.partitions_time > self.partitions_ttl:
+			prefix = self.namespace + '_'
+			self.partitions = {}
+			self.partitions_time = now
+
+			for namespace in self.storage.db.collection_names():
+				if namespace.startswith(prefix):
+					prange = self.get_partition_range(namespace)
+
+					if prange:
+						self.partitions[namespace] = prange
+
+		return sorted([prange + (namespace,) for namespace, prange in self.partitions.iteritems()])
+
+	def create_partition(self, namespace):
+		self.list_partitions()
+
+		if namespace in self.partitions:
+			return
+
+		self.logger.info("Create partition %s" % namespace)
+
+		indexes = self.storage.get_backend(self.namespace).index_information()
+		backend = self.storage.get_backend(namespace)
+
+		for name, index in indexes.iteritems():
+			if name != '_id_':
+				backend.ensure_index(index['key'])
+
+		self.partitions[namespace] = self.get_partition_range(namespace)
+
+	def log(self, _id, event, now=None):
+		"""
+			Queue a log of event '_id', return the id of the log.
+		"""
+
+		if now is None:
+			now = time.time()
+
+		document = self.template.copy()
+		document.update(event)
+
+		document['event_id'] = _id
+		document['_id'] = '%s.%s' % (_id, now)
+		document['crecord_write_time'] = int(now)
+
+		# Not on the event timestamp, late events would create partitions to purge
+		namespace = self.get_partition(now)
+
+		with self.pending_lock:
+			self.pending.setdefault(namespace, []).append(document)
+			self.pending_count += 1
+
+		self.flush()
+
+		return document['_id']
+
+	def flush(self, force=False):
+		with self.pending_lock:
+			now = time.time()
+
+			if not self.pending_count:
+				self.flush_last = now
+				return 0
+
+			if not force and self.pending_count < self.bulk_size and (now - self.flush_last) * 1000 < self.bulk_interval:
+				return 0
+
+			pending = self.pending
+			count = self.pending_count
+
+			self.pending = {}
+			self.pending_count = 0
+			self.flush_last = now
+
+			for namespace in pending:
+				documents = pending[namespace]
+
+				try:
+					if self.partition:
+						self.create_partition(namespace)
+
+					self.logger.debug("Insert %s log(s) in %s" % (len(documents), namespace))
+					self.storage.get_backend(namespace).insert(documents, continue_on_error=True)
+
+				except Exception, err:
+					self.logger.error("Impossible to insert %s log(s) in %s: %s" % (len(documents), namespace, err))
+
+			return count
+
+	def purge(self, now=None):
+		"""
+			Drop partitions older than 'retention'.
+		"""
+
+		if not self.retention:
+			return []
+
+		if now is None:
+			now = time.time()
+
+		dropped = []
+
+		for start, period, namespace in self.list_partitions(refresh=True):
+			if start + period < now - self.retention:
+				self.logger.info("Drop partition %s" % namespace)
+				self.storage.drop_namespace(namespace)
+
+				del self.partitions[namespace]
+				dropped.append(namespace)
+
+		return dropped
+
+	def get_namespaces(self, start=None):
+		"""
+			Return namespaces holding logs of events since 'start'.
+		"""
+
+		namespaces = [self.namespace]
+
+		for pstart, period, namespace in self.list_partitions():
+			if start is not None and pstart + period <= start:
+				continue
+
+			namespaces.append(namespace)
+
+		return namespaces
+
+	def find(self, mfilter={}, start=None, stop=None, sort='timestamp', account=None, limit=0, offset=0, search_after=None, with_total=False, total_ttl=0):
+		"""
+			Find logs over all partitions between 'start' and 'stop'.
+
+			Each partition is sorted and limited by MongoDB, then sorted
+			partitions are merged. With 'offset', 'offset' + 'limit' logs
+			are read from each partition, 'search_after' pages by keyset
+			like cstorage.find.
+		"""
+
+		if not account:
+			account = self.account
+
+		self.flush(force=True)
+
+		timestamp = {}
+
+		if start is not None:
+			timestamp['$gte'] = start
+
+		if stop is not None:
+			timestamp['$lte'] = stop
+
+		if timestamp:
+			mfilter = {'$and': [mfilter, {'timestamp': timestamp}]}
+
+		if isinstance(sort, basestring):
+			sort = [(sort, 1)]
+
+		if search_after is not None:
+			sort = self.storage.get_keyset_sort(sort)
+
+		plimit = 0
+
+		if limit:
+			plimit = offset + limit
+
+		namespaces = self.get_namespaces(start)
+		partitions = []
+
+		for namespace in namespaces:
+			records = self.storage.find(dict(mfilter), namespace=namespace, account=account, sort=sort, limit=plimit, search_after=search_after)
+			partitions.append([logkey(record, sort) for record in records])
+
+		if sort:
+			keys = heapq.merge(*partitions)
+		else:
+			keys = itertools.chain(*partitions)
+
+		records = [key.record for key in itertools.islice(keys, offset, plimit or None)]
+
+		if with_total:
+			total = 0
+
+			for namespace in namespaces:
+				total += self.storage.find(dict(mfilter), namespace=namespace, account=account, count=True, total_ttl=total_ttl)
+
+			return records, total
+
+		return records
+
+	def remove(self, mfilter):
+		self.flush(force=True)
+
+		for namespace in self.get_namespaces():
+			self.storage.get_backend(namespace).remove(mfilter, safe=True)
+
+	def drop(self):
+		with self.pending_lock:
+			self.pending = {}
+			self.pending_count = 0
+
+		for namespace in self.get_namespaces():
+			self.storage.drop_namespace(namespace)
+
+		self.partitions = None
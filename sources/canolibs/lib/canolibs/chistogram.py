@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+#--------------------------------
+# Copyright (c) 2011 "Capensis" [http://www.capensis.com]
+#
+# This file is part of Canopsis.
+#
+# Canopsis is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canopsis is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Canopsis.  If not, see <http://www.gnu.org/licenses/>.
+# ---------------------------------
+
+import math
+
+
+class chistogram(object):
+	"""
+		Fixed memory histogram of durations (in seconds).
+
+		Buckets grow geometrically from 'vmin' by 'factor', so each
+		percentile is known within (factor - 1) relative error whatever
+		the number of recorded values. Values under 'vmin' go in the
+		first bucket, values above the last bucket in the last one.
+	"""
+
+	def __init__(self, vmin=0.00001, vmax=1000, factor=1.1):
+		self.vmin = vmin
+		self.vmax = vmax
+		self.factor = factor
+
+		self.log_factor = math.log(factor)
+		self.size = int(math.ceil(math.log(vmax / vmin) / self.log_factor)) + 2
+
+		self.reset()
+
+	def reset(self):
+		self.counts = [0] * self.size
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+
+	def get_bucket(self, value):
+		if value < self.vmin:
+			return 0
+
+		bucket = int(math.log(value / self.vmin) / self.log_factor) + 1
+
+		return min(bucket, self.size - 1)
+
+	def get_bound(self, bucket):
+		""" Upper bound of a bucket """
+
+		return self.vmin * self.factor ** bucket
+
+	def add(self, value, count=1):
+		self.counts[self.get_bucket(value)] += count
+		self.count += count
+		self.total += value * count
+
+		if value > self.max:
+			self.max = value
+
+	def percentile(self, p):
+		if not self.count:
+			return 0.0
+
+		rank = math.ceil(self.count * p / 100.0)
+		seen = 0
+
+		for bucket, count in enumerate(self.counts):
+			seen += count
+
+			if seen >= rank:
+				return min(self.get_bound(bucket), self.max)
+
+		return self.max
+
+	def mean(self):
+		if not self.count:
+			return 0.0
+
+		return self.total / self.count
+
+	def merge(self, other):
+		if (other.vmin, other.factor, other.size) != (self.vmin, self.factor, self.size):
+			raise ValueError('Incompatible histograms')
+
+		for bucket, count in enumerate(other.counts):
+			self.counts[bucket] += count
+
+		self.count += other.count
+		self.total += other.total
+		self.max = max(self.max, other.max)
+
+	def dump(self):
+		""" Returns a JSON serializable dict, with non-empty buckets only """
+
+		return {
+			'vmin': self.vmin,
+			'vmax': self.vmax,
+			'factor': self.factor,
+			'count': self.count,
+			'total': self.total,
+			'max': self.max,
+			'buckets': dict([
+				(str(bucket), count)
+				for bucket, count in enumerate(self.counts) if count
+			])
+		}
+
+	@staticmethod
+	def load(dump):
+		histogram = chistogram(vmin=dump['vmin'], vmax=dump['vmax'], factor=dump['factor'])
+
+		for bucket, count in dump['buckets'].items():
+			histogram.counts[int(bucket)] = count
+
+		histogram.count = dump['count']
+		histogram.total = dump['total']
+		histogram.max = dump['max']
+
+		return histogram
@@ -22,16 +22,20 @@
 # http://docs.mongodb.org/manual/reference/operator/
 
 import re
+import json
 import operator
+import threading
 
-def field_check(mfilter, event, key):
-	cond = {'$lt': operator.lt,
-		'$lte': operator.le,
-		'$gt': operator.gt,
-		'$gte': operator.ge,
-		'$ne': operator.ne,
-		'$eq': operator.eq}
+from collections import OrderedDict
+
+cond = {'$lt': operator.lt,
+	'$lte': operator.le,
+	'$gt': operator.gt,
+	'$gte': operator.ge,
+	'$ne': operator.ne,
+	'$eq': operator.eq}
 
+def field_check(mfilter, event, key):
 	for op in mfilter[key]:
 		if op == '$exists':
 			#check if key is in event
@@ -161,3 +165,243 @@ def regex_match(phrase, pattern, options=None):
 	return bool(re.search(str(pattern), str(phrase), options))
 
 
+
+def equality_constraints(mfilter, fields):
+	"""
+		Returns {field: value} for the fields an event must be equal to
+		for check(mfilter, event) to be True. Only plain equalities are
+		extracted (also from '$and' elements), nothing is extracted next
+		to an '$or', which can match before other keys are checked.
+	"""
+
+	constraints = {}
+
+	if not isinstance(mfilter, dict) or '$or' in mfilter:
+		return constraints
+
+	for key in mfilter:
+		value = mfilter[key]
+
+		if key == '$and' and isinstance(value, list):
+			for element in value:
+				for field, fvalue in equality_constraints(element, fields).items():
+					constraints.setdefault(field, fvalue)
+
+		elif key in fields and not isinstance(value, (dict, list)):
+			constraints[key] = value
+
+	return constraints
+
+## Compiled filters
+
+CACHE_SIZE = 1024
+
+cache = OrderedDict()
+cache_lock = threading.Lock()
+
+def compile(mfilter):
+	"""
+		Turn a filter into a predicate 'f(event) -> bool', returning the
+		same results as check(mfilter, event).
+
+		Compiled filters are cached (LRU) on their canonical JSON, so
+		engines reloading the same rules on each beat compile them once.
+	"""
+
+	try:
+		key = json.dumps(mfilter, sort_keys=True)
+
+	except (TypeError, ValueError):
+		return compile_check(mfilter)
+
+	with cache_lock:
+		predicate = cache.pop(key, None)
+
+		if predicate is None:
+			predicate = compile_check(mfilter)
+
+			if len(cache) >= CACHE_SIZE:
+				cache.popitem(last=False)
+
+		cache[key] = predicate
+
+	return predicate
+
+def compile_check(mfilter):
+	"""
+		Compile check(). Each step returns False (no match), True (match,
+		stop here, like '$or' does) or None (go on with next key).
+	"""
+
+	try:
+		steps = [compile_key(mfilter, key) for key in mfilter]
+
+	except Exception:
+		# Let check() behave (or raise) as usual on malformed filters
+		return lambda event: check(mfilter, event)
+
+	def predicate(event):
+		for step in steps:
+			result = step(event)
+
+			if result is not None:
+				return result
+
+		return True
+
+	if 'connector_name' in mfilter:
+		connector_name = mfilter['connector_name']
+		check_steps = predicate
+
+		def predicate(event):
+			if 'connector_name' in event and connector_name != event['connector_name']:
+				return False
+
+			return check_steps(event)
+
+	return predicate
+
+def compile_key(mfilter, key):
+	value = mfilter[key]
+
+	if key == '$and':
+		predicates = [compile_check(element) for element in value]
+
+		def step(event):
+			for predicate in predicates:
+				if not predicate(event):
+					return False
+
+	elif key == '$or':
+		predicates = [compile_check(element) for element in value]
+
+		def step(event):
+			for predicate in predicates:
+				if predicate(event):
+					return True
+
+			return False
+
+	elif key == '$nor':
+		predicates = [compile_check(element) for element in value]
+
+		def step(event):
+			for predicate in predicates:
+				if predicate(event):
+					return False
+
+	elif not isinstance(value, dict):
+		def step(event):
+			if key not in event or event[key] != value:
+				return False
+
+	elif '$in' in value:
+		values = value['$in']
+
+		def step(event):
+			if key not in event:
+				return False
+
+			if not len([x for x in event[key] if any(y in x for y in values)]):
+				return False
+
+	elif '$nin' in value:
+		def step(event):
+			if key not in event:
+				return False
+
+			# Same lookup as check(), which reads '$in' here
+			if len([x for x in event[key] if any(y in x for y in value['$in'])]):
+				return False
+
+	else:
+		field_predicate = compile_field(mfilter, key)
+
+		def step(event):
+			if key not in event:
+				return False
+
+			if not field_predicate(event) and event[key] != value:
+				return False
+
+	return step
+
+def compile_field(mfilter, key):
+	"""
+		Compile field_check(mfilter, event, key).
+	"""
+
+	spec = mfilter[key]
+	tests = []
+
+	for op in spec:
+		if op == '$exists':
+			if spec[op]:
+				tests.append(lambda event: key in event)
+			else:
+				tests.append(lambda event: key not in event)
+
+		elif op in ['$eq', '$ne', '$gt', '$gte', '$lt', '$lte']:
+			tests.append(lambda event, func=cond[op], operand=spec[op]: func(event[key], operand))
+
+		elif op == '$regex' or (op == '$options' and "$regex" in spec):
+			tests.append(compile_regex(key, spec["$regex"], spec.get("$options", None)))
+
+		elif op == '$in':
+			tests.append(lambda event, values=spec[op]: event[key] in values)
+
+		elif op == '$nin':
+			tests.append(lambda event, values=spec[op]: event[key] not in values)
+
+		elif op == '$not':
+			reverse = compile_field({key: spec[op]}, key)
+			tests.append(lambda event, reverse=reverse: not reverse(event))
+
+		elif op == '$all':
+			def test_all(event, items_required=spec[op]):
+				items = event[key]
+
+				if not isinstance(items, list):
+					items = [items]
+
+				for item in items_required:
+					if item not in items:
+						return False
+
+				return True
+
+			tests.append(test_all)
+
+		else:
+			tests.append(lambda event: event[key] == spec)
+
+	def predicate(event):
+		for test in tests:
+			if not test(event):
+				return False
+
+		return True
+
+	return predicate
+
+def compile_regex(key, pattern, options=None):
+	"""
+		Compile regex_match(event[key], pattern, options).
+	"""
+
+	options = regex_computeoptions(options)
+
+	if not pattern or not options:
+		return lambda event: False
+
+	regex = re.compile(str(pattern), options)
+
+	def test(event):
+		phrase = event[key]
+
+		if not phrase:
+			return False
+
+		return bool(regex.search(str(phrase)))
+
+	return test
@@ -123,6 +123,9 @@ class crecord(object):
 		del dump['children']
 		del dump['parent']			
 
+		# Computed by dump
+		dump.pop('aaa_readers', None)
+
 		self.data = dump.copy()
 
 	def save(self, storage=None):
@@ -151,7 +154,10 @@ class crecord(object):
 		dump['parent'] =  self.parent
 		dump['children'] =  self.children
 		
-		dump['aaa_admin_group'] = self.admin_group
+		admin_group = dump.get('aaa_admin_group', None) or 'group.CPS_%s_admin' % dump['crecord_type']
+
+		dump['aaa_admin_group'] = admin_group
+		dump['aaa_readers'] = make_readers(dump['aaa_owner'], dump['aaa_group'], admin_group, dump['aaa_access_owner'], dump['aaa_access_group'], dump['aaa_access_other'], dump['aaa_access_unauth'])
 
 		if json:
 			# Clean objectid
@@ -219,6 +225,14 @@ class crecord(object):
 	def __str__(self):
 		return str(self.dump())
 
+	def get_readers(self):
+		"""
+			Return who can read this record, as matched by
+			caccount.get_principals.
+		"""
+
+		return make_readers(self.owner, self.group, self.admin_group, self.access_owner, self.access_group, self.access_other, self.access_unauth)
+
 	def check_write(self, account):
 		if account:
 			if account.user == 'root' or account.group == 'group.CPS_root' or 'group.CPS_root' in account.groups:
@@ -349,6 +363,159 @@ class crecord(object):
 		if autosave and self.storage:
 			self.save()
 
+def make_readers(owner, group, admin_group, access_owner, access_group, access_other, access_unauth):
+	readers = []
+
+	if owner and 'r' in access_owner:
+		readers.append(owner)
+
+	if group and 'r' in access_group:
+		readers.append(group)
+
+	if admin_group:
+		readers.append(admin_group)
+
+	if 'r' in access_other:
+		readers.append('other')
+
+	if 'r' in access_unauth:
+		readers.append('unauth')
+
+	return readers
+
+def copy_default(default):
+	if isinstance(default, list):
+		return list(default)
+
+	return default
+
+def raw_property(key, default=None):
+	"""
+		Property on raw[key] of a crawrecord, 'default' is set on first read.
+	"""
+
+	def fget(self):
+		raw = self.raw
+
+		if key not in raw:
+			raw[key] = copy_default(default)
+
+		return raw[key]
+
+	def fset(self, value):
+		self.raw[key] = value
+
+	return property(fget, fset)
+
+class crawrecord(object):
+	"""
+		Record view on a raw document, for engine-owned documents: crecord
+		fields are read and written in 'raw' without copy, and 'data' is
+		'raw' itself. ACL fields are only set when read, 'aaa_readers'
+		only computed by dump.
+
+		It can be put with cstorage.put like a crecord, and
+		cstorage.find(view=True) returns them.
+	"""
+
+	__slots__ = ('raw', 'binary', 'storage')
+
+	def __init__(self, raw_record=None, type=None, owner=None, group=None, storage=None):
+		if raw_record is None:
+			raw_record = {}
+
+		self.raw = raw_record
+		self.binary = None
+		self.storage = storage
+
+		if type:
+			self.type = type
+
+		self.chown(owner)
+		self.chgrp(group)
+
+	_id = raw_property('_id')
+	owner = raw_property('aaa_owner')
+	group = raw_property('aaa_group')
+	access_owner = raw_property('aaa_access_owner', ['r', 'w'])
+	access_group = raw_property('aaa_access_group', ['r'])
+	access_other = raw_property('aaa_access_other', [])
+	access_unauth = raw_property('aaa_access_unauth', [])
+	type = raw_property('crecord_type', 'raw')
+	name = raw_property('crecord_name', 'noname')
+	write_time = raw_property('crecord_write_time')
+	enable = raw_property('enable', True)
+	parent = raw_property('parent', [])
+	children = raw_property('children', [])
+
+	# Raw fields of a crecord dump, with their defaults
+	defaults = {
+		'_id': None,
+		'aaa_owner': None,
+		'aaa_group': None,
+		'crecord_type': 'raw',
+		'crecord_name': 'noname',
+		'crecord_write_time': None,
+		'enable': True
+	}
+
+	list_defaults = (
+		('aaa_access_owner', ['r', 'w']),
+		('aaa_access_group', ['r']),
+		('aaa_access_other', []),
+		('aaa_access_unauth', []),
+		('parent', []),
+		('children', [])
+	)
+
+	@property
+	def data(self):
+		return self.raw
+
+	@property
+	def admin_group(self):
+		return self.raw.get('aaa_admin_group', None) or 'group.CPS_%s_admin' % self.type
+
+	@admin_group.setter
+	def admin_group(self, admin_group):
+		self.raw['aaa_admin_group'] = admin_group
+
+	chown = crecord.__dict__['chown']
+	chgrp = crecord.__dict__['chgrp']
+	chmod = crecord.__dict__['chmod']
+	check_write = crecord.__dict__['check_write']
+	save = crecord.__dict__['save']
+
+	def dump(self, json=False):
+		dump = dict(self.defaults)
+		dump.update(self.raw)
+
+		for key, default in self.list_defaults:
+			if key not in dump:
+				dump[key] = list(default)
+
+		admin_group = dump.get('aaa_admin_group', None) or 'group.CPS_%s_admin' % dump['crecord_type']
+
+		dump['aaa_admin_group'] = admin_group
+		dump['aaa_readers'] = make_readers(dump['aaa_owner'], dump['aaa_group'], admin_group, dump['aaa_access_owner'], dump['aaa_access_group'], dump['aaa_access_other'], dump['aaa_access_unauth'])
+
+		if json:
+			# Clean objectid
+			for key in dump:
+				if isinstance(dump[key], objectid.ObjectId):
+					dump[key] = str(dump[key])
+
+			dump['parent'] = [str(item) for item in dump['parent']]
+			dump['children'] = [str(item) for item in dump['children']]
+
+		return dump
+
+	def get_readers(self):
+		return self.dump()['aaa_readers']
+
+	def __str__(self):
+		return str(self.dump())
+
 def access_to_str(access):
 	output = ''
 
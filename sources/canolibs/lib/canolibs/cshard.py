@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+#--------------------------------
+# Copyright (c) 2011 "Capensis" [http://www.capensis.com]
+#
+# This file is part of Canopsis.
+#
+# Canopsis is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canopsis is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Canopsis.  If not, see <http://www.gnu.org/licenses/>.
+# ---------------------------------
+
+from bisect import bisect
+import hashlib
+
+
+class cshard(object):
+	"""
+		Consistent hash ring spreading keys (event routing keys) over
+		a fixed number of shards.
+
+		A key always reaches the same shard, so events of a same rk are
+		processed in order by a single worker. When the number of shards
+		changes, only about 1/N of the keys move to another shard:
+		stop the upstream engines, wait for the shard queues to be
+		drained, then restart workers and upstream engines with the new
+		number of shards.
+	"""
+
+	def __init__(self, shards, replicas=64):
+		self.shards = shards
+		self.replicas = replicas
+
+		ring = []
+
+		for shard in range(shards):
+			for replica in range(replicas):
+				ring.append((self.hash('{0}-{1}'.format(shard, replica)), shard))
+
+		ring.sort()
+
+		self.ring_hashes = [h for h, shard in ring]
+		self.ring_shards = [shard for h, shard in ring]
+
+	@staticmethod
+	def hash(key):
+		if isinstance(key, unicode):
+			key = key.encode('utf-8')
+
+		return int(hashlib.md5(key).hexdigest()[:8], 16)
+
+	def get_shard(self, key):
+		if self.shards <= 1:
+			return 0
+
+		index = bisect(self.ring_hashes, self.hash(key))
+
+		if index == len(self.ring_hashes):
+			index = 0
+
+		return self.ring_shards[index]
+
+	def get_queue(self, queue_name, key):
+		return get_shard_queue(queue_name, self.get_shard(key))
+
+
+def get_shard_queue(queue_name, shard):
+	return '{0}.{1}'.format(queue_name, shard)
@@ -20,11 +20,36 @@
 
 from cstorage import cstorage
 from crecord import crecord
+from crecord import crawrecord
 from caccount import caccount
 from ctimer import ctimer
 
 import logging, random
 
+def bench_records(nb):
+	## Build and dump records of events, without DB
+	event = {'component': 'bench', 'resource': 'bench', 'state': 0, 'state_type': 1, 'output': 'bench'}
+
+	timer.start()
+	for i in range(0, nb):
+		record = crecord(event)
+		record.type = 'event'
+		record.chmod('o+r')
+		record.dump()
+	timer.stop()
+	crecord_speed = int(nb / timer.elapsed)
+
+	timer.start()
+	for i in range(0, nb):
+		record = crawrecord(dict(event), type='event')
+		record.chmod('o+r')
+		record.dump()
+	timer.stop()
+	crawrecord_speed = int(nb / timer.elapsed)
+
+	print " + crecord Speed:",crecord_speed,"records/s (%s records)" % nb
+	print " + crawrecord Speed:",crawrecord_speed,"records/s (%s records)" % nb
+
 def go(account, nb):
 	storage.account=account
 	## Insert 1000 records
@@ -43,6 +68,12 @@ def go(account, nb):
 	read_nb = len(records)
 	read_speed = int(read_nb / timer.elapsed)
 
+	## Read all records as views
+	timer.start()
+	view_nb = len(storage.find(view=True))
+	timer.stop()
+	view_speed = int(view_nb / timer.elapsed)
+
 	## Update records
 	new_records = []
 	for record in records:
@@ -64,6 +95,7 @@ def go(account, nb):
 	
 	print " + Insert Speed:",insert_speed,"records/s (%s records)" % insert_nb
 	print " + Read Speed:",read_speed,"records/s (%s records)" % read_nb
+	print " + Read Speed (view):",view_speed,"records/s (%s records)" % view_nb
 	print " + Update Speed:",update_speed,"records/s (%s records)" % update_nb
 	print " + Remove Speed:",remove_speed,"records/s (%s records)" % remove_nb
 
@@ -74,6 +106,9 @@ account = caccount()
 storage = cstorage(account=account, namespace=namespace, logging_level=logging.INFO)
 timer = ctimer(logging_level=logging.INFO)
 
+print "Bench of event records ..."
+bench_records(50000)
+
 print "Bench with 'anonymous' account ..."
 account = caccount()
 go(account, 5000)
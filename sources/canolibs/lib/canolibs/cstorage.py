@@ -23,6 +23,7 @@ import time
 import sys
 import os
 import ConfigParser
+import threading
 
 import gridfs
 
@@ -31,12 +32,17 @@ from bson import objectid
 
 from pymongo import ASCENDING
 from pymongo import DESCENDING
+from pymongo.errors import BulkWriteError
+from pymongo.errors import DuplicateKeyError
 
 from caccount import caccount
 from crecord import crecord
+from crecord import crawrecord
 from cfile import cfile
 
-from operator import itemgetter
+
+# Record types accepted by put and remove
+RECORDS = (crecord, crawrecord)
 
 CONFIG = ConfigParser.RawConfigParser()
 CONFIG.read(os.path.expanduser('~/etc/cstorage.conf'))
@@ -91,6 +97,10 @@ class cstorage(object):
 		self.logger.debug("Object initialised.")
 
 		self.backend = {}
+		# Totals cache: (collection, filter) -> (timestamp, total)
+		self.totals = {}
+		# ACL filters cache: account -> (Read_mfilter, Write_mfilter)
+		self.mongofilters = {}
 		self.connected = False
 
 		if mongo_autoconnect:
@@ -104,18 +114,23 @@ class cstorage(object):
 			return _id
 
 	def make_mongofilter(self, account):
+		"""
+			Return (Read_mfilter, Write_mfilter) of 'account', cached per
+			account and groups. Reads match the indexed 'aaa_readers'.
+		"""
+
+		key = (account._id, account.user, account.group, tuple(account.groups))
+
+		try:
+			return self.mongofilters[key]
+		except KeyError:
+			pass
+
 		Read_mfilter = {}
 		Write_mfilter = {}
 
 		if account._id != "account.root" and account.group != "group.CPS_root" and not 'group.CPS_root' in account.groups:
-			Read_mfilter = { '$or': [
-				{'aaa_owner': account._id, 'aaa_access_owner': 'r'},
-				{'aaa_group': account.group, 'aaa_access_group': 'r'},
-				{'aaa_group': {'$in': account.groups}, 'aaa_access_group': 'r'},
-				{'aaa_admin_group':account.group},
-				{'aaa_admin_group':{'$in': account.groups}},
-				{'aaa_access_unauth': 'r'}
-			] }
+			Read_mfilter = { 'aaa_readers': { '$in': account.get_principals() } }
 
 			Write_mfilter = { '$or': [
 				{'aaa_owner': account._id, 'aaa_access_owner': 'w'},
@@ -127,9 +142,13 @@ class cstorage(object):
 			] }
 
 			if account.user != "anonymous":
-				Read_mfilter['$or'].append({'aaa_access_other': 'r'})
 				Write_mfilter['$or'].append({'aaa_access_other': 'w'})
 
+		if len(self.mongofilters) >= 1024:
+			self.mongofilters.clear()
+
+		self.mongofilters[key] = (Read_mfilter, Write_mfilter)
+
 		return (Read_mfilter, Write_mfilter)
 
 
@@ -137,24 +156,9 @@ class cstorage(object):
 		if self.connected:
 			return True
 
-		if self.mongo_userid and self.mongo_password:
-			uri = 'mongodb://{0}:{1}@{2}:{3}/{4}'.format(
-				self.mongo_userid,
-				self.mongo_password,
-				self.mongo_host,
-				self.mongo_port,
-				self.mongo_db
-			)
-
-		else:
-			uri = 'mongodb://{0}:{1}/{2}'.format(
-				self.mongo_host,
-				self.mongo_port,
-				self.mongo_db
-			)
-
-		self.conn=Connection(uri, safe=True)
-		self.db=self.conn[self.mongo_db]
+		self.conn = get_client(self.mongo_host, self.mongo_port, self.mongo_db, self.mongo_userid, self.mongo_password)
+		self.db = self.conn[self.mongo_db]
+		self.pid = os.getpid()
 
 		try:
 			self.gridfs_namespace = CONFIG.get("master", "gridfs_namespace")
@@ -169,8 +173,10 @@ class cstorage(object):
 
 	def disconnect(self):
 		if self.connected:
+			# The client is shared, only leave it
 			self.conn.fsync()
 			del self.conn
+			self.backend = {}
 			self.connected = False
 
 	def check_connected(self):
@@ -180,6 +186,13 @@ class cstorage(object):
 		if not self.connected:
 			raise Exception("CSTORAGE is not connected %s" % id(self))
 
+		if self.pid != os.getpid():
+			# Forked, the client of the parent can't be shared
+			self.logger.debug("Reconnect after fork %s" % id(self))
+			self.connected = False
+			self.backend = {}
+			self.connect()
+
 	def get_backend(self, namespace=None):
 		self.check_connected()
 
@@ -198,22 +211,129 @@ class cstorage(object):
 
 
 	def update(self, _id, data, namespace=None, account=None):
+		"""
+			Set 'data' fields of a record in one conditional update, the
+			write rights of 'account' are part of the query.
+		"""
+
 		self.check_connected()
 
 		if not isinstance(data, dict):
 			raise Exception('Invalid data, must be a dict ...')
 
+		if not account:
+			account = self.account
+
 		data['crecord_write_time'] = int(time.time())
 
-		# Check if record exist
-		count = self.count({'_id': _id}, namespace=namespace, account=account, for_write=True)
-		if count:
-			backend = self.get_backend(namespace)
-			backend.update({ '_id': self.clean_id(_id) }, { "$set": data });
-		else:
+		backend = self.get_backend(namespace)
+
+		ret = backend.update(self.make_write_query(self.clean_id(_id), account), { "$set": data }, safe=True)
+
+		if not ret['updatedExisting']:
 			raise KeyError("'%s' not found ..." % _id)
 
+	def make_write_query(self, _id, account):
+		"""
+			Match '_id' only if 'account' can write it.
+		"""
+
+		(Read_mfilter, Write_mfilter) = self.make_mongofilter(account)
+
+		query = dict(Write_mfilter)
+		query['_id'] = _id
+
+		return query
+
+	def get_write_ids(self, backend, ids):
+		"""
+			Return 'ids' as stored: a string of 24 hex characters is an
+			ObjectId only if such a record exists, new records keep their
+			string '_id'.
+		"""
+
+		oids = []
+
+		for _id in ids:
+			if isinstance(_id, basestring):
+				oid = self.clean_id(_id)
+
+				if isinstance(oid, objectid.ObjectId):
+					oids.append(oid)
+
+		if not oids:
+			return list(ids)
+
+		existing = set([raw['_id'] for raw in backend.find({'_id': {'$in': oids}}, fields=['_id'])])
+
+		write_ids = []
+
+		for _id in ids:
+			if isinstance(_id, basestring) and self.clean_id(_id) in existing:
+				_id = self.clean_id(_id)
+
+			write_ids.append(_id)
+
+		return write_ids
+
+	def prepare_put(self, record, account, mset=False):
+		"""
+			Return the (_id, document) to write for 'record'.
+		"""
+
+		if not record.owner:
+			record.chown(account.user)
+
+		if not record.group:
+			record.chgrp(account.group)
+
+		## Check if record have binary and store in grid fs
+		if record.binary:
+			record.data['binary_id'] = self.put_binary(record.binary, record.data['file_name'], record.data['content_type'])
+
+		record.write_time = int(time.time())
+		data = record.dump()
+
+		_id = data.pop('_id')
+
+		if not _id:
+			data['crecord_creation_time'] = record.write_time
+			return None, data
+
+		# A record without its creation time is not a replacement, the
+		# creation time of an existing record is kept
+		if mset or not data.get('crecord_creation_time', None):
+			creation_time = data.pop('crecord_creation_time', None) or record.write_time
+			return _id, { '$set': data, '$setOnInsert': { 'crecord_creation_time': creation_time } }
+
+		return _id, data
+
+	def get_duplicate_status(self, backend, _id, account):
+		"""
+			Return why an upsert of '_id' raised a duplicate key error:
+			'denied' if the record exists but 'account' can't write it,
+			'retry' if it was inserted by a concurrent write, else 'error'
+			(another unique index).
+		"""
+
+		if not _id:
+			return 'error'
+
+		if backend.find_one(self.make_write_query(_id, account), fields=['_id']):
+			return 'retry'
+
+		if backend.find_one({'_id': _id}, fields=['_id']):
+			return 'denied'
+
+		return 'error'
+
 	def put(self, _record_or_records, account=None, namespace=None, mset=False):
+		"""
+			Write records in one round-trip each: an insert without '_id',
+			else an upsert matching the write rights of 'account'. A
+			record that exists but is not writable raises ValueError.
+		"""
+
 		self.check_connected()
 
 		if not account:
@@ -223,7 +343,7 @@ class cstorage(object):
 		return_ids = []
 
 
-		if isinstance(_record_or_records, crecord):
+		if isinstance(_record_or_records, RECORDS):
 			records = [_record_or_records]
 		elif isinstance(_record_or_records, list):
 			records = _record_or_records
@@ -232,113 +352,154 @@ class cstorage(object):
 
 		backend = self.get_backend(namespace)
 
+		# Rights are only known from an acknowledged write
+		(Read_mfilter, Write_mfilter) = self.make_mongofilter(account)
+		safe = self.mongo_safe or bool(Write_mfilter)
+
 		self.logger.debug("Put %s record(s) ..." % len(records))
 		for record in records:
-			_id = record._id
+			try:
+				_id, data = self.prepare_put(record, account, mset=mset)
 
-			if not record.owner:
-				record.chown(account.user)
+				if not _id:
+					self.logger.debug("Insert new record")
+					_id = backend.insert(data, safe=self.mongo_safe, w=1)
+				else:
+					self.logger.debug("Upsert record '%s'" % _id)
+					_id = self.get_write_ids(backend, [_id])[0]
+					ret = backend.update(self.make_write_query(_id, account), data, upsert=True, safe=safe)
 
-			if not record.group:
-				record.chgrp(account.group)
+					if ret:
+						if ret['updatedExisting']:
+							self.logger.debug("Successfully updated (_id: '%s')" % _id)
+						else:
+							self.logger.debug("Successfully inserted (_id: '%s')" % _id)
 
-			access = False
+			except DuplicateKeyError, err:
+				status = self.get_duplicate_status(backend, _id, account)
 
-			new_record = True
-			oldrecord = None
-			if _id:
-				try:
-					oldrecord = self.get(_id, namespace=namespace, account=self.root_account)
-					new_record = False
-				except:
-					pass
-
-			if not new_record:
-				self.logger.debug("Check rights of %s" % _id)
-				if account.user == 'root':
-					access = True
-				else:
-					access = oldrecord.check_write(account)
-			else:
-				## New record
-				## Todo: check if account have right to create record ...
-				access = True
+				if status == 'denied':
+					## Exists but not matched by write rights
+					self.logger.error("Puts: Access denied ...")
+					raise ValueError("Access denied")
 
-			if not access:
-				self.logger.error("Puts: Access denied ...")
-				raise ValueError("Access denied")
+				if status == 'retry':
+					## Inserted by a concurrent write, update it
+					self.logger.debug("Update record '%s' inserted meanwhile" % _id)
 
-			if new_record:
-				## Insert new record
-				self.logger.debug("Insert new record")
+					try:
+						backend.update(self.make_write_query(_id, account), data, upsert=True, safe=safe)
+						err = None
 
-				try:
-					## Check if record have binary and store in grid fs
-					if record.binary:
-						record.data['binary_id'] = self.put_binary(record.binary, record.data['file_name'], record.data['content_type'])
+					except Exception, err:
+						pass
 
-					record.write_time = int(time.time())
-					data = record.dump()
-					data['crecord_creation_time'] = record.write_time
+				if err:
+					self.logger.error("Impossible to store !\nReason: %s" % err)
+					self.logger.debug("Record dump:\n%s" % record.dump())
+					raise ValueError("Impossible to store (%s)" % err)
 
-					## Del it if 'None'
-					if not data['_id']:
-						del data['_id']
+			except Exception, err:
+				self.logger.error("Impossible to store !\nReason: %s" % err)
+				self.logger.debug("Record dump:\n%s" % record.dump())
+				raise ValueError("Impossible to store (%s)" % err)
 
-					if not _id:
-						backend.insert(data, safe=self.mongo_safe, w=1)
-					else:
-						backend.update({'_id': _id}, data, safe=self.mongo_safe, upsert=True)
+			record._id = _id
+			return_ids.append(_id)
 
-					self.logger.debug("Successfully inserted (_id: '%s')" % _id)
+		if len(return_ids) == 1:
+			return return_ids[0]
+		else:
+			return return_ids
 
-				except Exception, err:
-					self.logger.error("Impossible to store !\nReason: %s" % err)
-					self.logger.debug("Record dump:\n%s" % record.dump())
-					raise ValueError("Impossible to insert (%s)" % err)
+	def put_many(self, records, account=None, namespace=None, mset=False):
+		"""
+			Write records in a single unordered bulk, with the same rules
+			as put. Return the outcome of each record, in order, as a list
+			of (_id, status), status is 'inserted', 'updated', 'denied' or
+			'error'.
+		"""
 
-				record._id = _id
-				return_ids.append(_id)
+		self.check_connected()
+
+		if not account:
+			account = self.account
+
+		if not records:
+			return []
+
+		backend = self.get_backend(namespace)
+
+		bulk = backend.initialize_unordered_bulk_op()
+		ids = []
+		datas = []
+		inserted = set()
+
+		prepared = [self.prepare_put(record, account, mset=mset) for record in records]
+		write_ids = self.get_write_ids(backend, [_id for _id, data in prepared])
+
+		for index, (_id, data) in enumerate(prepared):
+			if not _id:
+				# insert sets the '_id' of data
+				bulk.insert(data)
+				_id = data['_id']
+				inserted.add(index)
+			elif '$set' in data:
+				_id = write_ids[index]
+				bulk.find(self.make_write_query(_id, account)).upsert().update_one(data)
 			else:
-				## Update record
-				self.logger.debug("Update record '%s'" % _id)
+				_id = write_ids[index]
+				bulk.find(self.make_write_query(_id, account)).upsert().replace_one(data)
 
-				try:
-					## Check if record have binary and store in grid fs
-					if record.binary:
-						record.data['binary_id'] = self.put_binary(record.binary, record.data['file_name'], record.data['content_type'])
+			ids.append(_id)
+			datas.append(data)
 
-					record.write_time = int(time.time())
-					data = record.dump()
+		self.logger.debug("Put %s record(s) in one bulk ..." % len(records))
 
-					del data['_id']
-					_id = self.clean_id(_id)
+		try:
+			result = bulk.execute()
+		except BulkWriteError, err:
+			result = err.details
 
-					if mset:
-						ret = backend.update({'_id': _id}, {"$set": data}, upsert=True, safe=self.mongo_safe)
-					else:
-						ret = backend.update({'_id': _id}, data, upsert=True, safe=self.mongo_safe)
+		outcomes = []
+		inserted.update([upsert['index'] for upsert in result.get('upserted', [])])
+		errors = dict([(error['index'], error) for error in result.get('writeErrors', [])])
 
-					if self.mongo_safe:
-						if ret['updatedExisting']:
-							self.logger.debug("Successfully updated (_id: '%s')" % _id)
-						else:
-							self.logger.debug("Successfully saved (_id: '%s')" % _id)
+		for index, record in enumerate(records):
+			_id = ids[index]
 
-				except Exception, err:
-					self.logger.error("Impossible to store !\nReason: %s" % err)
-					self.logger.debug("Record dump:\n%s" % record.dump())
-					raise ValueError("Impossible to store (%s)" % err)
+			if index in errors:
+				error = errors[index]
+				status = 'error'
+
+				if error.get('code', None) in (11000, 11001) and index not in inserted:
+					status = self.get_duplicate_status(backend, _id, account)
+
+				if status == 'retry':
+					## Inserted by a concurrent write, update it
+					try:
+						backend.update(self.make_write_query(_id, account), datas[index], upsert=True, safe=True)
+						status = 'updated'
+						record._id = _id
+
+					except Exception, err:
+						self.logger.error("Impossible to store '%s': %s" % (_id, err))
+						status = 'error'
+
+				else:
+					self.logger.error("Impossible to store '%s': %s" % (_id, error.get('errmsg', None)))
 
+			else:
 				record._id = _id
-				return_ids.append(_id)
 
+				if index in inserted:
+					status = 'inserted'
+				else:
+					status = 'updated'
 
+			outcomes.append((_id, status))
 
-		if len(return_ids) == 1:
-			return return_ids[0]
-		else:
-			return return_ids
+		return outcomes
 	'''
 	#warning : not tested
 	def recursive_put(self, record,depth=0, account=None, namespace=None):
@@ -361,9 +522,67 @@ class cstorage(object):
 	def count(self, *args, **kargs):
 		return self.find(count=True, *args, **kargs)
 
-	def find(self, mfilter={}, mfields=None, account=None, namespace=None, one=False, count=False, sort=None, limit=0, offset=0, for_write=False, ignore_bin=True, raw=False, with_total=False):
+	def find(self, mfilter={}, mfields=None, account=None, namespace=None, one=False, count=False, sort=None, limit=0, offset=0, for_write=False, ignore_bin=True, raw=False, with_total=False, hint=None, search_after=None, total_ttl=0, view=False):
+		"""
+			Find records, sort, offset and limit are processed by MongoDB
+			('hint' forces an index). With 'view', records are crawrecord
+			views on the raw documents instead of crecords.
+
+			'sort' is a compound sort: records are ordered on its first
+			key, then on the next ones for equal values (the former per-key
+			Python sort ordered them on the last key first). Missing and
+			null values come first in ascending order, last in descending.
+
+			With 'search_after' (values of the sort keys of the last record
+			of the previous page, see get_search_after), records are paged
+			by keyset instead of 'offset'.
+
+			The total of matching records is only counted with 'count' or
+			'with_total', and kept 'total_ttl' seconds for the same filter.
+		"""
+
+		self.check_connected()
+
+		if one:
+			sort = None
+			limit = 1
+
+		backend, mfilter, cursor = self.find_cursor(mfilter, mfields=mfields, account=account, namespace=namespace, sort=sort, limit=limit, offset=offset, for_write=for_write, hint=hint, search_after=search_after)
+
+		if count:
+			return self.get_total(backend, mfilter, total_ttl)
+
+		records = list(self.iter_records(cursor, mfields=mfields, ignore_bin=ignore_bin, raw=raw, view=view))
+
+		self.logger.debug("Found %s record(s)" % len(records))
+
+		if one:
+			if len(records) > 0:
+				return records[0]
+			else:
+				return None
+		else:
+			if with_total: # returns the couple of records, total
+				return records, self.get_total(backend, mfilter, total_ttl)
+
+			return records
+
+	def ifind(self, mfilter={}, mfields=None, account=None, namespace=None, sort=None, limit=0, offset=0, for_write=False, ignore_bin=True, raw=False, hint=None, search_after=None, view=False):
+		"""
+			Same as find but yield records while reading the cursor.
+		"""
+
 		self.check_connected()
 
+		backend, mfilter, cursor = self.find_cursor(mfilter, mfields=mfields, account=account, namespace=namespace, sort=sort, limit=limit, offset=offset, for_write=for_write, hint=hint, search_after=search_after)
+
+		return self.iter_records(cursor, mfields=mfields, ignore_bin=ignore_bin, raw=raw, view=view)
+
+	def find_cursor(self, mfilter={}, mfields=None, account=None, namespace=None, sort=None, limit=0, offset=0, for_write=False, hint=None, search_after=None):
+		"""
+			Return (backend, filter with rights, cursor).
+		"""
+
 		if not account:
 			account = self.account
 
@@ -374,9 +593,6 @@ class cstorage(object):
 		if mfilter.get('_id', None):
 			mfilter['_id'] = self.clean_id(mfilter['_id'])
 
-		if one:
-			sort = [('timestamp', -1)]
-
 		self.logger.debug("Find records from mfilter" )
 
 		(Read_mfilter, Write_mfilter) = self.make_mongofilter(account)
@@ -388,77 +604,156 @@ class cstorage(object):
 			if Read_mfilter:
 				mfilter = { '$and': [ mfilter, Read_mfilter ] }
 
+		spec = mfilter
+
+		if search_after is not None:
+			sort = self.get_keyset_sort(sort)
+			spec = { '$and': [ mfilter, self.make_search_after_filter(sort, search_after) ] }
+
 		self.logger.debug(" + fields : %s" % mfields)
-		self.logger.debug(" + mfilter: %s" % mfilter)
+		self.logger.debug(" + mfilter: %s" % spec)
+		self.logger.debug(" + sort   : %s" % sort)
 
 		backend = self.get_backend(namespace)
 
-		if one:
-			raw_records = backend.find_one(mfilter, fields=mfields, safe=self.mongo_safe)
-			if raw_records:
-				raw_records = [ raw_records ]
-			else:
-				raw_records = []
-		else:
-			if sort is None:
-				raw_records = backend.find(mfilter, fields=mfields, safe=self.mongo_safe, start=offset, limit=limit)
-			else:
-				raw_records = backend.find(mfilter, fields=mfields, safe=self.mongo_safe)
+		cursor = backend.find(spec, fields=mfields)
+
+		if sort:
+			cursor = cursor.sort(sort)
+
+		if hint:
+			cursor = cursor.hint(hint)
+
+		if offset and search_after is None:
+			cursor = cursor.skip(offset)
+
+		if limit:
+			cursor = cursor.limit(limit)
+
+		return backend, mfilter, cursor
+
+	def iter_records(self, raw_records, mfields=None, ignore_bin=True, raw=False, view=False):
+		for raw_record in raw_records:
+			if mfields:
+				yield raw_record
+				continue
 
-			total = raw_records.count()
+			try:
+				# Remove binary (base64)
+				if ignore_bin and raw_record.get('media_bin', None):
+					del raw_record['media_bin']
+
+				if raw:
+					yield raw_record
+				elif view:
+					yield crawrecord(raw_record)
+				else:
+					yield crecord(raw_record=raw_record)
+
+			except Exception, err:
+				## Not record format ..
+				self.logger.error("Impossible parse record ('%s') !" % err)
 
-			# process limit, offset and sort independently of pymongo because sort does not use index
-			if count:
+	def get_total(self, backend, mfilter, total_ttl=0):
+		key = (backend.name, repr(mfilter))
+		now = time.time()
+
+		if total_ttl and key in self.totals:
+			timestamp, total = self.totals[key]
+
+			if now - timestamp < total_ttl:
 				return total
 
-			raw_records = list(raw_records)
+		total = backend.find(mfilter).count()
 
-			if sort is not None:
-				for s in sort:
-					key = s[0]
-					desc = s[1] == -1
-					raw_records = sorted(raw_records, key=itemgetter(key), reverse=desc)
+		# Keep the cache small, filters are mostly built by the UI
+		if len(self.totals) >= 1024:
+			self.totals.clear()
 
-				# and get a sub list of raw_records
-				if limit != 0 and offset != 0:
-					raw_records = raw_records[offset: offset + limit]
-				elif limit != 0:
-					raw_records = raw_records[:limit]
-				elif offset != 0:
-					raw_records = raw_records[offset:]
+		self.totals[key] = (now, total)
 
-		records=[]
+		return total
 
-		if not mfields:
-			for raw_record in raw_records:
-				try:
-					# Remove binary (base64)
-					if ignore_bin and raw_record.get('media_bin', None):
-						del raw_record['media_bin']
+	def get_keyset_sort(self, sort):
+		"""
+			Keyset pagination needs a total order: sort on '_id' last.
+		"""
 
-					if not raw:
-						records.append(crecord(raw_record=raw_record))
-					else:
-						records.append(raw_record)
+		sort = list(sort or [])
 
-				except Exception, err:
-					## Not record format ..
-					self.logger.error("Impossible parse record ('%s') !" % err)
-		else:
-			records = raw_records
+		if '_id' not in [key for key, direction in sort]:
+			sort.append(('_id', ASCENDING))
 
-		self.logger.debug("Found %s record(s)" % len(records))
+		return sort
+
+	def make_search_after_filter(self, sort, search_after):
+		"""
+			Filter records after 'search_after' values in 'sort' order,
+			null and missing values are ordered like MongoDB does (lowest).
+		"""
+
+		if len(search_after) != len(sort):
+			raise ValueError("search_after needs a value for each sort key %s" % [key for key, direction in sort])
+
+		values = []
+
+		for (key, direction), value in zip(sort, search_after):
+			if key == '_id':
+				value = self.clean_id(value)
+
+			values.append(value)
+
+		clauses = []
+
+		for i in range(len(sort)):
+			# Equal on previous keys, after on this one
+			clause = dict([(sort[j][0], values[j]) for j in range(i)])
+
+			key, direction = sort[i]
+
+			if values[i] is None:
+				if direction == DESCENDING:
+					# Nothing after nulls
+					continue
+
+				clause[key] = { '$ne': None }
+
+			elif direction == DESCENDING:
+				# $lt doesn't match nulls, they come last
+				clause['$or'] = [ { key: { '$lt': values[i] } }, { key: None } ]
 
-		if one:
-			if len(records) > 0:
-				return records[0]
 			else:
-				return None
+				clause[key] = { '$gt': values[i] }
+
+			clauses.append(clause)
+
+		if not clauses:
+			# After the last record
+			return { '_id': { '$in': [] } }
+
+		return { '$or': clauses }
+
+	def get_search_after(self, record, sort):
+		"""
+			Return the 'search_after' of the page following 'record'.
+		"""
+
+		if isinstance(record, RECORDS):
+			data = record.data
+			_id = record._id
 		else:
-			if with_total: # returns the couple of records, total
-				return records, total
+			data = record
+			_id = record.get('_id', None)
 
-			return records
+		search_after = []
+
+		for key, direction in self.get_keyset_sort(sort):
+			if key == '_id':
+				search_after.append(str(_id))
+			else:
+				search_after.append(data.get(key, None))
+
+		return search_after
 
 	def get(self, _id_or_ids, account=None, namespace=None, mfields=None, ignore_bin=True):
 		self.check_connected()
@@ -542,11 +837,11 @@ class cstorage(object):
 
 		_ids = []
 
-		if isinstance(_id_or_ids, crecord):
+		if isinstance(_id_or_ids, RECORDS):
 			_ids = [ _id_or_ids._id ]
 		elif isinstance(_id_or_ids, list):
 			if len(_id_or_ids) > 0:
-				if isinstance(_id_or_ids[0], crecord):
+				if isinstance(_id_or_ids[0], RECORDS):
 					for record in _id_or_ids:
 						_ids.append(record._id)
 				else:
@@ -824,10 +1119,92 @@ class cstorage(object):
 #            docs = [docs]
 ##################
 
+## Shared clients
+try:
+	POOL_SIZE = CONFIG.getint("master", "pool_size")
+except ConfigParser.Error:
+	POOL_SIZE = 50
+
+CLIENTS = {}
+CLIENTS_PID = os.getpid()
+CLIENTS_LOCK = threading.Lock()
+CLIENTS_STATS = {'created': 0, 'reused': 0, 'forks': 0}
+
+def use_greenlets():
+	try:
+		from gevent import monkey
+		return monkey.is_module_patched('socket')
+
+	except (ImportError, AttributeError):
+		return False
+
+def check_fork():
+	"""
+		Forget clients and storages inherited from the parent process,
+		their sockets can't be shared.
+	"""
+
+	global CLIENTS_PID
+
+	if CLIENTS_PID != os.getpid():
+		CLIENTS.clear()
+		STORAGES.clear()
+		CLIENTS_PID = os.getpid()
+		CLIENTS_STATS['forks'] += 1
+
+def get_client(host, port, db, userid=None, password=None, safe=True):
+	"""
+		Return the pooled client of this process for
+		(host, port, db, credentials, safe).
+	"""
+
+	if userid and password:
+		uri = 'mongodb://{0}:{1}@{2}:{3}/{4}'.format(userid, password, host, port, db)
+	else:
+		uri = 'mongodb://{0}:{1}/{2}'.format(host, port, db)
+
+	key = (uri, safe)
+
+	with CLIENTS_LOCK:
+		check_fork()
+
+		try:
+			client = CLIENTS[key]
+			CLIENTS_STATS['reused'] += 1
+
+		except KeyError:
+			# Acknowledged writes don't need a socket per thread to
+			# read them back
+			client = Connection(uri, safe=safe, max_pool_size=POOL_SIZE, auto_start_request=not safe, use_greenlets=use_greenlets())
+			CLIENTS[key] = client
+			CLIENTS_STATS['created'] += 1
+
+		return client
+
+def get_pool_stats():
+	"""
+		Return stats of shared clients, for monitoring.
+	"""
+
+	with CLIENTS_LOCK:
+		check_fork()
+
+		stats = dict(CLIENTS_STATS)
+		stats['clients'] = len(CLIENTS)
+		stats['storages'] = len(STORAGES)
+		stats['pool_size'] = POOL_SIZE
+		stats['greenlets'] = use_greenlets()
+
+	return stats
+
 ## Cache storage
 STORAGES = {}
 def get_storage(namespace='object', account=None, logging_level=logging.INFO):
 	global STORAGES
+
+	with CLIENTS_LOCK:
+		check_fork()
+
 	try:
 		return STORAGES[namespace]
 
@@ -20,8 +20,11 @@
 
 import unittest
 import threading, time, json, logging
+import zlib
 
 from camqp import camqp
+from kombu.serialization import loads
+from bson import objectid
 
 logging.basicConfig(level=logging.DEBUG,
                     format='%(asctime)s %(name)s %(levelname)s %(message)s',
@@ -75,6 +78,60 @@ class KnownValues(unittest.TestCase):
 			print "rcvmsgbody:\t", rcvmsgbody
 			raise NameError, 'Received Event is not conform'
 
+	def test_6_Serializers(self):
+		amqp = camqp(read_config_file=False, auto_connect=False)
+
+		msg = dict(msgbody)
+		msg['_id'] = objectid.ObjectId()
+		msg['perf_data_array'] = [{'metric': 'rta', 'value': 0.037, 'unit': u'ms'}]
+
+		expected = dict(msg)
+		expected['_id'] = str(msg['_id'])
+
+		for serializer in ['canopsis-json', amqp.internal_serializer]:
+			body, content_type, content_encoding, compression = amqp.encode(msg, serializer)
+
+			self.assertEqual(compression, None)
+			self.assertEqual(loads(body, content_type, content_encoding), expected)
+
+		# Internal serializer only between engines
+		self.assertEqual(amqp.get_serializer('amq.direct'), amqp.internal_serializer)
+		self.assertEqual(amqp.get_serializer(amqp.exchange_name_events), 'canopsis-json')
+
+		# Compression over threshold
+		amqp.compression_threshold = 100
+		body, content_type, content_encoding, compression = amqp.encode(msg, 'canopsis-json')
+
+		self.assertEqual(compression, 'zlib')
+
+	def test_7_MemoryTransport(self):
+		received = []
+
+		def on_message(body, msg):
+			received.append((msg.delivery_info['routing_key'], body))
+
+		consumer = camqp(read_config_file=False, transport="memory")
+		consumer.add_queue("Engine_unittest", [], on_message, exchange_name="amq.direct")
+		consumer.add_queue("unittest_events", ["unit_test.#"], on_message, exchange_name=consumer.exchange_name_events)
+		consumer.start()
+
+		producer = camqp(read_config_file=False, transport="memory")
+		producer.publish({'direct': True}, "Engine_unittest", "amq.direct")
+		producer.publish({'topic': True}, "unit_test.testmessage", producer.exchange_name_events)
+		producer.publish({'topic': False}, "other.testmessage", producer.exchange_name_events)
+
+		end = time.time() + 10.0
+		while len(received) < 2 and time.time() < end:
+			time.sleep(0.1)
+
+		consumer.stop()
+		consumer.join()
+
+		self.assertEqual(sorted(received), [
+			("Engine_unittest", {'direct': True}),
+			("unit_test.testmessage", {'topic': True})
+		])
+
 	def test_99_Disconnect(self):
 		global myamqp
 		myamqp.stop()
@@ -13,6 +13,9 @@ class CamqpMock(object):
 	def publish(self, event, rk, exchange_name):
 		self.events.append(event)
 
+	def publish_many(self, events, rk, exchange_name):
+		self.events.extend(events)
+
 	def clean(self):
 		self.events = []
 
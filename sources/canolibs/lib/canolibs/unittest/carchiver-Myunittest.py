@@ -71,6 +71,62 @@ class KnownValues(unittest.TestCase):
 		if len(records) != 3:
 			raise Exception('Invalid logs count  (%s)...' % len(records))
 
+	def test_04_WriteBehind(self):
+		archiver = carchiver(namespace='unittest_wb', write_behind=True, flush_interval=60000, flush_size=1000, logging_level=logging.DEBUG)
+		archiver.remove_all()
+
+		event_id = 'unit.test.wb'
+
+		print "1. Insert new event ..."
+		if not archiver.check_event(event_id, { 'state': 0, 'state_type': 1, 'output': 'first' }):
+			raise Exception('[1] Invalid check ...')
+
+		print "2. Coalesce updates ..."
+		archiver.check_event(event_id, { 'state': 0, 'state_type': 1, 'output': 'second' })
+		archiver.check_event(event_id, { 'state': 0, 'state_type': 1, 'output': 'third' })
+
+		if len(archiver.dirty) != 1 or archiver.dirty[event_id][1]['output'] != 'third':
+			raise Exception('[2] Updates not coalesced: %s' % archiver.dirty)
+
+		devent = archiver.collection.find_one(event_id)
+		if devent['output'] != 'first':
+			raise Exception('[2] Update written before flush ...')
+
+		print "3. Change state ..."
+		if not archiver.check_event(event_id, { 'state': 2, 'state_type': 1, 'output': 'fourth' }):
+			raise Exception('[3] Invalid check ...')
+
+		if archiver.dirty:
+			raise Exception('[3] State change not flushed ...')
+
+		devent = archiver.collection.find_one(event_id)
+		if devent['state'] != 2 or devent['output'] != 'fourth':
+			raise Exception('[3] Invalid stored event: %s' % devent)
+
+		print "4. Flush on close ..."
+		archiver.check_event(event_id, { 'state': 2, 'state_type': 1, 'output': 'fifth' })
+		archiver.close()
+
+		devent = archiver.collection.find_one(event_id)
+		if devent['output'] != 'fifth':
+			raise Exception('[4] Pending update not flushed: %s' % devent)
+
+		print "5. Evict written states only ..."
+		archiver.states_size = 1
+		archiver.check_event(event_id, { 'state': 2, 'state_type': 1, 'output': 'sixth' })
+		archiver.check_event('unit.test.wb2', { 'state': 0, 'state_type': 1 })
+
+		if list(archiver.states) != [event_id, 'unit.test.wb2']:
+			raise Exception('[5] Dirty state evicted: %s' % archiver.states.keys())
+
+		archiver.flush(force=True)
+		archiver.check_event('unit.test.wb2', { 'state': 0, 'state_type': 1 })
+
+		if list(archiver.states) != ['unit.test.wb2']:
+			raise Exception('[5] Written state not evicted: %s' % archiver.states.keys())
+
+		archiver.remove_all()
+
 	def test_99_DropNamespace(self):
 		ARCHIVER.remove_all()
 		pass
@@ -20,12 +20,25 @@
 
 import unittest
 import threading, time, json, logging
+import pstats, os
 
 logging.basicConfig(level=logging.DEBUG,
                     format='%(asctime)s %(name)s %(levelname)s %(message)s',
                     )
                     
-from cengine import cengine
+from cengine import cengine, DROP
+import camqpmock
+
+class message(object):
+	def __init__(self):
+		self.acked = False
+		self.requeued = False
+
+	def ack(self):
+		self.acked = True
+
+	def requeue(self):
+		self.requeued = True
 
 class KnownValues(unittest.TestCase): 
 	def setUp(self):
@@ -34,5 +47,142 @@ class KnownValues(unittest.TestCase):
 	def test_1_Init(self):
 		pass
 
+	def test_2_work_batch(self):
+		engine = cengine(name='unittest', next_amqp_queues=['Engine_next'], batch_size=3)
+		engine.amqp = camqpmock.CamqpMock(engine)
+		engine.work = lambda event, msg: DROP if event['i'] == 1 else event
+
+		msgs = [message() for i in range(5)]
+
+		for i in range(5):
+			engine.on_amqp_batch_event({'i': i, 'rk': 'unittest'}, msgs[i])
+
+		# First batch is full, second one waits for its window
+		self.assertEqual([e['i'] for e in engine.amqp.events], [0, 2])
+		self.assertEqual(len(engine.batch), 2)
+		self.assertEqual(engine.counter_event, 3)
+
+		# Events are acked once processed
+		self.assertEqual([msg.acked for msg in msgs], [True, True, True, False, False])
+
+		engine.flush_batch()
+
+		self.assertEqual([e['i'] for e in engine.amqp.events], [0, 2, 3, 4])
+		self.assertEqual(engine.counter_event, 5)
+		self.assertTrue(all([msg.acked for msg in msgs]))
+		self.assertTrue('cengine' in engine.amqp.events[0]['processing'])
+
+		# Failed batches are forwarded as is, or given back to the broker
+		def fail(*args):
+			raise Exception('unittest')
+
+		engine.work = fail
+		engine.amqp.clean()
+
+		msgs = [message() for i in range(3)]
+
+		for i in range(3):
+			engine.on_amqp_batch_event({'i': i, 'rk': 'unittest'}, msgs[i])
+
+		self.assertEqual([e['i'] for e in engine.amqp.events], [0, 1, 2])
+		self.assertEqual(engine.counter_error, 3)
+		self.assertTrue(all([msg.acked for msg in msgs]))
+
+		engine.amqp.publish_many = fail
+
+		msgs = [message() for i in range(3)]
+
+		for i in range(3):
+			engine.on_amqp_batch_event({'i': i, 'rk': 'unittest'}, msgs[i])
+
+		self.assertFalse(any([msg.acked for msg in msgs]))
+		self.assertTrue(all([msg.requeued for msg in msgs]))
+
+		# The consumer thread flushes the batch on request
+		engine.work = lambda event, msg: event
+		del engine.amqp.publish_many
+
+		engine.on_amqp_batch_event({'i': 3, 'rk': 'unittest'}, message())
+		engine.on_amqp_drain()
+		self.assertEqual(len(engine.batch), 1)
+
+		engine.batch_flush_requested = True
+		engine.on_amqp_drain()
+		self.assertEqual(len(engine.batch), 0)
+		self.assertFalse(engine.batch_flush_requested)
+
+	def test_3_fuse(self):
+		first = cengine(name='unittest1', next_amqp_queues=['Engine_unittest2'])
+		last = cengine(name='unittest2', next_amqp_queues=['Engine_next'])
+		last.etype = 'last'
+
+		first.amqp = camqpmock.CamqpMock(first)
+		last.amqp = first.amqp
+		first.work = lambda event, msg: DROP if event['i'] == 1 else event
+
+		first.fuse([last])
+
+		for i in range(3):
+			first._work({'i': i, 'rk': 'unittest'})
+
+		# Only the last engine publishes
+		self.assertEqual([e['i'] for e in first.amqp.events], [0, 2])
+		self.assertEqual(sorted(first.amqp.events[0]['processing'].keys()), ['cengine', 'last'])
+		self.assertEqual(first.counter_event, 3)
+		self.assertEqual(last.counter_event, 2)
+
+	def test_4_shards(self):
+		engine = cengine(name='unittest', shard=1, next_amqp_queues=['Engine_next'], next_shards={'Engine_next': 4})
+
+		self.assertEqual(engine.amqp_queue, 'Engine_unittest.1')
+
+		queue = engine.get_next_queue('Engine_next', {'rk': 'nagios.Central.check.component.host1'})
+		self.assertTrue(queue.startswith('Engine_next.'))
+
+		for i in range(10):
+			self.assertEqual(queue, engine.get_next_queue('Engine_next', {'rk': 'nagios.Central.check.component.host1'}))
+
+	def test_5_latency(self):
+		engine = cengine(name='unittest')
+		engine.amqp = camqpmock.CamqpMock(engine)
+		engine.last_stat = 0
+
+		for i in range(98):
+			engine.count_worktime(0.01)
+
+		engine.count_worktime(0.7)
+		engine.count_worktime(2.0)
+
+		engine._beat()
+
+		perfdata = dict([(perf['metric'], perf['value']) for perf in engine.amqp.events[0]['perf_data_array']])
+
+		self.assertTrue(0.009 < perfdata['cps_sec_per_evt_p50'] < 0.011)
+		self.assertTrue(0.6 < perfdata['cps_sec_per_evt_p99'] < 0.8)
+		self.assertEqual(perfdata['cps_sec_per_evt_max'], 2.0)
+		self.assertEqual(perfdata['cps_evt_over_warn'], 2)
+		self.assertEqual(perfdata['cps_evt_over_crit'], 1)
+
+		# Counters are reset
+		self.assertEqual(engine.histogram.count, 0)
+
+	def test_6_profile(self):
+		engine = cengine(name='unittest')
+		engine.amqp = camqpmock.CamqpMock(engine)
+		engine.profile_path = '/tmp/cengine-unittest.prof'
+
+		engine.on_profile_signal(None, None)
+		engine.on_amqp_event({'rk': 'unittest'}, None)
+		self.assertTrue(engine.profiler)
+
+		engine.profile_end = 0
+		engine.on_amqp_event({'rk': 'unittest'}, None)
+		self.assertFalse(engine.profiler)
+
+		stats = pstats.Stats(engine.profile_path)
+		self.assertTrue([func for func in stats.stats if func[2] == '_work'])
+
+		os.remove(engine.profile_path)
+
 if __name__ == "__main__":
 	unittest.main(verbosity=2)
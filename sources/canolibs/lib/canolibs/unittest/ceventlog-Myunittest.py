@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+#--------------------------------
+# Copyright (c) 2011 "Capensis" [http://www.capensis.com]
+#
+# This file is part of Canopsis.
+#
+# Canopsis is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canopsis is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Canopsis.  If not, see <http://www.gnu.org/licenses/>.
+# ---------------------------------
+
+import unittest, logging
+
+from ceventlog import ceventlog
+
+EVENTLOG = None
+
+DAY = 86400
+# 2013-01-01 00:00:00 UTC
+T0 = 1356998400
+
+class KnownValues(unittest.TestCase):
+	def setUp(self):
+		pass
+
+	def test_01_Init(self):
+		global EVENTLOG
+		EVENTLOG = ceventlog(namespace='unittest_log', partition='day', retention=2 * DAY, bulk_size=10, logging_level=logging.DEBUG)
+		EVENTLOG.drop()
+
+	def test_02_Partition(self):
+		self.assertEqual(EVENTLOG.get_partition(T0 + 3600), 'unittest_log_20130101')
+		self.assertEqual(EVENTLOG.get_partition(T0 + DAY), 'unittest_log_20130102')
+
+		self.assertEqual(EVENTLOG.get_partition_range('unittest_log_20130102'), (T0 + DAY, DAY))
+		self.assertEqual(EVENTLOG.get_partition_range('unittest_log_2013010215'), (T0 + DAY + 15 * 3600, 3600))
+		self.assertEqual(EVENTLOG.get_partition_range('unittest_log_old'), None)
+
+	def test_03_Log(self):
+		for day in range(4):
+			for i in range(3):
+				EVENTLOG.log('unit.test', {'state': i, 'timestamp': T0 + day * DAY + i}, now=T0 + day * DAY + i)
+
+		# Not flushed yet
+		self.assertEqual(EVENTLOG.pending_count, 12 % 10)
+
+		records = EVENTLOG.find({'event_id': 'unit.test'})
+		self.assertEqual(len(records), 12)
+		self.assertEqual(EVENTLOG.pending_count, 0)
+
+		self.assertEqual(len(EVENTLOG.list_partitions(refresh=True)), 4)
+
+		# Fan out on partitions written since start only
+		self.assertEqual(EVENTLOG.get_namespaces(T0 + DAY), ['unittest_log', 'unittest_log_20130102', 'unittest_log_20130103', 'unittest_log_20130104'])
+
+		records = EVENTLOG.find({'event_id': 'unit.test'}, start=T0 + DAY + 1, stop=T0 + 2 * DAY + 1)
+		self.assertEqual([record.data['timestamp'] for record in records], [T0 + DAY + 1, T0 + DAY + 2, T0 + 2 * DAY, T0 + 2 * DAY + 1])
+
+		# Sorted and paged over partitions
+		records, total = EVENTLOG.find({'event_id': 'unit.test'}, sort=[('timestamp', -1)], limit=3, offset=2, with_total=True)
+		self.assertEqual([record.data['timestamp'] for record in records], [T0 + 3 * DAY, T0 + 2 * DAY + 2, T0 + 2 * DAY + 1])
+		self.assertEqual(total, 12)
+
+	def test_04_Late_event(self):
+		# Partitioned on write time, not on the event timestamp
+		EVENTLOG.log('unit.late', {'state': 0, 'timestamp': T0 + DAY + 10}, now=T0 + 3 * DAY + 10)
+		EVENTLOG.flush(force=True)
+
+		self.assertEqual(len(EVENTLOG.list_partitions(refresh=True)), 4)
+
+		records = EVENTLOG.find({'event_id': 'unit.late'}, start=T0 + DAY, stop=T0 + DAY + 20)
+		self.assertEqual(len(records), 1)
+
+		EVENTLOG.remove({'event_id': 'unit.late'})
+
+	def test_05_Purge(self):
+		dropped = EVENTLOG.purge(now=T0 + 4 * DAY)
+		self.assertEqual(dropped, ['unittest_log_20130101'])
+
+		records = EVENTLOG.find({'event_id': 'unit.test'})
+		self.assertEqual(len(records), 9)
+
+	def test_06_Partitions_cache(self):
+		reader = ceventlog(namespace='unittest_log', logging_level=logging.DEBUG)
+		self.assertEqual(len(reader.list_partitions()), 3)
+
+		EVENTLOG.log('unit.test', {'state': 0, 'timestamp': T0 + 4 * DAY}, now=T0 + 4 * DAY)
+		EVENTLOG.flush(force=True)
+
+		# New partitions are seen once the list expired
+		self.assertEqual(len(reader.get_namespaces()), 4)
+
+		reader.partitions_time = 0
+		self.assertEqual(len(reader.get_namespaces()), 5)
+
+	def test_99_Drop(self):
+		EVENTLOG.drop()
+		self.assertEqual(EVENTLOG.list_partitions(), [])
+
+if __name__ == "__main__":
+	unittest.main(verbosity=2)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+#--------------------------------
+# Copyright (c) 2011 "Capensis" [http://www.capensis.com]
+#
+# This file is part of Canopsis.
+#
+# Canopsis is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canopsis is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Canopsis.  If not, see <http://www.gnu.org/licenses/>.
+# ---------------------------------
+
+import unittest
+
+import random
+
+from chistogram import chistogram
+
+class KnownValues(unittest.TestCase):
+	def setUp(self):
+		self.values = [random.expovariate(100) for i in range(10000)]
+
+	def test_01_percentiles(self):
+		histogram = chistogram()
+
+		for value in self.values:
+			histogram.add(value)
+
+		self.values.sort()
+
+		for p in [50, 90, 99]:
+			expected = self.values[int(len(self.values) * p / 100.0) - 1]
+			self.assertTrue(abs(histogram.percentile(p) - expected) <= expected * 0.1 + histogram.vmin, (p, histogram.percentile(p), expected))
+
+		self.assertEqual(histogram.percentile(100), max(self.values))
+		self.assertEqual(histogram.count, len(self.values))
+
+	def test_02_dump_load(self):
+		histogram = chistogram()
+
+		for value in self.values:
+			histogram.add(value)
+
+		loaded = chistogram.load(histogram.dump())
+
+		self.assertEqual(loaded.counts, histogram.counts)
+		self.assertEqual(loaded.percentile(99), histogram.percentile(99))
+
+		loaded.merge(histogram)
+		self.assertEqual(loaded.count, 2 * histogram.count)
+
+if __name__ == "__main__":
+	unittest.main(verbosity=2)
@@ -19,6 +19,7 @@
 # ---------------------------------
 
 import unittest
+import random
 import json
 
 import cmfilter
@@ -174,6 +175,100 @@ class KnownValues(unittest.TestCase):
 		match = cmfilter.check(filter1, event)	
 		self.assertFalse(match, msg='Filter: %s' % filter1)
 
+	def test_09_compile(self):
+		# Compiled filters return the same results (or raise the same errors) as check()
+		rand = random.Random(42)
+
+		fields = ['connector', 'connector_name', 'component', 'state', 'tags', 'missing']
+		values = {
+			'connector': ['cengine', 'nagios', 'collectd'],
+			'connector_name': ['engine', 'Central'],
+			'component': ['host1', 'host2', u'h\xf4te', ''],
+			'state': [0, 1, 2, 3],
+			'tags': [['tag1'], ['tag1', 'tag2'], []],
+			'missing': ['x']
+		}
+
+		def random_value(field):
+			return rand.choice(values[field])
+
+		def random_field_filter(field, depth):
+			op = rand.choice(['$eq', '$ne', '$gt', '$gte', '$lt', '$lte', '$exists', '$regex', '$in', '$nin', '$all', '$not', 'raw'])
+
+			if op == '$exists':
+				return {op: rand.choice([True, False])}
+
+			elif op == '$regex':
+				spec = {op: rand.choice(['h.st', 'C.ntr', 'ng', '^c'])}
+
+				if rand.random() < 0.7:
+					spec['$options'] = rand.choice(['i', ''])
+
+				return spec
+
+			elif op in ['$in', '$nin', '$all']:
+				return {op: [random_value(field) for i in range(rand.randint(0, 3))]}
+
+			elif op == '$not' and depth < 2:
+				return {op: random_field_filter(field, depth + 1)}
+
+			elif op == 'raw':
+				return random_value(field)
+
+			spec = {op: random_value(field)}
+
+			if rand.random() < 0.3:
+				spec['$lt'] = random_value(field)
+
+			return spec
+
+		def random_filter(depth=0):
+			mfilter = {}
+
+			for i in range(rand.randint(1, 3)):
+				if depth < 2 and rand.random() < 0.3:
+					mfilter[rand.choice(['$and', '$or', '$nor'])] = [random_filter(depth + 1) for j in range(rand.randint(1, 3))]
+
+				else:
+					field = rand.choice(fields)
+					mfilter[field] = random_field_filter(field, depth)
+
+			return mfilter
+
+		def random_event():
+			return dict([(field, random_value(field)) for field in fields[:-1] if rand.random() < 0.9])
+
+		def result(func, *args):
+			try:
+				return func(*args)
+
+			except Exception as err:
+				return type(err)
+
+		for i in range(2000):
+			mfilter = random_filter()
+			compiled = cmfilter.compile(mfilter)
+
+			for j in range(10):
+				event = random_event()
+
+				self.assertEqual(result(compiled, event), result(cmfilter.check, mfilter, event), msg='Filter: %s, Event: %s' % (mfilter, event))
+
+		# Cached on canonical JSON
+		self.assertTrue(cmfilter.compile({'a': 1, 'b': 2}) is cmfilter.compile({'b': 2, 'a': 1}))
+
+	def test_10_equality_constraints(self):
+		fields = ['connector', 'component', 'event_type']
+
+		constraints = cmfilter.equality_constraints({'connector': 'nagios', 'state': 2, 'component': {'$regex': 'h.*'}}, fields)
+		self.assertEqual(constraints, {'connector': 'nagios'})
+
+		constraints = cmfilter.equality_constraints({'$and': [{'connector': 'nagios'}, {'event_type': 'check'}]}, fields)
+		self.assertEqual(constraints, {'connector': 'nagios', 'event_type': 'check'})
+
+		constraints = cmfilter.equality_constraints({'connector': 'nagios', '$or': [{'event_type': 'check'}]}, fields)
+		self.assertEqual(constraints, {})
+
 if __name__ == "__main__":
 	unittest.main(verbosity=2)
 
@@ -21,6 +21,7 @@
 import unittest
 import json
 from crecord import crecord
+from crecord import crawrecord
 from caccount import caccount
 from cgroup import cgroup
 
@@ -156,6 +157,47 @@ class KnownValues(unittest.TestCase):
 		
 		if not check:
 			raise Exception('Admin group are not handle ...')
+
+	def test_10_readers(self):
+		record = crecord(self.data, owner='william', group='capensis', type='view')
+		record.chmod('a+r')
+
+		readers = record.dump()['aaa_readers']
+		if readers != ['account.william', 'group.capensis', 'group.CPS_view_admin', 'unauth']:
+			raise Exception('Invalid readers: %s' % readers)
+
+		anonymous = caccount()
+		if not set(readers) & set(anonymous.get_principals()):
+			raise Exception('Anonymous account must read it ...')
+
+		record.chmod('a-r')
+		if set(record.get_readers()) & set(anonymous.get_principals()):
+			raise Exception('Anonymous account must not read it ...')
+
+		record2 = crecord(raw_record=record.dump())
+		if 'aaa_readers' in record2.data:
+			raise Exception('Readers must not be loaded in data ...')
+
+	def test_11_rawrecord(self):
+		record = crecord(self.data, _id='test', owner='william', group='capensis', type='event')
+		record.chmod('o+r')
+
+		raw = dict(self.data, _id='test')
+		view = crawrecord(raw, type='event', owner='william', group='capensis')
+		view.chmod('o+r')
+
+		if view.dump() != record.dump():
+			raise Exception('Invalid dump: %s' % view.dump())
+
+		if view.data is not raw or raw['aaa_access_other'] != ['r']:
+			raise Exception('View must not copy raw record ...')
+
+		view = crawrecord(record.dump())
+		if view.owner != 'account.william' or view.admin_group != 'group.CPS_event_admin':
+			raise Exception('Invalid fields of raw record ...')
+
+		if not view.check_write(caccount(user='william', group='capensis')):
+			raise Exception('Invalid write rights ...')
 		
 
 if __name__ == "__main__":
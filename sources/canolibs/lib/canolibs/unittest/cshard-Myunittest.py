@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+#--------------------------------
+# Copyright (c) 2011 "Capensis" [http://www.capensis.com]
+#
+# This file is part of Canopsis.
+#
+# Canopsis is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canopsis is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Canopsis.  If not, see <http://www.gnu.org/licenses/>.
+# ---------------------------------
+
+import unittest
+
+from cshard import cshard
+
+class KnownValues(unittest.TestCase):
+	def setUp(self):
+		self.keys = ['nagios.Central.check.resource.host%s.load' % i for i in range(1000)]
+
+	def test_01_stable(self):
+		shard = cshard(4)
+
+		for key in self.keys:
+			self.assertEqual(shard.get_shard(key), cshard(4).get_shard(key))
+
+		self.assertEqual(shard.get_queue('Engine_eventstore', self.keys[0]), 'Engine_eventstore.%s' % shard.get_shard(self.keys[0]))
+
+	def test_02_spread(self):
+		shard = cshard(4)
+		counts = [0] * 4
+
+		for key in self.keys:
+			counts[shard.get_shard(key)] += 1
+
+		for count in counts:
+			self.assertTrue(count > 100, counts)
+
+	def test_03_rebalance(self):
+		before = cshard(4)
+		after = cshard(5)
+
+		moved = len([key for key in self.keys if before.get_shard(key) != after.get_shard(key)])
+
+		# Only keys going to the new shard should move
+		self.assertTrue(moved < len(self.keys) / 3, moved)
+
+		for key in self.keys:
+			if before.get_shard(key) != after.get_shard(key):
+				self.assertEqual(after.get_shard(key), 4)
+
+if __name__ == "__main__":
+	unittest.main(verbosity=2)
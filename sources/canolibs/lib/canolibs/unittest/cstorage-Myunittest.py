@@ -21,9 +21,12 @@
 import unittest
 
 from cstorage import cstorage
+from cstorage import get_pool_stats
 from crecord import crecord
+from crecord import crawrecord
 from caccount import caccount
 from cgroup import cgroup
+from bson import objectid
 
 import logging
 import time
@@ -58,6 +61,16 @@ class KnownValues(unittest.TestCase):
 		records = STORAGE.find(account=self.root_account)
 		STORAGE.remove(records, account=self.root_account)
 
+	def test_01_SharedClient(self):
+		storage = cstorage(self.root_account, namespace='unittest')
+
+		if storage.conn is not STORAGE.conn:
+			raise Exception('Clients are not shared ...')
+
+		stats = get_pool_stats()
+		if stats['clients'] < 1 or stats['reused'] < 1:
+			raise Exception('Invalid pool stats: %s' % stats)
+
 	def test_02_CreateRecord(self):
 		global MYRECORD
 		MYRECORD = crecord(self.data, storage=STORAGE)
@@ -182,6 +195,66 @@ class KnownValues(unittest.TestCase):
 		if nb != 2:
 			raise Exception('Error in count ...')
 
+	def test_15_Find_sort(self):
+		sort = [('state', 1), ('check', -1)]
+		records = STORAGE.find({}, sort=sort, limit=2)
+
+		if [record.data['check'] for record in records] != ['test3', 'test2']:
+			raise Exception('Error in sort ...')
+
+		records, total = STORAGE.find({}, sort=sort, offset=2, with_total=True)
+
+		if len(records) != 1 or records[0].data['check'] != 'test1' or total != 3:
+			raise Exception('Error in offset ...')
+
+	def test_15_Find_search_after(self):
+		# Records without state come first ascending, last descending
+		STORAGE.put(crecord({'check': 'test0'}, _id='test_search_after'))
+
+		for sort, expected in [
+			([('state', 1), ('check', -1)], ['test0', 'test3', 'test2', 'test1']),
+			([('state', -1), ('check', 1)], ['test1', 'test2', 'test3', 'test0'])]:
+
+			checks = []
+			search_after = None
+
+			while True:
+				records = STORAGE.find({}, sort=sort, limit=1, search_after=search_after)
+				if not records:
+					break
+
+				checks += [record.data['check'] for record in records]
+				search_after = STORAGE.get_search_after(records[-1], sort)
+
+			if checks != expected:
+				raise Exception('Error in search_after: %s' % checks)
+
+		STORAGE.remove('test_search_after')
+
+	def test_15_ifind(self):
+		records = STORAGE.ifind({}, sort=[('check', 1)])
+
+		if isinstance(records, list):
+			raise Exception('ifind must return a generator ...')
+
+		if [record.data['check'] for record in records] != ['test1', 'test2', 'test3']:
+			raise Exception('Error in ifind ...')
+
+	def test_15_view(self):
+		record = STORAGE.find_one({'check': 'test1'}, view=True)
+
+		if not isinstance(record, crawrecord) or record.data['state'] != 1:
+			raise Exception('Error in find view ...')
+
+		record.data['state'] = 2
+		STORAGE.put(record)
+
+		if STORAGE.get(record._id).data['state'] != 2:
+			raise Exception('Error in put view ...')
+
+		record.data['state'] = 1
+		STORAGE.put(record)
+
 	def test_16_CheckReadRights(self):
 		# Inserts
 		STORAGE.put(crecord({'check': 'test4'}), account=self.anonymous_account)
@@ -224,7 +297,63 @@ class KnownValues(unittest.TestCase):
 
 		## try to remove with anonymous account
 		STORAGE.remove(record, account=self.anonymous_account)
-		
+
+	def test_17_CheckWriteRights_put(self):
+		record = crecord({'check': 'test8'}, _id='test_write_rights')
+		STORAGE.put(record, account=self.user_account)
+
+		## try to overwrite and update with other accounts
+		self.assertRaises(ValueError, STORAGE.put, crecord({'check': 'test8'}, _id='test_write_rights'), self.anonymous_account)
+		self.assertRaises(KeyError, STORAGE.update, 'test_write_rights', {'check': 'test9'}, None, self.anonymous_account)
+
+		STORAGE.update('test_write_rights', {'check': 'test9'}, account=self.user_account)
+
+		record = STORAGE.get('test_write_rights', account=self.root_account)
+		if record.data['check'] != 'test9':
+			raise Exception('Error in update ...')
+
+	def test_17_PutMany(self):
+		records = [
+			crecord({'check': 'test10'}),
+			crecord({'check': 'test11'}, _id='test_put_many'),
+			crecord({'check': 'test12'}, _id='test_write_rights')
+		]
+
+		outcomes = STORAGE.put_many(records, account=self.user2_account)
+
+		if [status for _id, status in outcomes] != ['inserted', 'inserted', 'denied']:
+			raise Exception('Error in put_many outcomes: %s' % outcomes)
+
+		if records[0]._id != outcomes[0][0]:
+			raise Exception('Error in put_many _id ...')
+
+		outcomes = STORAGE.put_many(records[1:2], account=self.user2_account)
+
+		if outcomes != [('test_put_many', 'updated')]:
+			raise Exception('Error in put_many update: %s' % outcomes)
+
+		STORAGE.remove(['test_write_rights', 'test_put_many', records[0]._id], account=self.root_account)
+
+	def test_17_Put_ids(self):
+		backend = STORAGE.get_backend()
+
+		# New records keep a string _id, even of 24 hex characters
+		STORAGE.put(crecord({'check': 'test13'}, _id='a' * 24))
+
+		if not backend.find_one({'_id': 'a' * 24}):
+			raise Exception('String _id not kept ...')
+
+		# Existing ObjectId records are updated, with their creation time
+		oid = objectid.ObjectId()
+		STORAGE.put(crecord({'check': 'test14', 'crecord_creation_time': 1}, _id=oid))
+		STORAGE.put(crecord({'check': 'test15'}, _id=str(oid)))
+
+		raw = backend.find_one({'_id': oid})
+		if raw['check'] != 'test15' or raw['crecord_creation_time'] != 1:
+			raise Exception('Invalid put of an existing record: %s' % raw)
+
+		backend.remove({'_id': {'$in': ['a' * 24, oid]}})
+
 
 	def test_18_MapReduce(self):
 		from bson.code import Code
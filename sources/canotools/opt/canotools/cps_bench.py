@@ -20,16 +20,23 @@
 
 import time
 import logging
+import random
+import getopt
+import bisect
+import json
 import sys
+import os
+
+from ConfigParser import ConfigParser
 
 from camqp import camqp
+from chistogram import chistogram
 import cevent
 from cstorage import get_storage
 from caccount import caccount
+from ceventlog import ceventlog
 import traceback
 
-import pyperfstore2
-
 
 ########################################################
 #
@@ -37,67 +44,27 @@ import pyperfstore2
 #
 ########################################################
 
-AMQP_HOST = "localhost"
-
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s %(name)s %(levelname)s %(message)s',
                     )
 
 logger = logging.getLogger("bench")
-amqp = camqp()
-
-storage = get_storage(namespace='events', account=caccount(user="root", group="root"))
-manager = pyperfstore2.manager(logging_level=logging.INFO)
-
-base_component_event = cevent.forger(
-					connector =			'bench',
-					connector_name =	"engine",
-					event_type =		"check",
-					source_type =		"component",
-					component =			"component-",
-					state =				0,
-					state_type =		1,
-					output =			"Output",
-					long_output =		"",
-					#perf_data =			None,
-					perf_data_array =	[
-						{'metric': 'metric1', 'value': 0.25, 'unit': None, 'min': None, 'max': None, 'warn': None, 'crit': None, 'type': 'GAUGE' },
-						{'metric': 'metric2',   'value': 0.16, 'unit': None, 'min': None, 'max': None, 'warn': None, 'crit': None, 'type': 'GAUGE' },
-						{'metric': 'metric3',  'value': 0.12, 'unit': None, 'min': None, 'max': None, 'warn': None, 'crit': None, 'type': 'GAUGE' },
-						{'metric': 'metric4',  'value': 0.12, 'unit': None, 'min': None, 'max': None, 'warn': None, 'crit': None, 'type': 'GAUGE' },
-						{'metric': 'metric5',  'value': 0.12, 'unit': None, 'min': None, 'max': None, 'warn': None, 'crit': None, 'type': 'GAUGE' },
-						{'metric': 'metric6',  'value': 0.12, 'unit': None, 'min': None, 'max': None, 'warn': None, 'crit': None, 'type': 'GAUGE' },
-						{'metric': 'metric7',  'value': 0.12, 'unit': None, 'min': None, 'max': None, 'warn': None, 'crit': None, 'type': 'GAUGE' },
-						{'metric': 'metric8',  'value': 0.12, 'unit': None, 'min': None, 'max': None, 'warn': None, 'crit': None, 'type': 'GAUGE' },
-						{'metric': 'metric9',  'value': 0.12, 'unit': None, 'min': None, 'max': None, 'warn': None, 'crit': None, 'type': 'GAUGE' },
-						{'metric': 'metric10',  'value': 0.12, 'unit': None, 'min': None, 'max': None, 'warn': None, 'crit': None, 'type': 'GAUGE' }
-                    ]
-					#display_name =		""
-				)
-
-base_component_event['latency'] = 0.141
-base_component_event['current_attempt'] = 1
-base_component_event['max_attempts'] = 1
-base_component_event['execution_time'] = 0.007503
-base_component_event['output'] = "WARNING - Charge moyenne: 0.92, 3.11, 3.45"
-base_component_event['perfdata'] = "load1=0.920;5.000;10.000;0; load5=3.110;4.000;6.000;0; load15=3.450;3.000;4.000;0;"
-
-base_resource_event = cevent.forger(
-					connector =			'bench',
-					connector_name =	"engine",
-					event_type =		"check",
-					source_type =		"resource",
-					component =			"component-",
-					resource =			"resource-",
-					state =				0,
-					state_type =		1,
-					output =			"Output",
-					long_output =		"",
-					#perf_data =			None,
-					#perf_data_array =	[],
-					#display_name =		""
-				)
-				
+
+DEFAULT_SCENARIO = {
+	'events': 10000,
+	'rate': 0,
+	'components': 100,
+	'resources': 10,
+	'zipf': 1.1,
+	'flip_rate': 0.01,
+	'perfdata': 5,
+	'ack_rate': 0.001,
+	'downtime_rate': 0.0005,
+	'timeout': 300,
+	'seed': 42
+}
+
+BENCH_QUEUE = "bench_alerts"
 
 ########################################################
 #
@@ -116,97 +83,312 @@ def signal_handler(signum, frame):
 signal.signal(signal.SIGINT, signal_handler)
 signal.signal(signal.SIGTERM, signal_handler)
 
-def send_events(n, rate=0, burst=10):
-	i = 0
-	
-	logger.info("Send %s events" % n)
-	if (rate):
-		#1/10 ou 1/15
-		logger.info(" + @ %s events/second (%s events/5min)" % (rate, (rate*300)))
-		#time_target = time.time() + float(n)/rate
-		time_break = ((float(n) / rate) / n) * burst
-		#logger.info(" + @ %s events / %s seconds" % (rate, burst))
-		#logger.info(" + sleep %s seconds / %s events" % (time_break, burst))
-
-	time_start_burst = time.time()
-	start_time = time.time()
-	while RUN and i < n:
-		event = base_component_event.copy()
+def load_scenario(path, name):
+	config = ConfigParser()
+	config.read(os.path.expanduser(path))
 
-		#event['component'] += str(i)
-		event['component'] += "bench"
+	section = 'scenario:{0}'.format(name)
 
-		if i % 300 == 0:
-			event['state'] = 2
+	if not config.has_section(section):
+		raise ValueError("Scenario '%s' not found in %s" % (name, path))
 
-		event['bench_timestamp'] = time.time()
-		benchId = i
-		event['benchId'] = benchId
-
-		rk = cevent.get_routingkey(event)
-		amqp.publish(event, rk, amqp.exchange_name_events)
-
-		if (rate and (i % burst == 0)):
-			elapsed = time.time() - time_start_burst
-			if (time_break > elapsed):
-				time.sleep(time_break - elapsed)
-			time_start_burst = time.time()
-
-		i+=1
-
-	duration = time.time() - start_time
-	logger.info(" + Done, elapsed: %.3f ms (%s events/second)" % ((duration*1000), int(n/duration)) )
-
-	# Get last event
-	record = None
-	elapsed = None
-	logger.info("Wait last record ('%s' %s) ..." % (rk, benchId))
-	timeout = time.time() + 300
-	while RUN:
-		raw = storage.find_one({'_id': rk, 'benchId': benchId}, mfields={'bench_timestamp': 1})
-		if raw:
-			elapsed = time.time() - float(raw['bench_timestamp'])
-			storage.get_backend('events').remove({'_id': rk}, safe=True)
-			logger.info(" + Done, Delta: %.3f s" % elapsed )
-			total = elapsed + duration - 1
-			logger.info(" + Est: %.0f Events/sec" % (n/total))
-			break
-		
-		if time.time() > timeout:
-			logger.info(" + Fail, timeout")
-			break
+	scenario = dict(DEFAULT_SCENARIO)
+
+	for key, value in config.items(section):
+		if key not in DEFAULT_SCENARIO:
+			logger.warning("Unknown scenario parameter '%s'" % key)
+			continue
+
+		scenario[key] = type(DEFAULT_SCENARIO[key])(float(value))
+
+	return scenario
 
-		time.sleep(0.001)
+class generator(object):
+	"""
+		Reproducible stream of events for a scenario.
+	"""
+
+	def __init__(self, scenario):
+		self.scenario = scenario
+		self.random = random.Random(scenario['seed'])
 
-	return elapsed
+		# Checks, in decreasing order of activity
+		self.checks = []
+
+		for c in range(scenario['components']):
+			component = "bench-component-%s" % c
+
+			if scenario['resources']:
+				for r in range(scenario['resources']):
+					self.checks.append((component, "bench-resource-%s" % r))
+			else:
+				self.checks.append((component, None))
+
+		self.random.shuffle(self.checks)
+
+		# Zipf cumulative weights
+		self.cumweights = []
+		total = 0.0
+
+		for rank in range(1, len(self.checks) + 1):
+			total += 1.0 / (rank ** scenario['zipf'])
+			self.cumweights.append(total)
+
+		self.states = {}
+
+		# Events eventstore publishes on canopsis.alerts: first sighting
+		# and state changes of checks, acks and downtimes
+		self.alerts = 0
+
+	def pick_check(self):
+		value = self.random.random() * self.cumweights[-1]
+		return self.checks[bisect.bisect(self.cumweights, value)]
+
+	def forge_check(self, component, resource):
+		state = self.states.get((component, resource), None)
+
+		if state is None:
+			self.alerts += 1
+			state = 0
+
+		if self.random.random() < self.scenario['flip_rate']:
+			state = self.random.choice([s for s in [0, 1, 2, 3] if s != state])
+
+			if (component, resource) in self.states:
+				self.alerts += 1
+
+		self.states[(component, resource)] = state
+
+		perf_data_array = [
+			{'metric': 'metric%s' % i, 'value': round(self.random.random() * 100, 3), 'type': 'GAUGE'}
+			for i in range(self.scenario['perfdata'])
+		]
+
+		return cevent.forger(
+			connector = 'bench',
+			connector_name = 'bench',
+			event_type = 'check',
+			source_type = 'resource' if resource else 'component',
+			component = component,
+			resource = resource,
+			state = state,
+			state_type = 1,
+			output = "Bench state %s" % state,
+			perf_data_array = perf_data_array,
+			reverse_lookup = False
+		)
+
+	def forge_ack(self):
+		problems = [check for check, state in self.states.items() if state]
+
+		if not problems:
+			return None
+
+		component, resource = self.random.choice(sorted(problems))
+		source_type = 'resource' if resource else 'component'
+
+		ref_rk = cevent.get_routingkey({
+			'connector': 'bench',
+			'connector_name': 'bench',
+			'event_type': 'check',
+			'source_type': source_type,
+			'component': component,
+			'resource': resource
+		})
+
+		event = cevent.forger(
+			connector = 'bench',
+			connector_name = 'bench',
+			event_type = 'ack',
+			source_type = source_type,
+			component = component,
+			resource = resource,
+			ref_rk = ref_rk,
+			output = "Bench ack",
+			reverse_lookup = False
+		)
+		event['author'] = 'bench'
+
+		return event
+
+	def forge_downtime(self):
+		component, resource = self.pick_check()
+		now = int(time.time())
+
+		event = cevent.forger(
+			connector = 'bench',
+			connector_name = 'bench',
+			event_type = 'downtime',
+			source_type = 'component',
+			component = component,
+			output = "Bench downtime",
+			reverse_lookup = False
+		)
+		event.update({
+			'author': 'bench',
+			'downtime_id': self.random.randint(0, 1000000),
+			'start': now,
+			'end': now + 60,
+			'duration': 60,
+			'fixed': True,
+			'entry': now
+		})
+
+		return event
+
+	def __iter__(self):
+		for i in range(self.scenario['events']):
+			event = None
+
+			if self.random.random() < self.scenario['ack_rate']:
+				event = self.forge_ack()
+
+			elif self.random.random() < self.scenario['downtime_rate']:
+				event = self.forge_downtime()
+
+			if event:
+				self.alerts += 1
+			else:
+				event = self.forge_check(*self.pick_check())
+
+			event['bench_id'] = i
+			yield event
+
+class collector(object):
+	"""
+		Receive events at the end of the chain (canopsis.alerts), and
+		measure latencies from 'processing' stamps set by engines.
+		Checks only reach it on state changes, so latencies are the ones
+		of alerts.
+	"""
+
+	def __init__(self):
+		self.received = 0
+		self.first = None
+		self.last = None
+		self.latency = chistogram()
+		self.stages = {}
+
+	def on_event(self, event, msg):
+		now = time.time()
+
+		if event.get('connector') != 'bench' or 'bench_timestamp' not in event:
+			return
+
+		self.received += 1
+		self.last = now
+
+		if not self.first:
+			self.first = now
+
+		self.latency.add(now - event['bench_timestamp'])
+
+		# Time between the start of each stage and the start of the next one
+		stamps = sorted(event.get('processing', {}).items(), key=lambda stamp: stamp[1])
+		stamps = [('publish', event['bench_timestamp'])] + stamps + [('end', now)]
+
+		for (stage, start), (next_stage, end) in zip(stamps[:-1], stamps[1:]):
+			if stage not in self.stages:
+				self.stages[stage] = chistogram()
+
+			self.stages[stage].add(max(end - start, 0))
+
+def histogram_stats(histogram):
+	return {
+		'count': histogram.count,
+		'mean': round(histogram.mean(), 6),
+		'p50': round(histogram.percentile(50), 6),
+		'p90': round(histogram.percentile(90), 6),
+		'p99': round(histogram.percentile(99), 6),
+		'max': round(histogram.max, 6)
+	}
+
+def run_scenario(amqp, name, scenario):
+	results = collector()
+	amqp.add_queue(BENCH_QUEUE, ['#'], results.on_event, exchange_name=amqp.exchange_name_alerts, auto_delete=True)
+	amqp.start()
+	amqp.wait_connection()
+	time.sleep(1)
+
+	logger.info("Run scenario '%s': %s" % (name, scenario))
+
+	rate = scenario['rate']
+	sent = 0
+	start_time = time.time()
+
+	events = generator(scenario)
+
+	for event in events:
+		if not RUN:
+			break
+
+		event['bench_timestamp'] = time.time()
+		amqp.publish(event, cevent.get_routingkey(event), amqp.exchange_name_events)
+		sent += 1
+
+		if rate:
+			pause = start_time + float(sent) / rate - time.time()
+			if pause > 0:
+				time.sleep(pause)
+
+	send_duration = time.time() - start_time
+	logger.info(" + %s events sent in %.3f s (%.0f events/second)" % (sent, send_duration, sent / send_duration))
+
+	# Wait for the end of the chain
+	timeout = time.time() + scenario['timeout']
+	while RUN and results.received < events.alerts and time.time() < timeout:
+		time.sleep(0.1)
+
+	if results.received < events.alerts:
+		logger.warning(" + Only %s/%s alerts received" % (results.received, events.alerts))
+
+	duration = (results.last or time.time()) - start_time
+
+	return {
+		'scenario': name,
+		'config': scenario,
+		'timestamp': int(start_time),
+		'sent': sent,
+		'alerts': events.alerts,
+		'received': results.received,
+		'send_rate': round(sent / send_duration, 2),
+		'throughput': round(sent / duration, 2),
+		'latency': histogram_stats(results.latency),
+		'stages': dict([
+			(stage, histogram_stats(histogram))
+			for stage, histogram in results.stages.items()
+		])
+	}
+
+def compare(result, baseline, tolerance):
+	"""
+		Returns False if throughput is lower than baseline's by more than tolerance (%).
+	"""
+
+	minimum = baseline['throughput'] * (1 - tolerance / 100.0)
+
+	logger.info("Throughput: %.2f events/second, baseline: %.2f events/second" % (result['throughput'], baseline['throughput']))
+	logger.info("p99 latency: %.4f s, baseline: %.4f s" % (result['latency']['p99'], baseline['latency']['p99']))
+
+	if result['throughput'] < minimum:
+		logger.error("Throughput regression: %.2f < %.2f events/second" % (result['throughput'], minimum))
+		return False
+
+	return True
 
 def clean_db():
 	# Clean DB
 	logger.info("Remove old data")
 
-	for perf_data in base_component_event['perf_data_array']:
-		manager.remove(name="%sbench%s" % (base_component_event['component'], perf_data['metric']))
-
-	#storage.get_backend('perfdata2').remove({'co': {'$regex': 'component-.*'}}, safe=True)
+	storage = get_storage(namespace='events', account=caccount(user="root", group="root"))
 
 	storage.get_backend('events').remove({'connector': 'bench'}, safe=True)
-	storage.get_backend('events_log').remove({'connector': 'bench'}, safe=True)
-
-	time.sleep(1)
-	if (storage.get_backend('events').find({'connector': 'bench'}).count()):
-		logger.error(" + All data are not removed ...")
-	else:	
-		logger.info(" + Done")
+	ceventlog(storage=storage).remove({'connector': 'bench'})
 
-def average(values) :
-	return sum(values) / float(len(values))
+	logger.info(" + Done")
 
-def stat_variance( echantillon ) :
-	n = len( echantillon ) # taille
-	mq = average( echantillon )**2
-	s = sum( [ x**2 for x in echantillon ] )
-	variance = s / n - mq
-	return variance
+def usage():
+	print >>sys.stderr, "Usage: cps_bench.py [-c <scenarios file>] [-s <scenario>] [-o <results file>] [-b <baseline results file>] [-t <tolerance %>]"
 
 ########################################################
 #
@@ -214,39 +396,70 @@ def stat_variance( echantillon ) :
 #
 ########################################################
 
+if __name__ == '__main__':
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], 'c:s:o:b:t:h')
+
+	except getopt.GetoptError as err:
+		usage()
+		sys.exit(1)
+
+	path = '~/etc/cps_bench.conf'
+	name = 'default'
+	output = None
+	baseline = None
+	tolerance = 10.0
+
+	for o, a in opts:
+		if o == '-c':
+			path = a
+
+		elif o == '-s':
+			name = a
+
+		elif o == '-o':
+			output = a
+
+		elif o == '-b':
+			baseline = a
+
+		elif o == '-t':
+			tolerance = float(a)
+
+		else:
+			usage()
+			sys.exit(1)
+
+	if not output:
+		output = 'cps_bench-%s-%s.json' % (name, int(time.time()))
+
+	amqp = camqp()
+	success = True
+
+	try:
+		scenario = load_scenario(path, name)
+
+		clean_db()
+		result = run_scenario(amqp, name, scenario)
+		clean_db()
+
+		with open(output, 'w') as f:
+			json.dump(result, f, indent=4, sort_keys=True)
+
+		logger.info("Results written in %s" % output)
+
+		if baseline:
+			with open(baseline) as f:
+				success = compare(result, json.load(f), tolerance)
+
+	except Exception as err:
+		logger.error('Bench Failed !')
+		logger.error(err)
+		traceback.print_exc(file=sys.stdout)
+		success = False
+
+	amqp.stop()
+	amqp.join()
 
-amqp.start()
-
-clean_db()
-stats = []
-
-try:
-	# Send n events and check lattency
-	#nbs = [ 500, 1000, 1250, 1500, 1750, 2000, 2250, 2500, 2750, 3000, 3250, 3500, 3750, 4000 ]
-	#rates =  [100, 150, 200, 250, 300, 350, 400, 450, 500]
-	nbs = [ 10000 ]
-	#nbs = [ 10000 ]
-	#rates = [ 100, 200, 300, 400 ]
-	rates = [ 370 ]
-	
-	for rate in rates:
-		for nb in nbs:
-			result = send_events(nb, rate)
-			stats.append((nb, rate, result))
-			time.sleep(5)
-			#clean_db()
-
-	clean_db()
-
-except Exception as err:
-	logger.error('Bench Failed !')
-	logger.error(err)
-	traceback.print_exc(file=sys.stdout)
-
-times = [stat[2] for stat in stats]
-print "Stats:"
-print " + Average: 	%.2f" % average(times)
-print " + Variance:	%.2f" % stat_variance(times)
-
-amqp.stop()
-amqp.join()
\ No newline at end of file
+	if not success:
+		sys.exit(1)
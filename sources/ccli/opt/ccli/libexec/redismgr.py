@@ -37,24 +37,13 @@ class cli(ccmd):
 		self.key_info = 'gte_values_in_redis'
 
 	def _get_data(self, _id):
-		data = self.manager.store.redis.lrange(_id, 0, -1)
-
-		def clean_point(p):
-			p[0] = int(p[0])
-			p[1] = float(p[1])
-
-			return p
-
-		return [clean_point(p.split('|')) for p in data]
+		return self.manager.get_data(_id)
 
 	def _get_redis_data(self):
 		keys = self.manager.store.redis.keys('*')
 		keys.remove('perfstore2:rotate:plan')
 
-		for key in keys:
-			self.manager.store.redis_pipe.llen(key)
-
-		result = self.manager.store.redis_pipe.execute()
+		result = self.manager.store.count_plain(keys)
 		data = {}
 
 		for index, key in enumerate(keys):
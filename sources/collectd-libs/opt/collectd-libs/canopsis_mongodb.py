@@ -61,6 +61,7 @@ def read_callback(data=None):
 	## Pyperfstore
 	perfdata2_size = storage.get_namespace_size("perfdata2_bin.chunks") 
 	perfdata2_size += storage.get_namespace_size("perfdata2_bin.files")
+	perfdata2_size += storage.get_namespace_size("perfdata2_chunks")
 	perfdata2_size += storage.get_namespace_size("perfdata2")
 	perfdata2_size += storage.get_namespace_size("perfdata2_daily")
 	put_value("perfdata2_size", perfdata2_size)
@@ -21,6 +21,7 @@
 from caccount import caccount
 from cstorage import cstorage
 from crecord import crecord
+from ceventlog import ceventlog
 
 ##set root account
 root = caccount(user="root", group="root")
@@ -29,11 +30,14 @@ storage = cstorage(account=root)
 logger = None
 
 def init():
-	namespaces = ['cache', 'events', 'events_log', 'object' ]
+	namespaces = ['cache', 'events', 'object' ]
 	
 	for namespace in namespaces:
 		logger.info(" + Drop '%s' collection" % namespace)
 		storage.drop_namespace(namespace)
+
+	logger.info(" + Drop 'events_log' collections")
+	ceventlog(storage=storage).drop()
 	
 	#logger.info(" + Create 'cache' collection")
 	## Create 100MB cache
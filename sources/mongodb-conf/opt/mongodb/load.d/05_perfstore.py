@@ -20,6 +20,7 @@
 
 import logging
 import pyperfstore2
+from pyperfstore2 import codec
 
 logger = None
 
@@ -32,6 +33,8 @@ def init():
 
 def update():
 	add_rotate_task()
+	move_chunks()
+	pack_plain()
 
 	# tweak: rename all 'stat' metrics
 	metrics = manager.find(mfilter={"co": "stat", "me": {"$regex": "^cps_.*"}})
@@ -51,6 +54,34 @@ def update():
 		manager.store.remove(_id=old_id)
 
 
+def move_chunks():
+	"""
+		Move chunks listed in metas ('c' and 'rc' arrays) to the chunks collection.
+	"""
+
+	metas = manager.store.collection.find(
+		{'$or': [{'c': {'$exists': True}}, {'rc': {'$exists': True}}]},
+		fields=['c', 'rc', 'rlts'])
+
+	for meta in metas:
+		_id = meta['_id']
+		logger.info(" + Index chunks of '%s'" % _id)
+
+		for fts, lts, bin_id in meta.get('c', []):
+			data = manager.store.get_bin(bin_id)
+
+			if data is not None:
+				manager.store.add_chunk(bin_id, _id, fts, lts, codec.get_count(data))
+
+		for tier, fts, lts, bin_id, count in meta.get('rc', []):
+			manager.store.add_chunk(bin_id, _id, fts, lts, count, tier=tier, rlts=meta.get('rlts', lts))
+
+		manager.store.update(_id, munset={'c': True, 'rc': True}, upsert=False)
+
+def pack_plain():
+	logger.info(" + Pack plain points in Redis")
+	logger.info("   + %s key(s) packed" % manager.store.migrate())
+
 def add_rotate_task():
 	#### TODO: Remove this !!
 
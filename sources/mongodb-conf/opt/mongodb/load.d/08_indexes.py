@@ -20,6 +20,7 @@
 
 from caccount import caccount
 from cstorage import get_storage
+from ceventlog import ceventlog
 
 logger = None
 
@@ -29,7 +30,8 @@ storage = get_storage(account=root, namespace='object')
 
 INDEXES = {
 	'object': [
-		[('crecord_type', 1)]
+		[('crecord_type', 1)],
+		[('aaa_readers', 1)]
 	],
 	'perfdata2': [
 		[('co', 1), ('re', 1), ('me', 1)],
@@ -40,6 +42,9 @@ INDEXES = {
 		[('lv', 1)],
 		[('lv', -1)]
 	],
+	'perfdata2_chunks': [
+		[('meta_id', 1), ('tier', 1), ('lts', 1)]
+	],
 	'perfdata2_daily': [
 		[('insert_date', 1)]
 	],
@@ -67,6 +72,8 @@ INDEXES = {
 			('state', 1)
 		],[
 			('state', -1)
+		],[
+			('aaa_readers', 1)
 		]
 	],
 	'events_log': [
@@ -95,6 +102,8 @@ INDEXES = {
 			('tags', 1)
 		],[
 			('referer', 1)
+		],[
+			('aaa_readers', 1)
 		]
 	],
 	'entities': [
@@ -118,12 +127,18 @@ def init():
 	if user_input == 'Y':
 		print 'Starting indexes update...'
 
-		for collection in INDEXES:
+		collections = dict(INDEXES)
+
+		# Time partitions of events_log
+		for start, period, collection in ceventlog(storage=storage).list_partitions():
+			collections[collection] = INDEXES['events_log']
+
+		for collection in collections:
 			logger.info(' + Create indexes for collection {0}'.format(collection))
 			col = storage.get_backend(collection)
 			col.drop_indexes()
 
-			for index in INDEXES[collection]:
+			for index in collections[collection]:
 				col.ensure_index(index)
 	else:
 		print 'Skipping indexes update'
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+#--------------------------------
+# Copyright (c) 2011 "Capensis" [http://www.capensis.com]
+#
+# This file is part of Canopsis.
+#
+# Canopsis is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canopsis is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Canopsis.  If not, see <http://www.gnu.org/licenses/>.
+# ---------------------------------
+
+from caccount import caccount
+from cstorage import get_storage
+from crecord import crecord
+
+logger = None
+
+##set root account
+root = caccount(user="root", group="root")
+storage = get_storage(account=root, namespace='object')
+
+BULK_SIZE = 1000
+
+def init():
+	pass
+
+def update():
+	update_readers()
+
+def update_readers():
+	"""
+		Backfill 'aaa_readers' of records written before it existed.
+	"""
+
+	for namespace in storage.db.collection_names():
+		if namespace.startswith('system.'):
+			continue
+
+		backend = storage.get_backend(namespace)
+		mfilter = {'aaa_owner': {'$exists': True}, 'aaa_readers': {'$exists': False}}
+
+		if not backend.find_one(mfilter, fields=['_id']):
+			continue
+
+		logger.info(" + Set readers of records in '%s'" % namespace)
+
+		bulk = backend.initialize_unordered_bulk_op()
+		size = 0
+		total = 0
+
+		for raw_record in backend.find(mfilter):
+			# load consumes the raw record
+			_id = raw_record['_id']
+
+			try:
+				readers = crecord(raw_record=raw_record).get_readers()
+			except Exception, err:
+				logger.warning("   + Invalid record '%s': %s" % (_id, err))
+				continue
+
+			bulk.find({'_id': _id}).update_one({'$set': {'aaa_readers': readers}})
+			size += 1
+
+			if size >= BULK_SIZE:
+				bulk.execute()
+				bulk = backend.initialize_unordered_bulk_op()
+				total += size
+				size = 0
+
+		if size:
+			bulk.execute()
+			total += size
+
+		logger.info("   + %s record(s) updated" % total)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+#--------------------------------
+# Copyright (c) 2011 "Capensis" [http://www.capensis.com]
+#
+# This file is part of Canopsis.
+#
+# Canopsis is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canopsis is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Canopsis.  If not, see <http://www.gnu.org/licenses/>.
+# ---------------------------------
+
+import os, threading
+
+from pymongo import Connection
+
+# Pooled clients of this process: (uri, safe) -> client
+CLIENTS = {}
+CLIENTS_PID = os.getpid()
+CLIENTS_LOCK = threading.Lock()
+
+POOL_SIZE = 50
+
+def use_greenlets():
+	try:
+		from gevent import monkey
+		return monkey.is_module_patched('socket')
+
+	except (ImportError, AttributeError):
+		return False
+
+def get_client(host, port, db, userid=None, password=None, safe=True):
+	"""
+		Return the pooled client of this process for
+		(host, port, db, credentials, safe). Clients inherited
+		from a parent process are dropped, their sockets can't be shared.
+	"""
+
+	global CLIENTS_PID
+
+	if userid and password:
+		uri = 'mongodb://{0}:{1}@{2}:{3}/{4}'.format(userid, password, host, port, db)
+	else:
+		uri = 'mongodb://{0}:{1}/{2}'.format(host, port, db)
+
+	key = (uri, safe)
+
+	with CLIENTS_LOCK:
+		if CLIENTS_PID != os.getpid():
+			CLIENTS.clear()
+			CLIENTS_PID = os.getpid()
+
+		client = CLIENTS.get(key, None)
+
+		if client is None:
+			# Acknowledged writes don't need a socket per thread to
+			# read them back
+			client = Connection(uri, safe=safe, max_pool_size=POOL_SIZE, auto_start_request=not safe, use_greenlets=use_greenlets())
+			CLIENTS[key] = client
+
+		return client
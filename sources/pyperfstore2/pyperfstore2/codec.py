@@ -0,0 +1,614 @@
+#!/usr/bin/env python
+#--------------------------------
+# Copyright (c) 2011 "Capensis" [http://www.capensis.com]
+#
+# This file is part of Canopsis.
+#
+# Canopsis is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canopsis is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Canopsis.  If not, see <http://www.gnu.org/licenses/>.
+# ---------------------------------
+
+# Chunk formats:
+#
+#  - version 0 (msgpack): zlib(msgpack((fts, [value | [interval, value], ...])))
+#    Written before versioning, recognized by the zlib header byte (0x78).
+#
+#  - version 1 (columnar): header '<BcBIq' (version, value type, scale, count,
+#    fts) followed by zlib(timestamps + values). Both columns are arrays of
+#    little-endian 64 bits words, stored byte-shuffled (all first bytes, then
+#    all second bytes, ...) so that zlib sees long runs of zero bytes:
+#      + timestamps: zigzag delta-of-delta of timestamps (count - 1 words)
+#      + values 'i': zigzag deltas of values (count words)
+#      + values 'd': decimals, values 'i' of value * 10 ** scale
+#      + values 'f': XOR of consecutive float bits (count words)
+#
+#  - version 2 (blocks): header '<BI' (version, blocks count), followed by an
+#    index of '<qqII' (fts, lts, count, size) by block and by the blocks, each
+#    one a version 1 chunk of BLOCK_SIZE points at most. A range read only
+#    decodes blocks of the index overlapping the range. Chunks holding a
+#    single block are written in version 1.
+#
+# Plain points, waiting in Redis for their rotation, are appended to a string
+# as '<Id' (timestamp, value) records of 12 bytes.
+
+import logging
+logger = logging.getLogger('codec')
+
+import zlib
+import struct
+from array import array
+
+import msgpack
+packer = None
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+VERSION_MSGPACK = 0
+VERSION_COLUMNAR = 1
+VERSION_BLOCKS = 2
+
+VERSION = VERSION_BLOCKS
+
+TYPE_INT = 'i'
+TYPE_DECIMAL = 'd'
+TYPE_FLOAT = 'f'
+
+ZLIB_HEADER = 0x78
+ZLIB_LEVEL = 6
+
+HEADER = struct.Struct('<BcBIq')
+
+BLOCKS_HEADER = struct.Struct('<BI')
+BLOCK_INDEX = struct.Struct('<qqII')
+BLOCK_SIZE = 1024
+
+# Keep deltas of deltas in 64 bits
+LIMIT = 2 ** 61
+
+# Plain points records
+POINT = struct.Struct('<Id')
+POINT_DTYPE = [('timestamp', '<u4'), ('value', '<f8')]
+
+POINT_NUMPY_MIN = 64
+
+# Plain values given back as int, exact in a double
+MAX_INT = 2 ** 53
+
+# Max digits of decimal values
+MAX_SCALE = 6
+SCALE_SAMPLE = 64
+
+# array.array typecode of decoded integers
+INT_TYPECODE = 'l' if array('l').itemsize >= 8 else 'd'
+
+#### Encode
+def encode(points, level=ZLIB_LEVEL, version=VERSION):
+	if version == VERSION_BLOCKS and len(points) > BLOCK_SIZE:
+		data = encode_blocks(points, level)
+
+		if data is not None:
+			return data
+
+	elif version in (VERSION_COLUMNAR, VERSION_BLOCKS):
+		data = encode_columnar(points, level)
+
+		if data is not None:
+			return data
+
+	return encode_msgpack(points)
+
+def encode_msgpack(points):
+	# Create packer
+	global packer
+	if not packer:
+		packer = msgpack.Packer()
+
+	# Remplace timestamp by interval
+	fts = points[0][0]
+	last_timestamp = fts
+	last_interval = 0
+	value = points[0][1]
+
+	if isinstance(value, float) and float.is_integer(value):
+		value = int(value)
+
+	data = [value]
+
+	xr = xrange(1, len(points))
+
+	for i in xr:
+		point = points[i]
+		value = point[1]
+
+		if value == int(value):
+			value = int(value)
+
+		interval = point[0] - last_timestamp
+		last_timestamp = point[0]
+
+		if interval != last_interval:
+			data.append([interval, value])
+			last_interval = interval
+		else:
+			data.append(value)
+
+	data = (fts, data)
+
+	# Pack and compress points
+	return zlib.compress(packer.pack(data), 9)
+
+def encode_columnar(points, level=ZLIB_LEVEL):
+	"""
+		Return None when points can't be stored in columns
+		(non integer timestamps, None or non numeric values).
+	"""
+
+	timestamps = [point[0] for point in points]
+	values = [point[1] for point in points]
+
+	try:
+		itimestamps = [int(timestamp) for timestamp in timestamps]
+		vtype = get_type(values)
+
+	except TypeError:
+		return None
+
+	if itimestamps != timestamps or not in_limit(itimestamps):
+		return None
+
+	scale = 0
+
+	if vtype == TYPE_INT:
+		values = [int(value) for value in values]
+
+		if not in_limit(values):
+			return None
+	else:
+		values = [float(value) for value in values]
+		scale, decimals = get_scale(values)
+
+		if scale:
+			vtype = TYPE_DECIMAL
+			values = decimals
+
+	header = HEADER.pack(VERSION_COLUMNAR, vtype, scale, len(points), itimestamps[0])
+
+	if numpy is not None:
+		body = encode_columns_numpy(itimestamps, values, vtype)
+	else:
+		body = encode_columns_array(itimestamps, values, vtype)
+
+	return header + zlib.compress(body, level)
+
+def encode_blocks(points, level=ZLIB_LEVEL):
+	index = []
+	blocks = []
+
+	for i in xrange(0, len(points), BLOCK_SIZE):
+		block = points[i:i + BLOCK_SIZE]
+		data = encode_columnar(block, level)
+
+		if data is None:
+			return None
+
+		index.append(BLOCK_INDEX.pack(block[0][0], block[-1][0], len(block), len(data)))
+		blocks.append(data)
+
+	return BLOCKS_HEADER.pack(VERSION_BLOCKS, len(blocks)) + ''.join(index) + ''.join(blocks)
+
+def get_type(values):
+	try:
+		if [int(value) for value in values] == values:
+			return TYPE_INT
+
+	except (ValueError, OverflowError):
+		# nan or inf
+		pass
+
+	return TYPE_FLOAT
+
+def get_scale(values):
+	"""
+		Return the smallest scale giving back exactly the values
+		by value = decimal / 10.0 ** scale, and the decimals.
+	"""
+
+	for scale in xrange(1, MAX_SCALE + 1):
+		factor = 10.0 ** scale
+
+		try:
+			# Try first on a sample, most float series have no scale
+			for sample in (values[:SCALE_SAMPLE], values):
+				decimals = [int(round(value * factor)) for value in sample]
+
+				if not in_limit(decimals):
+					return 0, None
+
+				if [decimal / factor for decimal in decimals] != sample:
+					break
+
+			else:
+				return scale, decimals
+
+		except (ValueError, OverflowError):
+			# nan or inf
+			break
+
+	return 0, None
+
+def in_limit(values):
+	return -LIMIT < min(values) and max(values) < LIMIT
+
+def encode_columns_numpy(timestamps, values, vtype):
+	timestamps = numpy.array(timestamps, dtype=numpy.int64)
+	columns = [zigzag_numpy(deltas_numpy(numpy.diff(timestamps)))]
+
+	if vtype == TYPE_FLOAT:
+		bits = numpy.array(values, dtype=numpy.float64).view(numpy.uint64)
+		xor = bits.copy()
+		xor[1:] ^= bits[:-1]
+		columns.append(xor)
+
+	else:
+		columns.append(zigzag_numpy(deltas_numpy(numpy.array(values, dtype=numpy.int64))))
+
+	return ''.join([
+		column.astype('<u8').view(numpy.uint8).reshape(-1, 8).T.tostring()
+		for column in columns
+	])
+
+def encode_columns_array(timestamps, values, vtype):
+	intervals = [timestamps[i] - timestamps[i - 1] for i in xrange(1, len(timestamps))]
+	body = shuffle(pack(zigzag(deltas(intervals))))
+
+	if vtype == TYPE_FLOAT:
+		bits = unpack(pack(values, 'd'))
+		xor = [bits[0]] + [bits[i] ^ bits[i - 1] for i in xrange(1, len(bits))]
+		body += shuffle(pack(xor))
+
+	else:
+		body += shuffle(pack(zigzag(deltas(values))))
+
+	return body
+
+def deltas_numpy(values):
+	result = values.copy()
+	result[1:] -= values[:-1]
+	return result
+
+def deltas(values):
+	if not values:
+		return []
+
+	return [values[0]] + [values[i] - values[i - 1] for i in xrange(1, len(values))]
+
+def zigzag_numpy(values):
+	return ((values << 1) ^ (values >> 63)).view(numpy.uint64)
+
+def zigzag(values):
+	return [(value << 1) ^ (value >> 63) for value in values]
+
+#### Decode
+def get_version(data):
+	if not data:
+		raise ValueError("Invalid data type (%s)" % type(data))
+
+	version = ord(data[0])
+
+	if version == ZLIB_HEADER:
+		return VERSION_MSGPACK
+
+	if version not in (VERSION_COLUMNAR, VERSION_BLOCKS):
+		raise ValueError("Unknown chunk version (%s)" % version)
+
+	return version
+
+def decode(data, tstart=None, tstop=None):
+	"""
+		Return timestamps and values of a chunk as two arrays
+		(numpy.ndarray or array.array without NumPy). With tstart or tstop,
+		only blocks overlapping the range are decoded, so arrays can hold
+		points out of it but always hold all points in it.
+	"""
+
+	version = get_version(data)
+
+	if version == VERSION_MSGPACK:
+		points = decode_msgpack(data)
+		timestamps = [point[0] for point in points]
+		values = [point[1] for point in points]
+
+		if numpy is not None:
+			return numpy.array(timestamps, dtype=numpy.int64), numpy.array(values)
+
+		if get_type(values) == TYPE_INT:
+			return array(INT_TYPECODE, timestamps), array(INT_TYPECODE, values)
+
+		return array(INT_TYPECODE, timestamps), array('d', values)
+
+	if version == VERSION_COLUMNAR:
+		return decode_columnar(data)
+
+	columns = [
+		decode_columnar(data[offset:offset + size])
+		for fts, lts, count, offset, size in get_blocks(data)
+		if (tstart is None or lts >= tstart) and (tstop is None or fts <= tstop)
+	]
+
+	if numpy is not None:
+		if not columns:
+			return numpy.array([], dtype=numpy.int64), numpy.array([])
+
+		return numpy.concatenate([column[0] for column in columns]), numpy.concatenate([column[1] for column in columns])
+
+	timestamps = array(INT_TYPECODE)
+	values = array('d')
+
+	# Integer values stay integers when all decoded blocks hold integers
+	if columns and all([column[1].typecode == INT_TYPECODE for column in columns]):
+		values = array(INT_TYPECODE)
+
+	for column in columns:
+		timestamps.extend(column[0])
+		values.extend(column[1])
+
+	return timestamps, values
+
+def decode_columnar(data):
+	version, vtype, scale, count, fts = HEADER.unpack_from(data)
+	body = zlib.decompress(data[HEADER.size:])
+
+	if numpy is not None:
+		return decode_columns_numpy(body, vtype, scale, count, fts)
+
+	return decode_columns_array(body, vtype, scale, count, fts)
+
+def decode_points(data, tstart=None, tstop=None):
+	"""
+		Return points of a chunk as a list of [timestamp, value].
+	"""
+
+	if get_version(data) == VERSION_MSGPACK:
+		return decode_msgpack(data)
+
+	timestamps, values = decode(data, tstart, tstop)
+
+	return map(list, zip(timestamps.tolist(), values.tolist()))
+
+def get_blocks(data):
+	"""
+		Return (fts, lts, count, offset, size) of blocks of a version 2 chunk.
+	"""
+
+	version, nblocks = BLOCKS_HEADER.unpack_from(data)
+
+	blocks = []
+	offset = BLOCKS_HEADER.size + nblocks * BLOCK_INDEX.size
+
+	for i in xrange(nblocks):
+		fts, lts, count, size = BLOCK_INDEX.unpack_from(data, BLOCKS_HEADER.size + i * BLOCK_INDEX.size)
+		blocks.append((fts, lts, count, offset, size))
+		offset += size
+
+	return blocks
+
+def get_count(data):
+	"""
+		Return the number of points of a chunk, without decoding it
+		when its header holds it.
+	"""
+
+	version = get_version(data)
+
+	if version == VERSION_MSGPACK:
+		return len(decode_msgpack(data))
+
+	if version == VERSION_COLUMNAR:
+		return HEADER.unpack_from(data)[3]
+
+	return sum([block[2] for block in get_blocks(data)])
+
+def decode_msgpack(data):
+	data = msgpack.unpackb(str(zlib.decompress(data)), use_list=True)
+
+	fts = data[0]
+	points = data[1]
+
+	if not isinstance(points, list):
+		raise ValueError("Invalid type (%s)" % type(points))
+
+	rpoints = []
+
+	#first point
+	rpoints.append([fts, points[0]])
+	timestamp = fts
+
+	xr = xrange(1, len(points))
+
+	interval = 0
+
+	for i in xr:
+		value = points[i]
+
+		if isinstance(value, list):
+			interval = value[0]
+			value = value[1]
+
+		timestamp += interval
+		rpoint = [timestamp, value]
+		rpoints.append(rpoint)
+
+	return rpoints
+
+def decode_columns_numpy(body, vtype, scale, count, fts):
+	columns = numpy.frombuffer(body, dtype=numpy.uint8)
+
+	size = 8 * (count - 1)
+	intervals = unzigzag_numpy(unshuffle_numpy(columns[:size]))
+	values = unshuffle_numpy(columns[size:])
+
+	timestamps = numpy.empty(count, dtype=numpy.int64)
+	timestamps[0] = fts
+	numpy.cumsum(numpy.cumsum(intervals), out=timestamps[1:])
+	timestamps[1:] += fts
+
+	if vtype == TYPE_FLOAT:
+		values = numpy.bitwise_xor.accumulate(values).view(numpy.float64)
+
+	else:
+		values = numpy.cumsum(unzigzag_numpy(values))
+
+		if vtype == TYPE_DECIMAL:
+			values = values / 10.0 ** scale
+
+	return timestamps, values
+
+def decode_columns_array(body, vtype, scale, count, fts):
+	size = 8 * (count - 1)
+	timestamps = array(INT_TYPECODE, [fts])
+
+	interval = 0
+	timestamp = fts
+	for delta in unzigzag(unpack(unshuffle(body[:size]))):
+		interval += delta
+		timestamp += interval
+		timestamps.append(timestamp)
+
+	if vtype == TYPE_FLOAT:
+		bits = []
+
+		value = 0
+		for xor in unpack(unshuffle(body[size:])):
+			value ^= xor
+			bits.append(value)
+
+		values = array('d', unpack(pack(bits), 'd'))
+
+	else:
+		values = array(INT_TYPECODE if vtype == TYPE_INT else 'd')
+		factor = 10.0 ** scale
+
+		value = 0
+		for delta in unzigzag(unpack(unshuffle(body[size:]))):
+			value += delta
+			values.append(value if vtype == TYPE_INT else value / factor)
+
+	return timestamps, values
+
+def unzigzag_numpy(values):
+	return (values >> 1).view(numpy.int64) ^ -(values & 1).view(numpy.int64)
+
+def unzigzag(values):
+	return [(value >> 1) ^ -(value & 1) for value in values]
+
+#### Byte shuffle
+def pack(values, fmt='Q'):
+	return struct.pack('<%s%s' % (len(values), fmt), *values)
+
+def unpack(data, fmt='Q'):
+	return struct.unpack('<%s%s' % (len(data) / 8, fmt), data)
+
+def shuffle(data):
+	return ''.join([data[i::8] for i in xrange(8)])
+
+def unshuffle(data):
+	count = len(data) / 8
+	result = bytearray(len(data))
+
+	for i in xrange(8):
+		result[i::8] = data[i * count:(i + 1) * count]
+
+	return str(result)
+
+def unshuffle_numpy(data):
+	return data.reshape(8, -1).T.copy().view('<u8').ravel().astype(numpy.uint64)
+
+#### Rollups
+def encode_rollup(rows, level=ZLIB_LEVEL):
+	"""
+		Encode rows of [timestamp, min, max, sum, count], one chunk by column.
+	"""
+
+	timestamps = [row[0] for row in rows]
+	columns = [encode(zip(timestamps, [row[i] for row in rows]), level) for i in xrange(1, 5)]
+
+	return msgpack.packb(columns)
+
+def decode_rollup(data, tstart=None, tstop=None):
+	# Columns share their timestamps, so the same blocks are decoded
+	columns = [decode_points(column, tstart, tstop) for column in msgpack.unpackb(str(data))]
+
+	timestamps = [point[0] for point in columns[0]]
+	values = [[point[1] for point in column] for column in columns]
+
+	return map(list, zip(timestamps, *values))
+
+#### Plain points
+def pack_points(points):
+	return ''.join([POINT.pack(int(point[0]), float(point[1])) for point in points])
+
+def unpack_points(data):
+	"""
+		Return plain points as a list of [timestamp, value], integral
+		values are given back as int.
+	"""
+
+	if not data:
+		return []
+
+	count = len(data) / POINT.size
+
+	# NumPy only pays off on long buffers (not for the last point)
+	if numpy is not None and count > POINT_NUMPY_MIN:
+		records = numpy.frombuffer(data, dtype=POINT_DTYPE)
+		values = records['value']
+
+		with numpy.errstate(invalid='ignore'):
+			integral = (numpy.abs(values) < MAX_INT) & (values == numpy.floor(values))
+
+		rvalues = values.astype(object)
+		rvalues[integral] = values[integral].astype(numpy.int64).astype(object)
+
+		return map(list, zip(records['timestamp'].tolist(), rvalues.tolist()))
+
+	records = struct.unpack('<' + 'Id' * count, data)
+
+	return [
+		[records[i], int(records[i + 1]) if is_integral(records[i + 1]) else records[i + 1]]
+		for i in xrange(0, 2 * count, 2)
+	]
+
+def is_integral(value):
+	return -MAX_INT < value < MAX_INT and value.is_integer()
+
+def parse_points(items):
+	"""
+		Return points of the list format ('timestamp|value' items).
+	"""
+
+	points = []
+
+	for item in items:
+		timestamp, value = item.split('|')
+
+		try:
+			value = int(value)
+		except ValueError:
+			value = float(value)
+
+		points.append([int(timestamp), value])
+
+	return points
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+#--------------------------------
+# Copyright (c) 2011 "Capensis" [http://www.capensis.com]
+#
+# This file is part of Canopsis.
+#
+# Canopsis is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canopsis is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Canopsis.  If not, see <http://www.gnu.org/licenses/>.
+# ---------------------------------
+
+import hashlib
+import math
+import struct
+
+# Meta fields written by the store itself, not by pushers
+STORE_FIELDS = ('_id', 'lts', 'lv', 'fts', 'rts', 'rlts', 'nc', 'c', 'rc', 'd')
+
+def freeze(value):
+	"""
+		Return a hashable value with the same repr for a pushed value
+		and the same value read back from MongoDB (unicode, int or long).
+	"""
+	if isinstance(value, (list, tuple)):
+		return tuple(freeze(item) for item in value)
+
+	if isinstance(value, dict):
+		return tuple(sorted((freeze(key), freeze(item)) for key, item in value.iteritems()))
+
+	if isinstance(value, str):
+		return value.decode('utf-8', 'replace')
+
+	if isinstance(value, (int, long)) and not isinstance(value, bool):
+		return float(value)
+
+	return value
+
+def get_signature(meta_data):
+	"""
+		Return a digest of the pushed fields of meta_data, equal for
+		a pushed meta and the same meta read back from MongoDB, in any
+		process.
+	"""
+	frozen = freeze(dict((key, value) for key, value in meta_data.iteritems() if key not in STORE_FIELDS))
+	return struct.unpack('<q', hashlib.md5(repr(frozen)).digest()[:8])[0]
+
+class knownset(object):
+	"""
+		Series with their meta signature.
+	"""
+
+	def __init__(self):
+		self.series = {}
+
+	def __contains__(self, item):
+		_id, signature = item
+		return self.series.get(_id, None) == signature
+
+	def __len__(self):
+		return len(self.series)
+
+	def add(self, _id, signature):
+		self.series[_id] = signature
+
+	def discard(self, _id):
+		self.series.pop(_id, None)
+
+	def clear(self):
+		self.series.clear()
+
+class bloomset(object):
+	"""
+		Bloom filter of series with their meta signature, sized for
+		capacity series. A false positive skips a meta upsert, with a
+		probability of error_rate. A series can't be removed from the
+		filter: discarded series are kept in a set until added again,
+		the filter is cleared when this set holds more than
+		capacity * forgotten_ratio series.
+	"""
+
+	def __init__(self, capacity, error_rate=0.001, forgotten_ratio=0.1):
+		self.capacity = capacity
+		self.error_rate = error_rate
+		self.forgotten_size = int(capacity * forgotten_ratio)
+
+		self.size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+		self.hashes = max(1, int(round(self.size * math.log(2) / capacity)))
+
+		self.clear()
+
+	def get_bits(self, _id, signature):
+		h1, h2 = struct.unpack('<QQ', hashlib.md5("%s:%s" % (_id, signature)).digest())
+		return [(h1 + i * h2) % self.size for i in xrange(self.hashes)]
+
+	def __contains__(self, item):
+		if item[0] in self.forgotten:
+			return False
+
+		for bit in self.get_bits(*item):
+			if not self.bits[bit >> 3] & (1 << (bit & 7)):
+				return False
+
+		return True
+
+	def __len__(self):
+		return self.count
+
+	def add(self, _id, signature):
+		for bit in self.get_bits(_id, signature):
+			self.bits[bit >> 3] |= 1 << (bit & 7)
+
+		self.forgotten.discard(_id)
+		self.count += 1
+
+	def discard(self, _id):
+		if not self.count:
+			return
+
+		self.forgotten.add(_id)
+
+		if len(self.forgotten) > self.forgotten_size:
+			self.clear()
+
+	def clear(self):
+		self.bits = bytearray((self.size + 7) // 8)
+		self.forgotten = set()
+		self.count = 0
@@ -20,17 +20,23 @@
 # ---------------------------------
 
 import os, sys, json, logging, time
-import hashlib, gridfs, traceback
+import hashlib, traceback
 from datetime import datetime
 
 from pyperfstore2.store import store
 import pyperfstore2.utils as utils
+import pyperfstore2.codec as codec
 from cstorage import get_storage
 from caccount import caccount
 
+# Rollup tiers built at rotation (seconds), and max rows of their chunks
+TIERS = (5 * utils.MN, utils.HR, utils.D)
+TIER_CHUNK_SIZE = 1000
+TIER_POINTS_RATIO = 4
+
 class manager(object):
 
-	def __init__(self, retention=0, dca_min_length=250, logging_level=logging.INFO, cache=True, **kwargs):
+	def __init__(self, retention=0, dca_min_length=250, logging_level=logging.INFO, cache=True, tiers=TIERS, **kwargs):
 
 		self.logger = logging.getLogger('manager')
 		self.logger.setLevel(logging_level)
@@ -39,6 +45,7 @@ class manager(object):
 		self.store = store(logging_level=self.logger.level, **kwargs)
 
 		self.dca_min_length = dca_min_length
+		self.tiers = tiers
 
 		# Seconds
 		self.retention = retention
@@ -80,18 +87,8 @@ class manager(object):
 
 		return _id
 
-	def get_data(self, _id):
-		data = self.store.redis.lrange(_id, 0, -1)
-		def cleanPoint(p):
-			p[0] = int(p[0])
-			try:
-				p[1] = int(p[1])
-			except:
-				p[1] = float(p[1])
-			return p
-
-		data = [ cleanPoint(p.split('|')) for p in data ]
-		return data
+	def get_data(self, _id, count=None):
+		return self.store.get_plain(_id, count)
 
 	def get_meta(self, _id=None, name=None, raw=False, mfields=None):
 		_id = self.get_id(_id, name)
@@ -227,7 +224,7 @@ class manager(object):
 
 		return dca
 
-	def get_points(self, _id=None, name=None, tstart=None, tstop=None, raw=False, return_meta=False, add_prev_point=False, add_next_point=False, subset_selection={}):
+	def get_points(self, _id=None, name=None, tstart=None, tstop=None, raw=False, return_meta=False, add_prev_point=False, add_next_point=False, subset_selection={}, max_points=None, interval=None, atype=None, roundtime=True, timezone=time.timezone):
 		_id = self.get_id(_id, name)
 		if tstop == None:
 			tstop = int(time.time())
@@ -243,6 +240,21 @@ class manager(object):
 
 		dca = self.subset_selection_apply(dca, subset_selection)
 
+		## Read a rollup tier when it can answer the aggregation
+		tier = None
+		if not raw and not add_prev_point and not add_next_point and not subset_selection:
+			tier = self.get_tier(dca, tstart, tstop, max_points, interval, atype, roundtime, timezone)
+
+		if tier:
+			self.logger.debug(" + Use rollup tier %s" % tier)
+			points = self.get_tier_points(dca, tier, tstart, tstop, atype, max_points, interval, roundtime, timezone)
+			del dca['d']
+
+			if not return_meta:
+				return points
+			else:
+				return (dca, points)
+
 		plain_fts = None
 		plain_lts = None
 
@@ -255,24 +267,20 @@ class manager(object):
 		## Check Compressed DCA
 		if not plain_fts or tstart < plain_fts:
 			self.logger.debug(" + Search in compressed DCA")
-			bin_ids = []
-
-			for bin_meta in dca.get('c', []):
-				fts = bin_meta[0]
-				lts = bin_meta[1]
-				bin_id = bin_meta[2]
-				self.logger.debug(" + Parse DCA:\t\t%s (%s -> %s)" % (bin_id, datetime.utcfromtimestamp(fts), datetime.utcfromtimestamp(lts)))
-				if tstart == tstop and tstart >= fts and tstart <= lts:
-					bin_ids.append(bin_id)
-					self.logger.debug("   + Append")
-				elif utils.intersection([fts, lts], [tstart, tstop]):
-					bin_ids.append(bin_id)
-					self.logger.debug("   + Append")
-			for bin_id in bin_ids:
-				data = self.store.get_bin(_id=bin_id)
+
+			# Neighbour points can be in any block of a chunk
+			if add_prev_point or add_next_point:
+				bstart = bstop = None
+			else:
+				bstart = tstart
+				bstop = tstop
+
+			for chunk in self.store.find_chunks(_id, tstart, tstop, data=True):
+				self.logger.debug(" + Parse DCA:\t\t%s (%s -> %s)" % (chunk['_id'], datetime.utcfromtimestamp(chunk['fts']), datetime.utcfromtimestamp(chunk['lts'])))
+				data = self.store.get_chunk(chunk)
 
 				if data is not None:
-					points += utils.uncompress(data)
+					points += utils.uncompress(data, bstart, bstop)
 
 		## Check Plain DCA
 		self.logger.debug(" + Search in plain DCA")
@@ -354,6 +362,64 @@ class manager(object):
 		else:
 			return (dca, points)
 
+	def get_tier(self, dca, tstart, tstop, max_points=None, interval=None, atype=None, roundtime=True, timezone=time.timezone):
+		"""
+			Return the coarsest rollup tier still meeting an aggregation by
+			interval or by max_points, None if raw points are needed.
+		"""
+
+		if not atype or atype.upper() not in utils.ROLLUP_ATYPES:
+			return None
+
+		if dca.get('type', 'GAUGE') != 'GAUGE' or dca.get('rts') is None:
+			return None
+
+		# Chunks rotated before rollups only have raw points
+		rts = dca['rts']
+		if tstart < rts and self.store.find_chunks(dca['_id'], tstart, rts - 1, limit=1).count(True):
+			return None
+
+		if interval:
+			interval = int(interval)
+
+			if not roundtime or interval not in utils.intervalToRelativeDelta:
+				return None
+
+			# Steps of a day and more start at midnight
+			period = min(interval, utils.D)
+			tiers = [tier for tier in self.tiers if period % tier == 0 and timezone % tier == 0]
+
+		elif max_points:
+			# Enough points for aggregate by point to still return about max_points
+			step = (tstop - tstart) / float(max_points) / TIER_POINTS_RATIO
+			tiers = [tier for tier in self.tiers if tier <= step]
+
+		else:
+			return None
+
+		if not tiers:
+			return None
+
+		return max(tiers)
+
+	def get_tier_points(self, dca, tier, tstart, tstop, atype='MEAN', max_points=None, interval=None, roundtime=True, timezone=time.timezone):
+		rollups = []
+
+		for chunk in self.store.find_chunks(dca['_id'], tstart, tstop, tier=tier, data=True):
+			data = self.store.get_chunk(chunk)
+
+			if data is not None:
+				rollups.append(codec.decode_rollup(data, tstart - tier + 1, tstop))
+
+		## Points not rotated yet
+		rlts = dca.get('rlts', None)
+		points = [point for point in dca.get('d', []) if rlts is None or point[0] > rlts]
+		rollups.append(utils.rollup(points, tier))
+
+		rows = [row for row in utils.merge_rollups(*rollups) if row[0] <= tstop and row[0] + tier > tstart]
+
+		return utils.get_rollup_points(rows, atype, tstart, tstop, max_points, interval, roundtime, timezone)
+
 	def get_last_point(self, *args, **kargs):
 		return self.get_point(*args, ts=None, **kargs)
 
@@ -364,7 +430,11 @@ class manager(object):
 		point = None
 
 		if not ts:
-			dca = self.get_meta(_id=_id)
+			# Only the last plain point is read
+			dca = self.get_meta(_id=_id, mfields={'d': 0})
+			if dca:
+				dca['d'] = self.get_data(_id, 1)
+
 			dca = self.subset_selection_apply(dca, subset_selection)
 			points = dca.get('d', [])
 		else:
@@ -398,10 +468,7 @@ class manager(object):
 			pass
 
 		self.logger.info(" + Check length (%s keys)" % len(keys))
-		for key in keys:
-			self.store.redis_pipe.llen(key)
-
-		result = self.store.redis_pipe.execute()
+		result = self.store.count_plain(keys)
 
 		for index, key in enumerate(keys):
 			if result[index] >= self.dca_min_length:
@@ -453,19 +520,29 @@ class manager(object):
 
 		try:
 			bin_id = "%s%s" % (_id, lts)
-			self.logger.debug("   + Store in binary record")
+			chunks = [{'_id': bin_id, 'meta_id': _id, 'fts': fts, 'lts': lts, 'count': len(points), 'tier': 0, 'data': data}]
+			replaced = []
 
-			try:
-				self.store.create_bin(_id=bin_id, data=data)
-			except gridfs.errors.FileExists as fe:
-				self.logger.debug('Impossible to create gridfs bin {} because it exists'.format(fe))
+			# Pushes don't update last value of known series
+			mset = {'lts': lts, 'lv': points[-1][1]}
+
+			if self.tiers:
+				self.logger.debug("   + Build rollup tiers")
+				perfdata = self.store.get(_id=_id)
+				rchunks, replaced, rmset = self.rollup(_id, points, perfdata)
+				chunks += rchunks
+
+				if rmset:
+					mset.update(rmset)
 
-			self.logger.debug("   + Add bin_id in meta and clean meta")
+			self.logger.debug("   + Store %s chunks and clean meta" % len(chunks))
+			self.store.put_chunks(chunks)
 
-			perfdata = self.store.get(_id=_id)
-			to_push = [fts, lts, bin_id]
-			if 'c' in perfdata and to_push not in perfdata['c']:
-				self.store.update(_id=_id, mpush={'c': (fts, lts, bin_id)})
+			# Replaced by the new rollup chunks
+			if replaced:
+				self.store.remove_chunks(replaced)
+
+			self.store.update(_id=_id, mset=mset, upsert=False)
 
 			self.store.redis.delete(_id)
 
@@ -476,6 +553,68 @@ class manager(object):
 		t = time.time() - t
 		self.logger.debug(" + Rotation of '%s' done in %.3f seconds" % (_id, t))
 
+	def rollup(self, _id, points, meta):
+		"""
+			Return chunks of the rollup tiers of points, ids of the chunks
+			they replace and fields to set in meta once they are stored.
+			Rows are merged in the last chunk of each tier until it is full.
+		"""
+
+		chunks = []
+		replaced = []
+
+		# Points already rolled up by an interrupted rotation
+		rlts = meta.get('rlts', None)
+		if rlts is not None:
+			points = [point for point in points if point[0] > rlts]
+
+		if not points:
+			return chunks, replaced, None
+
+		lts = points[-1][0]
+
+		mset = {'rlts': lts}
+
+		# Chunks rotated before have no rollup
+		if 'rts' not in meta:
+			mset['rts'] = points[0][0]
+
+		for tier in self.tiers:
+			last = None
+			for chunk in self.store.find_chunks(_id, tier=tier, limit=1, sort=[('lts', -1)], data=True):
+				last = chunk
+
+			# Tier already built by an interrupted rotation
+			tier_points = points
+			if last:
+				tier_points = [point for point in points if point[0] > last['rlts']]
+
+			rows = utils.rollup(tier_points, tier)
+
+			if not rows:
+				continue
+
+			if last and last['count'] < TIER_CHUNK_SIZE:
+				data = self.store.get_chunk(last)
+
+				if data is not None:
+					rows = utils.merge_rollups(codec.decode_rollup(data), rows)
+
+				replaced.append(last['_id'])
+
+			chunks.append({
+				'_id': "%s.%s.%s" % (_id, tier, lts),
+				'meta_id': _id,
+				'fts': rows[0][0],
+				'lts': rows[-1][0] + tier - 1,
+				'count': len(rows),
+				'tier': tier,
+				'rlts': lts,
+				'data': codec.encode_rollup(rows)
+			})
+
+		return chunks, replaced, mset
+
 	def cleanAll(self, timestamp=None):
 		return self.clean(timestamp=timestamp)
 
@@ -513,40 +652,31 @@ class manager(object):
 			meta_id = meta['_id']
 			self.logger.debug("   + Clean meta '%s'" % meta_id)
 
-			## Clean binaries
+			## Clean binaries and rollups
+			removed = []
+			for chunk in self.store.find_chunks(meta_id, tier=None, sort=[('lts', 1)]):
+				if chunk['lts'] <= timestamp:
+					self.logger.debug("     + Remove binarie DCA '%s'" % chunk['_id'])
+					removed.append(chunk['_id'])
+
+			if removed:
+				self.store.remove_chunks(removed)
+
 			bin_fts = None
-			for dca_meta in meta['c']:
-				fts = dca_meta[0]
-				lts = dca_meta[1]
-				bin_id = dca_meta[2]
-
-				# check lts
-				if  lts  <= timestamp:
-					self.logger.debug("     + Remove binarie DCA '%s'" %  bin_id)
-					self.store.grid.delete(bin_id)
-
-					# Remove dca meta
-					self.store.update(_id=meta_id, mpop={ 'c' : -1  })
-				else:
-					if not bin_fts:
-						bin_fts = fts
+			for chunk in self.store.find_chunks(meta_id, limit=1):
+				bin_fts = chunk['fts']
 
 			## Clean plain
 			plain_fts = None
 			points = self.get_data(meta_id)
 			if len(points):
 				if points[0][0] <= timestamp:
-					for point in points:
-						fts = point[0]
-						if fts <= timestamp:
-							self.logger.debug("     + Remove plain point")
-						else:
-							points.append(point)
-							if not plain_fts:
-								plain_fts = fts
+					self.logger.debug("     + Remove plain points")
+					points = [point for point in points if point[0] > timestamp]
+					self.store.set_plain(meta_id, points)
+
 					if points:
-						points = ["%s|%s" % (p[0], p[1]) for p in points]
-						self.store.redis.lset(meta_id, points)
+						plain_fts = points[0][0]
 
 			## Set new fts
 			fts = plain_fts
@@ -578,14 +708,14 @@ class manager(object):
 		bin_dcas = []
 
 		for _id in ids:
-			self.store.redis_pipe.delete(_id)
-			dca = self.get_meta(_id=_id, raw=True, mfields={'c': 1})
+			self.store.delete_plain(_id)
+			dca = self.get_meta(_id=_id, raw=True, mfields={'_id': 1})
 			if dca:
 				dcas.append(dca)
-				binaries = dca.get('c', [])
-				if len(binaries):
-					for bin_dca in binaries:
-						bin_dcas.append(bin_dca[2])
+
+		if dcas:
+			for chunk in self.store.find_chunks([dca['_id'] for dca in dcas], tier=None, sort=None):
+				bin_dcas.append(chunk['_id'])
 
 		self.store.sync()
 
@@ -595,8 +725,7 @@ class manager(object):
 
 		if len(bin_dcas):
 			self.logger.debug("Remove Compressed Binaries ...")
-			self.store.db[self.store.mongo_collection+"_bin.chunks"].remove({'files_id': {'$in': bin_dcas}})
-			self.store.db[self.store.mongo_collection+"_bin.files"].remove({'_id': {'$in': bin_dcas}})
+			self.store.remove_chunks(bin_dcas)
 
 		if len(dcas):
 			self.logger.debug("Remove Meta and Plains DCA ...")
@@ -605,6 +734,9 @@ class manager(object):
 			else:
 				self.store.remove(mfilter={'_id': {'$in': [ dca['_id'] for dca in dcas]}})
 
+		# Once removed, their meta is upserted on next push
+		self.store.forget(ids)
+
 	def showStats(self):
 		metas = self.find(limit=0)
 		mcount = metas.count()
@@ -630,10 +762,11 @@ class manager(object):
 		if meta and _id:
 			self.logger.info("Metadata:'%s'" % meta['_id'])
 			for key in meta:
-				if key != '_id' and key != 'c' and key != 'd' and key != 'nc':
+				if key != '_id' and key != 'd' and key != 'nc':
 					self.logger.info(" + %s: %s" % (key, meta[key]))
 
-			self.logger.info(" + Compressed DCA: %s" % len(meta.get('c', [])))
+			self.logger.info(" + Compressed DCA: %s" % self.store.find_chunks(_id).count())
+			self.logger.info(" + Rollup chunks: %s" % self.store.find_chunks(_id, tier={'$gt': 0}).count())
 			self.logger.info(" + Next Clean: %s" % meta.get('nc', None) )
 
 	def disconnect(self):
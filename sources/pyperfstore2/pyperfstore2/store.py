@@ -21,12 +21,29 @@
 import os, sys, json, logging, time
 
 from bson.errors import InvalidStringData
-from pymongo import Connection
+from bson.binary import Binary
 from gridfs import GridFS, errors
 import redis
 
+import pyperfstore2.codec as codec
+import pyperfstore2.known as known
+from pyperfstore2.client import get_client
+
 import threading
 
+# Redis keys of series (md5 of their name)
+ID_PATTERN = '[0-9a-f]' * 32
+
+# Binaries of chunks, in GridFS or in their chunk document
+BACKEND_GRIDFS = 'gridfs'
+BACKEND_DOCUMENT = 'document'
+
+# Bigger binaries stay in GridFS (documents are limited to 16 MB)
+MAX_DOCUMENT_BIN = 8 * 1024 * 1024
+
+# Redis channel of removed series, forgotten by all stores
+KNOWN_CHANNEL = 'perfstore2:forget'
+
 class store(object):
 	def __init__(self,
 			mongo_host="127.0.0.1",
@@ -40,6 +57,9 @@ class store(object):
 			redis_port=6379,
 			redis_db=0,
 			redis_sync_interval=10,
+			bin_backend=BACKEND_DOCUMENT,
+			known_capacity=None,
+			mongo_client=None,
 			logging_level=logging.INFO):
 
 		self.logger = logging.getLogger('store')
@@ -81,6 +101,14 @@ class store(object):
 		self.mongo_user = mongo_user if mongo_user != "" else None
 		self.mongo_pass = mongo_pass if mongo_pass != "" else None
 
+		# Client shared with the caller, else pooled by pyperfstore2
+		self.mongo_client = mongo_client
+
+		if bin_backend not in (BACKEND_GRIDFS, BACKEND_DOCUMENT):
+			raise ValueError("Unknown binaries backend (%s)" % bin_backend)
+
+		self.bin_backend = bin_backend
+
 		self.redis_sync_interval = redis_sync_interval
 		self.redis_db = redis_db
 		self.redis_port = redis_port
@@ -89,6 +117,15 @@ class store(object):
 		if not redis_host :
 			self.redis_host = mongo_host
 
+		# Series with an up to date meta, a bloom filter for large fleets
+		if known_capacity:
+			self.known = known.bloomset(known_capacity)
+		else:
+			self.known = known.knownset()
+
+		self.known_sub = None
+		self.last_forget_check = 0
+
 		self.connected = False
 
 		self.connect()
@@ -109,7 +146,11 @@ class store(object):
 		else:
 			self.logger.debug("Connect to MongoDB (%s/%s@%s:%s)" % (self.mongo_db, self.mongo_collection, self.mongo_host, self.mongo_port))
 			try:
-				self.conn=Connection(host=self.mongo_host, port=self.mongo_port, safe=self.mongo_safe)
+				if self.mongo_client:
+					self.conn = self.mongo_client
+				else:
+					# Pooled client of the process, authenticated by its URI
+					self.conn = get_client(self.mongo_host, self.mongo_port, self.mongo_db, self.mongo_user, self.mongo_pass, safe=self.mongo_safe)
 				self.logger.debug(" + Success")
 			except Exception, err:
 				self.logger.error(" + %s" % err)
@@ -120,21 +161,20 @@ class store(object):
 			self.redis = redis.StrictRedis(host=self.redis_host, port=self.redis_port, db=self.redis_db)
 			self.redis_pipe = self.redis.pipeline()
 
-			try:
-				if self.mongo_user and self.mongo_pass != None:
-						self.logger.debug("Try to auth '%s'" % self.mongo_user)
-						if not self.db.authenticate(self.mongo_user, self.mongo_pass):
-							raise Exception('Invalid user or pass.')
-						self.logger.debug(" + Success")
-			except Exception, err:
-				self.logger.error(" + Impossible to authenticate: %s" % err)
-				self.disconnect()
-				return False
+			# Pushed points in redis_pipe, by command index, with their
+			# records to replay on error, and index of the last delete
+			# of each key
+			self.push_records = {}
+			self.delete_indexes = {}
 
 			self.logger.debug("Get collections")
 			self.collection = self.db[self.mongo_collection]
 
 			self.grid = GridFS(self.db, self.mongo_collection+"_bin")
+
+			# Time index of binaries
+			self.chunks = self.db[self.mongo_collection+"_chunks"]
+
 			self.connected = True
 			self.logger.debug(" + Success")
 			return True
@@ -167,7 +207,30 @@ class store(object):
 	def sync(self):
 		if self.connected:
 			self.logger.debug("Sync pipeline to Redis")
-			self.redis_pipe.execute()
+			results = self.redis_pipe.execute(raise_on_error=False)
+
+			error = None
+			for index, result in enumerate(results):
+				if not isinstance(result, redis.ResponseError):
+					continue
+
+				if index in self.push_records:
+					_id, record = self.push_records[index]
+
+					# Points of a key deleted later in the pipeline are dropped,
+					# others are replayed in order (all appends of a key in
+					# the list format fail)
+					if self.delete_indexes.get(_id, -1) < index:
+						self.append(_id, record)
+
+				elif not error:
+					error = result
+
+			self.push_records = {}
+			self.delete_indexes = {}
+
+			if error:
+				raise error
 			self.last_sync = time.time()
 			self.pipe_size = 0
 
@@ -175,14 +238,21 @@ class store(object):
 		self.check_connection()
 		self.logger.debug("Push point '%s' in '%s'" % (point, _id))
 
-		meta_data['lts'] = point[0]
-		meta_data['lv'] = point[1]
+		now = time.time()
 
-		# Update meta data on mongo
-		if not self.redis.exists(_id):
-			self.update(_id=_id, mset=meta_data)
+		if (self.last_forget_check + 1) < now:
+			self.check_forgotten()
+			self.last_forget_check = now
 
-		now = time.time()
+		# Update meta data on mongo for new series and changed meta
+		signature = known.get_signature(meta_data)
+
+		if (_id, signature) not in self.known:
+			meta_data['lts'] = point[0]
+			meta_data['lv'] = point[1]
+
+			self.update(_id=_id, mset=meta_data)
+			self.known.add(_id, signature)
 
 		# Calcul push rate
 		if self.pushed_values and (self.last_rate_time + self.rate_interval) < now:
@@ -199,10 +269,13 @@ class store(object):
 			self.logger.debug("Bulk mode is enabled (rate: %s push/sec)" % self.last_rate)
 
 		# Push perfdata to db
+		record = codec.POINT.pack(int(point[0]), float(point[1]))
+
 		if not bulk and self.pipe_size == 0:
-			self.redis.rpush(_id, '%s|%s' % (point[0], point[1]))
+			self.append(_id, record)
 		else:
-			self.redis_pipe.rpush(_id, '%s|%s' % (point[0], point[1]))
+			self.push_records[len(self.redis_pipe)] = (_id, record)
+			self.redis_pipe.append(_id, record)
 			self.pipe_size += 1
 
 		# Sync DB if need
@@ -211,11 +284,296 @@ class store(object):
 
 		self.pushed_values += 1
 
+	def subscribe_known(self):
+		if not self.known_sub:
+			self.known_sub = self.redis.pubsub()
+			self.known_sub.subscribe(KNOWN_CHANNEL)
+
+	def warm_known(self):
+		"""
+			Fill known series from their meta, return their number.
+		"""
+		self.check_connection()
+		self.subscribe_known()
+
+		for meta in self.collection.find({}, fields={'d': 0}):
+			self.known.add(meta['_id'], known.get_signature(meta))
+
+		return len(self.known)
+
+	def forget(self, _ids):
+		"""
+			Forget series in all stores, their meta will be upserted on
+			next push.
+		"""
+		self.check_connection()
+
+		for _id in _ids:
+			self.known.discard(_id)
+
+		if _ids:
+			self.redis.publish(KNOWN_CHANNEL, json.dumps(_ids))
+
+	def check_forgotten(self):
+		self.subscribe_known()
+
+		message = self.known_sub.get_message()
+		while message:
+			if message['type'] == 'message':
+				for _id in json.loads(message['data']):
+					self.known.discard(_id)
+
+			message = self.known_sub.get_message()
+
+	def append(self, _id, data):
+		try:
+			self.redis.append(_id, data)
+		except redis.ResponseError:
+			# Key still in the list format
+			self.migrate(_id)
+			self.redis.append(_id, data)
+
+	def delete_plain(self, _id):
+		"""
+			Delete plain points of a DCA on next sync, after points
+			already pushed.
+		"""
+
+		self.check_connection()
+
+		self.delete_indexes[_id] = len(self.redis_pipe)
+		self.redis_pipe.delete(_id)
+
+	def get_plain(self, _id, count=None):
+		"""
+			Return plain points of a DCA, only the last count points if set.
+		"""
+
+		self.check_connection()
+
+		try:
+			if count:
+				data = self.redis.getrange(_id, -count * codec.POINT.size, -1)
+			else:
+				data = self.redis.get(_id)
+
+		except redis.ResponseError:
+			# Key still in the list format
+			return codec.parse_points(self.redis.lrange(_id, -count if count else 0, -1))
+
+		return codec.unpack_points(data)
+
+	def set_plain(self, _id, points):
+		self.check_connection()
+
+		if points:
+			self.redis.set(_id, codec.pack_points(points))
+		else:
+			self.redis.delete(_id)
+
+	def count_plain(self, keys):
+		"""
+			Return the number of plain points of each key.
+		"""
+
+		self.check_connection()
+
+		pipe = self.redis.pipeline(transaction=False)
+		for key in keys:
+			pipe.strlen(key)
+
+		counts = []
+		for key, result in zip(keys, pipe.execute(raise_on_error=False)):
+			if isinstance(result, redis.ResponseError):
+				# Key still in the list format
+				counts.append(self.redis.llen(key))
+			else:
+				counts.append(result / codec.POINT.size)
+
+		return counts
+
+	def migrate(self, _id=None):
+		"""
+			Convert plain points of keys in the list format ('timestamp|value'
+			items) to packed records, all keys if _id is None. Return the
+			number of converted keys.
+		"""
+
+		self.check_connection()
+
+		if _id:
+			keys = [_id]
+		else:
+			# Only series, the Redis DB may be shared
+			keys = self.redis.scan_iter(match=ID_PATTERN, count=1000)
+
+		converted = set()
+
+		def convert(pipe):
+			if pipe.type(key) != 'list':
+				return
+
+			points = codec.parse_points(pipe.lrange(key, 0, -1))
+
+			pipe.multi()
+			pipe.delete(key)
+			if points:
+				pipe.append(key, codec.pack_points(points))
+
+			converted.add(key)
+
+		for key in keys:
+			# Retried while pushes modify the list
+			self.redis.transaction(convert, key)
+
+		return len(converted)
+
 	def create_bin(self, _id, data):
 		self.check_connection()
 		self.logger.debug("Create bin record '%s'" % _id)
 		return self.grid.put(data, _id=_id)
 
+	def add_chunk(self, bin_id, meta_id, fts, lts, count, tier=0, **kwargs):
+		self.check_connection()
+		self.logger.debug("Add chunk '%s' of '%s' (%s -> %s)" % (bin_id, meta_id, fts, lts))
+
+		chunk = {'_id': bin_id, 'meta_id': meta_id, 'fts': fts, 'lts': lts, 'count': count, 'tier': tier}
+		chunk.update(kwargs)
+
+		# Cached by pymongo, recreated after a drop
+		self.chunks.ensure_index([('meta_id', 1), ('tier', 1), ('lts', 1)])
+
+		return self.chunks.save(chunk)
+
+	def put_chunks(self, chunks):
+		"""
+			Write chunks (descriptor fields and binary 'data') in one bulk,
+			binaries go in GridFS or in the chunk documents by backend.
+		"""
+
+		self.check_connection()
+
+		if not chunks:
+			return
+
+		self.chunks.ensure_index([('meta_id', 1), ('tier', 1), ('lts', 1)])
+
+		bulk = self.chunks.initialize_unordered_bulk_op()
+
+		for chunk in chunks:
+			chunk = chunk.copy()
+			data = chunk.pop('data')
+
+			self.logger.debug("Put chunk '%s' of '%s' (%s -> %s)" % (chunk['_id'], chunk['meta_id'], chunk['fts'], chunk['lts']))
+
+			if self.bin_backend == BACKEND_DOCUMENT and len(data) <= MAX_DOCUMENT_BIN:
+				chunk['data'] = Binary(data)
+			else:
+				try:
+					self.create_bin(_id=chunk['_id'], data=data)
+				except errors.FileExists:
+					# Left by an interrupted rotation
+					self.grid.delete(chunk['_id'])
+					self.create_bin(_id=chunk['_id'], data=data)
+
+				# Not to be moved by migrate_bins
+				if self.bin_backend == BACKEND_DOCUMENT:
+					chunk['data'] = None
+
+			bulk.find({'_id': chunk['_id']}).upsert().replace_one(chunk)
+
+		return bulk.execute()
+
+	def get_chunk(self, chunk):
+		"""
+			Return the binary of a chunk found with data.
+		"""
+
+		data = chunk.get('data')
+
+		if data is None:
+			return self.get_bin(chunk['_id'])
+
+		return data
+
+	def find_chunks(self, meta_id, tstart=None, tstop=None, tier=0, limit=0, sort=[('fts', 1)], data=False):
+		"""
+			Return chunks of a meta overlapping [tstart, tstop], tier 0 holds
+			raw points and None matches all tiers. With data, binaries stored
+			in documents are read by the same query.
+		"""
+
+		self.check_connection()
+
+		if isinstance(meta_id, list):
+			mfilter = {'meta_id': {'$in': meta_id}}
+		else:
+			mfilter = {'meta_id': meta_id}
+
+		if tier is not None:
+			mfilter['tier'] = tier
+		if tstart is not None:
+			mfilter['lts'] = {'$gte': tstart}
+		if tstop is not None:
+			mfilter['fts'] = {'$lte': tstop}
+
+		mfields = None
+		if not data:
+			mfields = {'data': 0}
+
+		return self.chunks.find(mfilter, fields=mfields, limit=limit, sort=sort)
+
+	def remove_chunks(self, _ids):
+		self.check_connection()
+
+		self.chunks.remove({'_id': {'$in': _ids}})
+		self.remove_bins(_ids)
+
+	def remove_bins(self, _ids):
+		self.check_connection()
+
+		self.db[self.mongo_collection+"_bin.chunks"].remove({'files_id': {'$in': _ids}})
+		self.db[self.mongo_collection+"_bin.files"].remove({'_id': {'$in': _ids}})
+
+	def migrate_bins(self, limit=0):
+		"""
+			Move binaries of chunks from GridFS to their document, at most
+			limit chunks. Return the number of checked chunks, 0 when the
+			migration is done.
+		"""
+
+		self.check_connection()
+
+		if self.bin_backend != BACKEND_DOCUMENT:
+			return 0
+
+		chunks = self.chunks.find({'data': {'$exists': False}}, fields=['_id'], limit=limit)
+
+		bulk = self.chunks.initialize_unordered_bulk_op()
+		moved = []
+		done = 0
+
+		for chunk in chunks:
+			_id = chunk['_id']
+			data = self.get_bin(_id)
+
+			if data is None or len(data) > MAX_DOCUMENT_BIN:
+				# Kept in GridFS
+				bulk.find({'_id': _id}).update_one({'$set': {'data': None}})
+			else:
+				bulk.find({'_id': _id}).update_one({'$set': {'data': Binary(data)}})
+				moved.append(_id)
+
+			done += 1
+
+		if done:
+			bulk.execute()
+
+		if moved:
+			self.remove_bins(moved)
+
+		return done
+
 	def remove(self, _id=None, mfilter=None):
 		self.check_connection()
 		if mfilter:
@@ -239,7 +597,10 @@ class store(object):
 			chunks_size = self.db.command("collstats", self.mongo_collection+"_bin.chunks")['size']
 			self.logger.info(" + Binaries:      %0.2f MB" % (chunks_size /1024.0/1024.0))
 
-			size += chunks_size + bin_size
+			index_size = self.db.command("collstats", self.mongo_collection+"_chunks")['size']
+			self.logger.info(" + Chunks:        %0.2f MB" % (index_size /1024.0/1024.0))
+
+			size += chunks_size + bin_size + index_size
 		except:
 			self.logger.warning("Impossible to read GridFS Size")
 			pass
@@ -273,15 +634,17 @@ class store(object):
 		self.db.drop_collection(self.mongo_collection)
 		self.db.drop_collection(self.mongo_collection+"_bin.chunks")
 		self.db.drop_collection(self.mongo_collection+"_bin.files")
+		self.db.drop_collection(self.mongo_collection+"_chunks")
 		self.redis.flushdb()
+		self.known.clear()
 
 	def disconnect(self):
 		# Sync redis
 		self.sync()
 
 		if self.connected:
+			# The client is shared, don't fsync or close it
 			self.logger.debug("Disconnect from MongoDB")
-			self.conn.fsync()
 			del self.conn
 			self.connected = False
 		else:
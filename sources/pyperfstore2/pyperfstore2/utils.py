@@ -24,9 +24,12 @@ logger.setLevel(logging.INFO)
 import zlib
 import time
 
-import msgpack
-packer = None
-unpacker = None
+import codec
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
 
 import calendar
 from datetime import datetime, timedelta
@@ -189,6 +192,15 @@ def parse_dst(points, dtype, first_point=[]):
 	dtype = dtype.upper()
 
 	if dtype == "DERIVE" or dtype == "COUNTER" or dtype == "ABSOLUTE":
+		# Series with None values keep the point by point conversion
+		arrays = None
+		if points and numpy is not None:
+			arrays = get_arrays(points, ordered=False)
+
+		if arrays:
+			timestamps, values = parse_dst_arrays(arrays[0], arrays[1], dtype, first_point)
+			return map(list, zip(timestamps.tolist(), values.tolist()))
+
 		if points:
 			rpoints = []
 			values = get_values(points)
@@ -255,6 +267,47 @@ def parse_dst(points, dtype, first_point=[]):
 
 	return points
 
+def parse_dst_arrays(timestamps, values, dtype, first_point=[]):
+	"""
+		Same as parse_dst on timestamps and values arrays (without None).
+	"""
+
+	dtype = dtype.upper()
+
+	if dtype == "COUNTER":
+		return timestamps, numpy.cumsum(values)
+
+	# A previous value or timestamp of 0 is ignored, as a missing one
+	previous_value = 0
+	previous_timestamp = 0
+	if first_point:
+		previous_value = first_point[1] or 0
+		previous_timestamp = first_point[0] or 0
+
+	previous_values = numpy.concatenate((numpy.array([previous_value]), values[:-1]))
+	previous_timestamps = numpy.concatenate((numpy.array([previous_timestamp]), timestamps[:-1]))
+
+	deltas = numpy.where(values > previous_values, values - previous_values, 0)
+	values = numpy.where(previous_values != 0, deltas, values)
+
+	if dtype == "DERIVE":
+		intervals = numpy.abs(timestamps - previous_timestamps)
+		derived = (previous_timestamps != 0) & (intervals != 0)
+
+		# round() of python, numpy.round doesn't round the same way
+		rates = values[derived].astype(numpy.float64) / intervals[derived]
+		values = values.astype(numpy.float64)
+		values[derived] = [round(rate, 3) for rate in rates.tolist()]
+
+		## if new dca start, value = 0 and no first_point: wait second point ...
+		if not first_point:
+			return timestamps[1:], values[1:]
+
+	elif dtype == "ABSOLUTE":
+		values = numpy.abs(values)
+
+	return timestamps, values
+
 def _roundtime(utcdate, periodtime=1, periodtype=T_HOUR, timezone=time.timezone):
 	"""
 	Calculate roudtime relative to an UTC date, a period time/type and a timezone.
@@ -387,7 +440,19 @@ def getTimeSteps(start, stop, interval, roundtime=True, timezone=time.timezone):
 
 	relativeinterval = intervalToRelativeDelta.get(interval, None)
 
-	if relativeinterval:
+	if relativeinterval and interval < M:
+		# From minutes to weeks, steps have a fixed length
+		delta = stop_datetime - start_datetime + timedelta(seconds=interval)
+		delta = (delta.days * D + delta.seconds) * 1000000 + delta.microseconds
+
+		count = 0
+		if delta > 0:
+			count = (delta - 1) / (interval * 1000000) + 1
+
+		ts = calendar.timegm(stop_datetime.timetuple())
+		timeSteps = range(ts - (count - 1) * interval, ts + 1, interval)
+
+	elif relativeinterval:
 		date = stop_datetime
 		start_datetime_minus_relativeinterval = start_datetime - relativeinterval
 
@@ -395,11 +460,12 @@ def getTimeSteps(start, stop, interval, roundtime=True, timezone=time.timezone):
 			ts = calendar.timegm(date.timetuple())
 			timeSteps.append(ts)
 			date -= relativeinterval
+
+		timeSteps.reverse()
 	else:
 		logger.debug('   + Use interval')
 		timeSteps = range(stop, start-interval, -interval)
-
-	timeSteps.reverse()
+		timeSteps.reverse()
 
 	logger.debug('   + timeSteps: %s', timeSteps)
 
@@ -429,6 +495,13 @@ def aggregate(points, start=None, stop=None, max_points=None, interval=None, aty
 
 	logger.debug("Aggregate %s points (max: %s, interval: %s, method: %s, mode: %s)" % (len(points), max_points, interval, atype, mode))
 
+	# By point, slices of points are already cheaper than building arrays
+	if not agfn and interval and numpy is not None and len(points) > 1:
+		arrays = get_arrays(points)
+
+		if arrays:
+			return aggregate_arrays(arrays[0], arrays[1], start=start, stop=stop, interval=interval, atype=atype, fill=fill, roundtime=roundtime, timezone=timezone)
+
 	if not agfn:
 		if atype == 'MEAN':
 			agfn = vmean
@@ -547,98 +620,210 @@ def get_aggregation_point(points_to_aggregate, fn, timestamp, fill):
 
 	return result
 
-def compress(points):
-	logger.debug("Compress timeserie")
+### Vectorized aggregation
+def get_arrays(points, ordered=True):
+	"""
+		Return timestamps and values of points as NumPy arrays,
+		None if values are not only numbers or points are not sorted.
+	"""
+
+	timestamps = numpy.array([point[0] for point in points])
+	values = numpy.array([point[1] for point in points])
+
+	if timestamps.dtype.kind not in 'if' or values.dtype.kind not in 'if':
+		return None
 
-	# Create packer
-	global packer
-	if not packer:
-		packer = msgpack.Packer()
+	if ordered and (timestamps[1:] < timestamps[:-1]).any():
+		return None
 
-	# Remplace timestamp by interval
-	logger.debug(" + Remplace Timestamp by Interval and compress it")
+	return timestamps, values
 
-	fts = points[0][0]
-	last_timestamp = fts
-	last_interval = 0
-	value = points[0][1]
+def aggregate_arrays(timestamps, values, start=None, stop=None, max_points=1450, interval=None, atype='MEAN', fill=False, roundtime=True, timezone=time.timezone):
+	"""
+		Same as aggregate (without agfn) on sorted timestamps and values
+		arrays, aggregates by interval if interval is set else by point.
+		Values are equal to the ones of aggregate, computed in the same order.
+	"""
 
-	if isinstance(value, float) and float.is_integer(value):
-		value = int(value)
+	atype = atype.upper()
+	count = len(timestamps)
 
-	data = [value]
+	if not interval:
+		if count < max_points:
+			return map(list, zip(timestamps.tolist(), values.tolist()))
 
-	logger.debug(" + FTS: %s" % fts)
+		interval = int(round(count / float(max_points)))
+		logger.debug(" + point interval: %s" % interval)
 
-	xr = xrange(1, len(points))
+		starts = numpy.arange(0, count, interval)
+		ends = numpy.minimum(starts + interval, count)
 
-	for i in xr:
-		point = points[i]
-		value = point[1]
+		rtimestamps = timestamps[ends - 1].tolist()
+		rvalues = reduce_buckets(values, starts, ends, atype)
 
-		if value == int(value):
-			value = int(value)
+		return map(list, zip(rtimestamps, rvalues))
 
-		interval = point[0] - last_timestamp
-		last_timestamp = point[0]
+	if not start:
+		start = timestamps[0].item()
 
-		if interval != last_interval:
-			data.append([interval, value])
-			last_interval = interval
-		else:
-			data.append(value)
+	if not stop:
+		stop = timestamps[-1].item()
 
-	data = (fts, data)
-	# Pack and compress points
-	points = zlib.compress(packer.pack(data), 9)
+	timeSteps = getTimeSteps(start, stop, int(interval), roundtime, timezone)
 
-	return points
+	# Points before timeSteps[1] go in the first bucket, points after
+	# timeSteps[-1] in the last one, only if there are some.
+	edges = numpy.searchsorted(timestamps, timeSteps[1:])
+	starts = numpy.concatenate(([0], edges)).astype(int)
+	ends = numpy.concatenate((edges, [count])).astype(int)
+
+	if starts[-1] >= count:
+		starts = starts[:-1]
+		ends = ends[:-1]
+
+	# DELTA also uses the last point of previous buckets
+	if atype == 'DELTA':
+		starts = numpy.maximum(starts - 1, 0)
 
-def uncompress(data):
+	rpoints = [[timestamp, 0 if fill else None] for timestamp in timeSteps[:len(starts)]]
+
+	filled = numpy.flatnonzero(ends > starts)
+	rvalues = reduce_buckets(values, starts[filled], ends[filled], atype)
+
+	for index, value in zip(filled.tolist(), rvalues):
+		rpoints[index][1] = round(value, 2)
+
+	logger.debug(" + Nb points: %s" % len(rpoints))
+
+	return rpoints
+
+def reduce_buckets(values, starts, ends, atype):
+	"""
+		Reduce values[start:end] of each bucket, buckets must not be empty.
+	"""
+
+	if atype == 'FIRST':
+		return values[starts].tolist()
+
+	if atype == 'LAST':
+		return values[ends - 1].tolist()
+
+	if atype == 'DELTA':
+		deltas = values[ends - 1] - values[starts]
+		single = ends - starts == 1
+		deltas[single] = values[starts[single]]
+		return deltas.tolist()
+
+	# Other aggregations use all values of buckets, which are consecutive
+	if atype == 'MIN':
+		return numpy.minimum.reduceat(values, starts).tolist()
+
+	if atype == 'MAX':
+		return numpy.maximum.reduceat(values, starts).tolist()
+
+	if values.dtype.kind == 'i':
+		sums = numpy.add.reduceat(values, starts).tolist()
+	else:
+		# Sum floats one after the other, as sum() does
+		vlist = values.tolist()
+		sums = [sum(vlist[start:end]) for start, end in zip(starts.tolist(), ends.tolist())]
+
+	if atype == 'SUM':
+		return sums
+
+	return [round(float(value / float(count)), 3) for value, count in zip(sums, (ends - starts).tolist())]
+
+def compress(points):
+	logger.debug("Compress timeserie")
+
+	return codec.encode(points)
+
+def uncompress(data, tstart=None, tstop=None):
 	logger.debug("Uncompress timeserie")
 
-	if not data:
-		raise ValueError("Invalid data type (%s)" % type(data))
+	return codec.decode_points(data, tstart, tstop)
 
-	# Create unpacker
-	global unpacker
-	if not unpacker:
-		unpacker = msgpack.Unpacker(use_list=True)
+### Rollup tiers
+ROLLUP_ATYPES = ('MEAN', 'MIN', 'MAX', 'SUM')
 
-	unpacker.feed(str(zlib.decompress(data)))
-	data = unpacker.unpack()
+def rollup(points, interval):
+	"""
+		Group points by interval in rows of [timestamp, min, max, sum, count],
+		timestamp is the start of the interval.
+	"""
 
-	fts = data[0]
-	points = data[1]
+	rows = {}
 
-	logger.debug(" + Type of point: %s" % type(points))
+	for point in points:
+		value = point[1]
 
-	if not isinstance(points, list):
-		raise ValueError("Invalid type (%s)" % type(points))
+		if value is None:
+			continue
 
-	rpoints = []
+		timestamp = point[0] - point[0] % interval
+		row = rows.get(timestamp, None)
 
-	#first point
-	rpoints.append([fts, points[0]])
-	logger.debug("   + First point: %s" % (rpoints[0]))
-	timestamp = fts
+		if row:
+			row[1] = min(row[1], value)
+			row[2] = max(row[2], value)
+			row[3] += value
+			row[4] += 1
+		else:
+			rows[timestamp] = [timestamp, value, value, value, 1]
 
-	xr = xrange(1, len(points))
+	return [rows[timestamp] for timestamp in sorted(rows)]
 
-	interval = 0
+def merge_rollups(*rollups):
+	"""
+		Merge rows of rollups, rows of a same interval are combined.
+	"""
 
-	for i in xr:
-		value = points[i]
+	rows = {}
 
-		if isinstance(value, list):
-			interval = value[0]
-			value = value[1]
+	for rollup_rows in rollups:
+		for row in rollup_rows:
+			merged = rows.get(row[0], None)
 
-		timestamp += interval
-		rpoint = [timestamp, value]
-		rpoints.append(rpoint)
+			if merged:
+				merged[1] = min(merged[1], row[1])
+				merged[2] = max(merged[2], row[2])
+				merged[3] += row[3]
+				merged[4] += row[4]
+			else:
+				rows[row[0]] = list(row)
 
-	return rpoints
+	return [rows[timestamp] for timestamp in sorted(rows)]
+
+def get_rollup_points(rows, atype='MEAN', start=None, stop=None, max_points=None, interval=None, roundtime=True, timezone=time.timezone):
+	"""
+		Return points of rollup rows for atype. Means of rows can't be
+		aggregated again, so MEAN rows are aggregated here by interval or
+		by max_points, weighted by their count.
+	"""
+
+	atype = atype.upper()
+
+	if atype == 'MIN':
+		return [[row[0], row[1]] for row in rows]
+	elif atype == 'MAX':
+		return [[row[0], row[2]] for row in rows]
+	elif atype == 'SUM':
+		return [[row[0], row[3]] for row in rows]
+
+	points = [[row[0], row[3], row[4]] for row in rows]
+
+	if len(points) > 1 and (interval or (max_points and len(points) >= max_points)):
+		points = aggregate(points, start=start, stop=stop, max_points=max_points, interval=interval, agfn=rmean, roundtime=roundtime, timezone=timezone)
+		return [point for point in points if point[1] is not None]
+
+	return [[point[0], point[1] / float(point[2])] for point in points]
+
+def rmean(points):
+	"""
+		Mean of points of [timestamp, sum, count].
+	"""
+
+	return round(float(sum([point[1] for point in points]) / float(sum([point[2] for point in points]))), 3)
 
 ### aggregation serie function
 def consolidation(series, fn, interval=None):
@@ -5,9 +5,20 @@ sys.path.append("../pyperfstore2/")
 import unittest
 
 import datetime, time
+import random
 
+import utils
 from utils import MN, HR, D, W, M, Y, roundTime, getTimeSteps
 
+numpy = utils.numpy
+
+ATYPES = ['MEAN', 'FIRST', 'LAST', 'MIN', 'MAX', 'SUM', 'DELTA']
+
+def random_points(count, interval=60, fn=random.random):
+	start = int(time.time()) - count * interval
+	timestamps = sorted([start + random.randint(0, count * interval) for i in xrange(count)])
+	return [[timestamp, fn()] for timestamp in timestamps]
+
 class AggregationTest(unittest.TestCase):
 
 	def setUp(self):		
@@ -72,8 +83,84 @@ class AggregationTest(unittest.TestCase):
 
 		pass
 
+	def testFixedTimeSteps(self):
+		stop_date = int(time.time())
+
+		for interval in [MN, 5*MN, HR, D, W]:
+			for start_date in [stop_date - interval * 10, stop_date - interval * 10 + 1, stop_date - interval / 2]:
+				timeSteps = getTimeSteps(start_date, stop_date, interval)
+
+				self.assertEqual(timeSteps[-1], utils.calendar.timegm(roundTime(datetime.datetime.utcfromtimestamp(stop_date), interval).timetuple()))
+				self.assertTrue(timeSteps[0] <= start_date < timeSteps[0] + interval)
+				self.assertEqual(timeSteps, range(timeSteps[0], timeSteps[-1] + 1, interval))
+
 	def testAggregate(self):
-		pass
+		fns = [random.random, lambda: random.randint(0, 100), lambda: round(random.random() * 100, 2)]
+
+		for i in xrange(50):
+			points = random_points(random.choice([2, 10, 1000]), fn=random.choice(fns))
+			start = points[0][0] - random.randint(0, HR)
+			stop = points[-1][0] + random.randint(0, HR)
+
+			for atype in ATYPES:
+				for interval in [None, 5*MN, HR, D]:
+					for fill in [True, False]:
+						kargs = dict(start=start, stop=stop, interval=interval, max_points=50, atype=atype, fill=fill)
+
+						utils.numpy = None
+						expected = utils.aggregate([list(point) for point in points], **kargs)
+						utils.numpy = numpy
+
+						if numpy:
+							result = utils.aggregate([list(point) for point in points], **kargs)
+							self.assertEqual(result, expected)
+
+							timestamps, values = utils.get_arrays(points)
+							result = utils.aggregate_arrays(timestamps, values, **kargs)
+							self.assertEqual(result, expected)
+
+	def testParseDst(self):
+		fns = [lambda: random.randint(0, 100), lambda: random.random() * 100, lambda: random.choice([0, 1.5, -2, 3])]
+
+		for i in xrange(200):
+			points = random_points(random.choice([1, 2, 10, 100]), interval=random.choice([1, 60]), fn=random.choice(fns))
+			first_points = [[], [points[0][0] - 60, random.randint(0, 100)], [points[0][0], None], [0, 10]]
+
+			for dtype in ['DERIVE', 'COUNTER', 'ABSOLUTE', 'GAUGE']:
+				for first_point in first_points:
+					utils.numpy = None
+					expected = utils.parse_dst([list(point) for point in points], dtype, first_point)
+					utils.numpy = numpy
+
+					result = utils.parse_dst([list(point) for point in points], dtype, first_point)
+					self.assertEqual(result, expected)
+
+		# None values
+		points = [[1, 10], [2, None], [3, 30], [4, 35]]
+		self.assertEqual(utils.parse_dst(points, 'DERIVE'), [[2, None], [3, 10.0], [4, 17.5]])
+
+	def testRollup(self):
+		points = random_points(1000, fn=lambda: random.randint(0, 100))
+		rows = utils.rollup(points, 5*MN)
+
+		self.assertEqual(sum([row[4] for row in rows]), len(points))
+		self.assertEqual(utils.merge_rollups(utils.rollup(points[:500], 5*MN), utils.rollup(points[500:], 5*MN)), rows)
+
+		# Rollup points aggregate as raw points on aligned intervals
+		for atype in utils.ROLLUP_ATYPES:
+			for interval in [5*MN, HR]:
+				rpoints = utils.get_rollup_points(utils.merge_rollups(rows), atype, points[0][0], points[-1][0], interval=interval, timezone=0)
+				self.assertEqual(
+					utils.aggregate(rpoints, start=points[0][0], stop=points[-1][0], interval=interval, atype=atype, timezone=0),
+					utils.aggregate(points, start=points[0][0], stop=points[-1][0], interval=interval, atype=atype, timezone=0))
+
+		# Means of rows with uneven counts
+		points = [[i, 10] for i in range(30)] + [[5*MN, 100]]
+		rows = utils.rollup(points, 5*MN)
+		rpoints = utils.get_rollup_points(rows, 'MEAN', 0, HR - 1, interval=HR, timezone=0)
+
+		self.assertEqual(utils.aggregate(rpoints, start=0, stop=HR - 1, interval=HR, atype='MEAN', timezone=0), [[0, 12.9]])
+		self.assertEqual(utils.aggregate(points, start=0, stop=HR - 1, interval=HR, atype='MEAN', timezone=0), [[0, 12.9]])
 
 if __name__ == "__main__":
 	unittest.main()
\ No newline at end of file
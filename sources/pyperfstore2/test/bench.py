@@ -18,6 +18,7 @@
 # along with Canopsis.  If not, see <http://www.gnu.org/licenses/>.
 # ---------------------------------
 
+import sys
 import time
 import random
 import logging
@@ -34,7 +35,11 @@ interval = 300
 day = 30
 
 name = 'nagios.Central.check.service.localhost'
-manager = pyperfstore2.manager(mongo_collection='bench_perfdata2')
+# Binaries backend to bench: 'gridfs' or 'document'
+bin_backend = sys.argv[1] if len(sys.argv) > 1 else 'document'
+print "Binaries backend: %s" % bin_backend
+
+manager = pyperfstore2.manager(mongo_collection='bench_perfdata2', bin_backend=bin_backend)
 manager.store.drop()
 
 def bench_store(interval=60, duration=60*60*24):
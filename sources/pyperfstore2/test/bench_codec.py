@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+#--------------------------------
+# Copyright (c) 2011 "Capensis" [http://www.capensis.com]
+#
+# This file is part of Canopsis.
+#
+# Canopsis is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canopsis is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Canopsis.  If not, see <http://www.gnu.org/licenses/>.
+# ---------------------------------
+
+import sys
+
+sys.path.append("../pyperfstore2/")
+
+import time
+import random
+
+import codec
+
+# One month of 1 minute points
+nb = 60 * 24 * 30
+fts = int(time.time())
+
+def serie(fn):
+	return [[fts + i * 60 + random.choice([0] * 20 + [1, -1]), fn(i)] for i in xrange(nb)]
+
+walk = [50.0]
+def random_walk(i):
+	walk[0] = max(0.0, walk[0] + random.gauss(0, 1))
+	return round(walk[0], 2)
+
+series = {
+	'state': serie(lambda i: random.choice([0] * 50 + [1, 2])),
+	'counter': serie(lambda i: i * 1500 + random.randint(0, 100)),
+	'percent': serie(random_walk),
+	'load': serie(lambda i: random.random() * 10),
+}
+
+def bench(fn, *args):
+	start = time.time()
+	for i in xrange(5):
+		result = fn(*args)
+	return result, (time.time() - start) / 5
+
+def bench_codec(name, points):
+	print "%s (%s points):" % (name, len(points))
+
+	raw = len(points) * 16.0
+
+	for version, fn_decode in [(codec.VERSION_MSGPACK, codec.decode_points), (codec.VERSION_COLUMNAR, codec.decode_points), (codec.VERSION_COLUMNAR, codec.decode), (codec.VERSION_BLOCKS, codec.decode)]:
+		data, encode_time = bench(codec.encode, points, codec.ZLIB_LEVEL, version)
+		result, decode_time = bench(fn_decode, data)
+
+		print "  + v%s %-13s %8s B (ratio %5.2f), encode %6.1f ms, decode %6.1f ms (%s points/s)" % (
+			version, fn_decode.__name__, len(data), raw / len(data),
+			encode_time * 1000, decode_time * 1000, int(len(points) / decode_time))
+
+	# Last hour only
+	tstart = points[-1][0] - 3600
+	for version in [codec.VERSION_COLUMNAR, codec.VERSION_BLOCKS]:
+		data = codec.encode(points, codec.ZLIB_LEVEL, version)
+		result, decode_time = bench(codec.decode, data, tstart)
+
+		print "  + v%s %-13s last hour, decode %6.1f ms (%s points)" % (
+			version, 'decode', decode_time * 1000, len(result[0]))
+
+for name in sorted(series):
+	bench_codec(name, series[name])
+
+print ""
+print "Without NumPy:"
+codec.numpy = None
+
+for name in sorted(series):
+	bench_codec(name, series[name])
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#--------------------------------
+# Copyright (c) 2011 "Capensis" [http://www.capensis.com]
+#
+# This file is part of Canopsis.
+#
+# Canopsis is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Canopsis is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Canopsis.  If not, see <http://www.gnu.org/licenses/>.
+# ---------------------------------
+
+# Plain points in Redis: list of 'timestamp|value' items against packed records.
+# Needs a running Redis, uses and flushes its db 1.
+
+import sys
+
+sys.path.append("../pyperfstore2/")
+
+import time
+import random
+
+import redis
+
+import codec
+
+# Keys of one day of 1 minute points
+nb_keys = 1000
+nb = 60 * 24
+fts = int(time.time())
+
+db = redis.StrictRedis(db=1)
+
+def serie():
+	value = random.choice([lambda i: random.randint(0, 2), lambda i: round(random.random() * 100, 2)])
+	return [[fts + i * 60, value(i)] for i in xrange(nb)]
+
+def write_list(pipe, key, points):
+	for point in points:
+		pipe.rpush(key, '%s|%s' % (point[0], point[1]))
+
+def write_packed(pipe, key, points):
+	# Appended as pushed
+	for point in points:
+		pipe.append(key, codec.pack_points([point]))
+
+def read_list(key):
+	return codec.parse_points(db.lrange(key, 0, -1))
+
+def read_packed(key):
+	return codec.unpack_points(db.get(key))
+
+def last_list(key):
+	return codec.parse_points([db.lindex(key, -1)])
+
+def last_packed(key):
+	return codec.unpack_points(db.getrange(key, -codec.POINT.size, -1))
+
+def bench(name, write, read, last, series):
+	db.flushdb()
+	memory = db.info()['used_memory']
+
+	pipe = db.pipeline(transaction=False)
+	for index, points in enumerate(series):
+		write(pipe, index, points)
+		pipe.execute()
+
+	memory = db.info()['used_memory'] - memory
+
+	start = time.time()
+	for index, points in enumerate(series):
+		assert read(index) == points
+	read_time = (time.time() - start) / len(series)
+
+	start = time.time()
+	for index, points in enumerate(series):
+		assert last(index) == points[-1:]
+	last_time = (time.time() - start) / len(series)
+
+	print "%-7s %7.2f MB (%5.1f B/point), read %6.2f ms/key, last point %5.3f ms/key" % (
+		name, memory / 1024.0 / 1024.0, memory / float(nb * nb_keys),
+		read_time * 1000, last_time * 1000)
+
+series = [serie() for i in xrange(nb_keys)]
+
+print "%s keys of %s points:" % (nb_keys, nb)
+bench('list', write_list, read_list, last_list, series)
+bench('packed', write_packed, read_packed, last_packed, series)
+
+db.flushdb()
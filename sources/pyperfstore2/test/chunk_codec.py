@@ -0,0 +1,139 @@
+import sys
+
+sys.path.append("../pyperfstore2/")
+
+import unittest
+
+import random
+
+import codec
+
+numpy = codec.numpy
+
+def points_int(count, fts=1356000000, interval=300):
+	return [[fts + i * interval + random.choice([0, 0, 0, 1, -1]), random.randint(0, 100)] for i in xrange(count)]
+
+def points_float(count, fts=1356000000, interval=300):
+	return [[fts + i * interval, round(random.random() * 10, 2)] for i in xrange(count)]
+
+class CodecTest(unittest.TestCase):
+
+	def tearDown(self):
+		codec.numpy = numpy
+
+	def check(self, points):
+		data = codec.encode(points)
+
+		if len(points) > codec.BLOCK_SIZE:
+			self.assertEqual(codec.get_version(data), codec.VERSION_BLOCKS)
+		else:
+			self.assertEqual(codec.get_version(data), codec.VERSION_COLUMNAR)
+
+		self.assertEqual(codec.decode_points(data), points)
+		self.assertEqual(codec.get_count(data), len(points))
+
+		timestamps, values = codec.decode(data)
+		self.assertEqual(list(timestamps), [point[0] for point in points])
+		self.assertEqual(list(values), [point[1] for point in points])
+
+		return data
+
+	def test_01_Int(self):
+		self.check(points_int(1))
+		self.check(points_int(1000))
+		self.check([[1, -2 ** 60], [2, 2 ** 60], [3, 0]])
+
+	def test_02_Float(self):
+		self.check(points_float(1))
+		self.check(points_float(1000))
+		self.check([[1, 0.1], [2, -1e300], [3, float('inf')], [4, 1.0]])
+
+	def test_02_Decimal(self):
+		points = [[fts, round(value / 3.0, 2)] for fts, value in points_int(100)]
+		data = self.check(points)
+		self.assertEqual(data[1], codec.TYPE_DECIMAL)
+
+		self.check([[1, 0.1], [2, 0.25], [3, -12.125]])
+
+	def test_03_Array(self):
+		codec.numpy = None
+		self.test_01_Int()
+		self.test_02_Float()
+		self.test_02_Decimal()
+		self.test_07_Blocks()
+		self.test_08_Plain()
+
+		# Chunks are portable between both decoders
+		points = points_float(100)
+		data = codec.encode(points)
+		codec.numpy = numpy
+		self.assertEqual(codec.decode_points(data), points)
+
+	def test_04_Legacy(self):
+		points = points_float(100)
+		data = codec.encode(points, version=codec.VERSION_MSGPACK)
+
+		self.assertEqual(codec.get_version(data), codec.VERSION_MSGPACK)
+		self.assertEqual(codec.decode_points(data), points)
+
+		timestamps, values = codec.decode(data)
+		self.assertEqual(list(values), [point[1] for point in points])
+
+	def test_05_Fallback(self):
+		# Columns only hold integer timestamps and numeric values
+		for points in [[[1.5, 1], [2, 2]], [[1, 1], [2, 2 ** 62]]]:
+			data = codec.encode(points)
+			self.assertEqual(codec.get_version(data), codec.VERSION_MSGPACK)
+			self.assertEqual(codec.decode_points(data), points)
+
+	def test_06_Rollup(self):
+		rows = [[0, 1, 5, 12, 4], [300, 0.5, 2.5, 3.25, 2], [900, -1, 2 ** 40, 2 ** 40, 3]]
+		self.assertEqual(codec.decode_rollup(codec.encode_rollup(rows)), rows)
+
+	def test_07_Blocks(self):
+		points = points_int(codec.BLOCK_SIZE * 3 + 100)
+		data = codec.encode(points)
+		self.assertEqual(len(codec.get_blocks(data)), 4)
+		self.check(points)
+
+		fts = points[0][0]
+		lts = points[-1][0]
+
+		for tstart, tstop in [(None, None), (fts + 30000, fts + 90000), (fts + 180000, None), (None, fts), (lts + 1, None)]:
+			result = codec.decode_points(data, tstart, tstop)
+			inside = [point for point in points if (tstart is None or point[0] >= tstart) and (tstop is None or point[0] <= tstop)]
+
+			# Whole blocks are decoded
+			self.assertEqual([point for point in result if point in inside], inside)
+			self.assertTrue(len(result) < len(inside) + 2 * codec.BLOCK_SIZE)
+
+		self.assertEqual(codec.decode_points(data, lts + 1), [])
+		self.assertEqual(len(codec.decode_points(data, None, fts)), codec.BLOCK_SIZE)
+
+		# Small chunks are written in one block
+		self.assertEqual(codec.get_version(codec.encode(points[:codec.BLOCK_SIZE])), codec.VERSION_COLUMNAR)
+
+		rows = [[i * 300, i, i, i, 1] for i in xrange(codec.BLOCK_SIZE * 2)]
+		self.assertEqual(codec.decode_rollup(codec.encode_rollup(rows), 3000, 3300), rows[:codec.BLOCK_SIZE])
+
+	def test_08_Plain(self):
+		points = points_int(100) + points_float(100) + [[1, 2 ** 60], [2, -0.0], [3, float('inf')]]
+		data = codec.pack_points(points)
+
+		self.assertEqual(len(data), len(points) * codec.POINT.size)
+		self.assertEqual(codec.unpack_points(data), points)
+		self.assertEqual(codec.unpack_points(data[-codec.POINT.size:]), points[-1:])
+		self.assertEqual(codec.unpack_points(''), [])
+
+		# Integral values are given back as int
+		self.assertEqual([type(point[1]) for point in codec.unpack_points(codec.pack_points([[1, 2.0], [2, 2.5]]))], [int, float])
+
+		items = ['%s|%s' % (timestamp, value) for timestamp, value in points]
+		self.assertEqual(codec.parse_points(items), points)
+
+	def test_09_Invalid(self):
+		self.assertRaises(ValueError, codec.decode, '')
+		self.assertRaises(ValueError, codec.decode, '\x05')
+
+if __name__ == "__main__":
+	unittest.main(verbosity=2)
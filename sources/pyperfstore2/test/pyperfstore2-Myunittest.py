@@ -28,6 +28,8 @@ logging.basicConfig(level=logging.INFO,
 )
 
 import pyperfstore2
+import pyperfstore2.codec
+import pyperfstore2.known
 manager = None
 name = 'nagios.Central.check.service.localhost9.ping'
 component = 'localhost9'
@@ -85,13 +87,34 @@ class KnownValues(unittest.TestCase):
 		if data.count() != 1:
 			raise Exception('Invalid meta count')
 			
-		if len(data[0].get('c', [])) != 1:
+		if manager.store.find_chunks(data[0]['_id']).count() != 1:
 			raise Exception('Invalid rotation')
 			
 		data = manager.find(name=name, limit=1, data=False)
 		if data.get('d', None):
 			raise Exception('Data field is present')
 
+	def test_06_Plain_migration(self):
+		_id = 'unittest_plain'
+
+		# List format
+		manager.store.redis.rpush(_id, '1|10', '2|10.5')
+
+		if manager.get_data(_id) != [[1, 10], [2, 10.5]]:
+			raise Exception('Invalid list format points')
+
+		manager.store.append(_id, pyperfstore2.codec.pack_points([[3, 11]]))
+
+		if manager.store.redis.type(_id) != 'string':
+			raise Exception('Points not packed')
+
+		if manager.get_data(_id) != [[1, 10], [2, 10.5], [3, 11]]:
+			raise Exception('Invalid packed points')
+
+		if manager.get_data(_id, 1) != [[3, 11]]:
+			raise Exception('Invalid last points')
+
+		manager.store.redis.delete(_id)
 			
 	def test_07_Get_points(self):
 		points = manager.get_points(name=name, tstart=ut_start, tstop=stop)
@@ -172,12 +195,84 @@ class KnownValues(unittest.TestCase):
 		if len(points) != 120:
 			raise Exception('Invalid count %s' % len(points))	
 		
+	def test_12_Rollup(self):
+		_id = manager.get_id(name=name)
+		if not manager.store.find_chunks(_id, tier=300).count():
+			raise Exception('Rollups not built')
+
+		raw_points = manager.get_points(name=name, tstart=ut_start, tstop=stop)
+
+		for atype in ['MAX', 'MEAN']:
+			expected = pyperfstore2.utils.aggregate(raw_points, start=ut_start, stop=stop, interval=300, atype=atype, timezone=0)
+
+			points = manager.get_points(name=name, tstart=ut_start, tstop=stop, interval=300, atype=atype, timezone=0)
+			result = pyperfstore2.utils.aggregate(points, start=ut_start, stop=stop, interval=300, atype=atype, timezone=0)
+
+			if result != expected:
+				raise Exception('Invalid %s rollup points: %s != %s' % (atype, result, expected))
+
+	def test_13_Bin_backends(self):
+		_id = manager.get_id(name=name)
+		points = manager.get_points(name=name, tstart=ut_start, tstop=stop)
+
+		# Move binaries to GridFS
+		gridfs_store = pyperfstore2.store(mongo_collection='unittest_perfdata2', redis_db=1, bin_backend='gridfs')
+		chunks = list(manager.store.find_chunks(_id, tier=None, data=True))
+		gridfs_store.put_chunks([dict(chunk, data=manager.store.get_chunk(chunk)) for chunk in chunks])
+
+		if manager.store.chunks.find({'data': {'$exists': True}}).count():
+			raise Exception('Binaries not in GridFS')
+
+		if manager.get_points(name=name, tstart=ut_start, tstop=stop) != points:
+			raise Exception('Invalid points from GridFS')
+
+		while manager.store.migrate_bins(limit=2):
+			pass
+
+		if manager.store.chunks.find({'data': {'$exists': False}}).count():
+			raise Exception('Binaries not migrated')
+
+		if manager.get_points(name=name, tstart=ut_start, tstop=stop) != points:
+			raise Exception('Invalid points after migration')
+
+	def test_14_Known_series(self):
+		_id = manager.get_id(name=name)
+
+		# Known series don't upsert their meta
+		manager.store.update(_id=_id, mset={'u': 'unknown'})
+		manager.push(name=name, value=1, timestamp=stop, meta_data=meta_data)
+
+		if manager.get_meta(_id=_id, raw=True)['u'] != 'unknown':
+			raise Exception('Meta upserted for a known series')
+
+		manager.push(name=name, value=1, timestamp=stop, meta_data=dict(meta_data, unit='ms'))
+
+		if manager.get_meta(_id=_id, raw=True)['u'] != 'ms':
+			raise Exception('Changed meta not upserted')
+
+		# Forgotten by other stores
+		signature = pyperfstore2.known.get_signature(manager.get_meta(_id=_id, raw=True))
+
+		other = pyperfstore2.store(mongo_collection='unittest_perfdata2', redis_db=1)
+		if not other.warm_known() or (_id, signature) not in other.known:
+			raise Exception('Known series not warmed')
+
+		manager.store.forget([_id])
+		time.sleep(0.1)
+		other.check_forgotten()
+
+		if (_id, signature) in other.known:
+			raise Exception('Series not forgotten')
+
 	def test_97_Remove(self):
 		manager.remove(name=name)
 		meta = manager.get_meta(name=name)
 		
 		if meta:
 			raise Exception('Impossible to delete')
+
+		if manager.store.find_chunks(manager.get_id(name=name), tier=None).count():
+			raise Exception('Chunks not deleted')
 			
 	def test_98_Add_Data_after_purge(self):
 		_id = manager.get_id(name=name)
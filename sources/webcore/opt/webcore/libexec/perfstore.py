@@ -40,6 +40,7 @@ import pyperfstore2.utils
 
 from cstorage import get_storage
 from caccount import caccount
+from ceventlog import ceventlog
 
 storage = get_storage(namespace='object', account=caccount(user="root", group="root"))
 
@@ -602,22 +603,17 @@ def perfstore_perftop(start=None, stop=None):
 
 		# Calculate most recurrent output
 		if get_output:
-			logs = get_storage(namespace='events_log', account=get_account())
+			account = get_account()
+			logs = ceventlog(storage=get_storage(namespace='events_log', account=account))
 
 			for item in data:
-				evfilter = {'$and': [
-					{
-						'component': item['co'],
-						'resource': item.get('re', {'$exists': False}),
-						'state': {'$ne': 0}
-					},{
-						'timestamp': {'$gt': start}
-					},{
-						'timestamp': {'$lt': stop}
-					}
-				]}
-
-				records = logs.find(evfilter)
+				evfilter = {
+					'component': item['co'],
+					'resource': item.get('re', {'$exists': False}),
+					'state': {'$ne': 0}
+				}
+
+				records = logs.find(evfilter, start=start, stop=stop, sort=None, account=account)
 
 				outputs = {}
 
@@ -753,7 +749,12 @@ def perfstore_get_values(_id, start=None, stop=None, aggregate_method=None, aggr
 													tstart=start,
 													tstop=stop,
 													return_meta=True,
-													subset_selection=subset_selection)
+													subset_selection=subset_selection,
+													max_points=aggregate_max_points,
+													interval=aggregate_interval,
+													atype=aggregate_method,
+													roundtime=aggregate_round_time,
+													timezone=timezone)
 			# Computes exclusion on metric point(s)
 			points = exclude_points(points, subset_selection)
 
@@ -28,6 +28,7 @@ from caccount import caccount
 from cstorage import cstorage
 from cstorage import get_storage
 from crecord import crecord
+from ceventlog import ceventlog
 import base64
 from ctools import clean_mfilter
 
@@ -36,6 +37,9 @@ from libexec.auth import get_account ,check_group_rights
 
 logger = logging.getLogger("rest")
 
+# Seconds a total is reused when paging
+TOTAL_TTL = 30
+
 ctype_to_group_access = {
 							'schedule' : 'group.CPS_schedule_admin',
 							'curve' : 'group.CPS_curve_admin',
@@ -165,6 +169,7 @@ def rest_get(namespace, ctype=None, _id=None, params=None):
 	onlyWritable	= params.get('onlyWritable', default=False)
 	noInternal	= params.get('noInternal', default=False)
 	ids			= params.get('ids', default=[])
+	search_after	= params.get('search_after', default=None)
 
 	get_id			= request.params.get('_id', default=None)
 
@@ -179,6 +184,13 @@ def rest_get(namespace, ctype=None, _id=None, params=None):
 		except Exception, err:
 			logger.error("Impossible to decode ids: %s: %s" % (ids, err))
 
+	if search_after:
+		try:
+			search_after = json.loads(search_after)
+		except Exception, err:
+			logger.error("Impossible to decode search_after: %s: %s" % (search_after, err))
+			search_after = None
+
 	if filter:
 		try:
 			filter = json.loads(filter)
@@ -208,6 +220,7 @@ def rest_get(namespace, ctype=None, _id=None, params=None):
 	logger.debug(" + Limit: "+str(limit))
 	logger.debug(" + Page: "+str(page))
 	logger.debug(" + Start: "+str(start))
+	logger.debug(" + Search after: "+str(search_after))
 	logger.debug(" + Groups: "+str(groups))
 	logger.debug(" + onlyWritable: "+str(onlyWritable))
 	logger.debug(" + Sort: "+str(sort))
@@ -271,7 +284,19 @@ def rest_get(namespace, ctype=None, _id=None, params=None):
 		#clean mfilter
 		mfilter = clean_mfilter(mfilter)
 
-		records, total = storage.find(mfilter, sort=msort, limit=limit, offset=start, account=account, with_total=True)
+		# Next pages reuse the total counted for the first one
+		if start or search_after is not None:
+			total_ttl = TOTAL_TTL
+		else:
+			total_ttl = 0
+
+		if namespace == 'events_log':
+			# Logs may be written in time partitions
+			finder = ceventlog(storage=storage)
+		else:
+			finder = storage
+
+		records, total = finder.find(mfilter, sort=msort, limit=limit, offset=start, account=account, with_total=True, search_after=search_after, total_ttl=total_ttl)
 
 	output = []
 
@@ -308,6 +333,10 @@ def rest_get(namespace, ctype=None, _id=None, params=None):
 
 	output={'total': total, 'success': True, 'data': output}
 
+	# Keyset of the next page
+	if records and not ids:
+		output['search_after'] = storage.get_search_after(records[-1], msort)
+
 	return output
 
 @get('/rest/:namespace/:ctype/:_id')